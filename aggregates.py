@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Agregados pré-calculados sobre os arquivos Parquet, para o dashboard.
+
+Após a conversão, cada agregado de AGGREGATES é calculado lote a lote
+(group_by do Arrow, sem pandas) e gravado como um Parquet pequeno em
+`parquet/_aggregates/<nome>.parquet`, junto com o resumo das tabelas
+(`tabelas.parquet`). O dashboard lê apenas esses arquivos.
+"""
+import os
+import logging
+import argparse
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from parquet_dataset import MONTH_PATTERN, table_path, parquet_files, open_dataset
+
+logger = logging.getLogger(__name__)
+
+PARQUET_DIR = 'parquet'
+AGGREGATES_DIRNAME = '_aggregates'
+SUMMARY_NAME = 'tabelas'
+
+# Agregado: (tabela, colunas de agrupamento, tabela de descrições da primeira coluna)
+# 'mes_inicio_atividade' é derivada de data_inicio_atividade (AAAA-MM).
+AGGREGATES = {
+    'estabelecimentos_por_uf': ('estabelecimentos', ['uf'], None),
+    'estabelecimentos_por_municipio': ('estabelecimentos', ['municipio', 'uf'], 'municipios'),
+    'estabelecimentos_por_cnae': ('estabelecimentos', ['cnae_fiscal_principal'], 'cnaes'),
+    'estabelecimentos_por_situacao': ('estabelecimentos', ['situacao_cadastral'], None),
+    'aberturas_por_mes': ('estabelecimentos', ['mes_inicio_atividade'], None),
+    'empresas_por_porte': ('empresas', ['porte_empresa'], None),
+}
+
+SITUACAO_ATIVA = '02'
+
+
+def aggregates_dir(parquet_dir=PARQUET_DIR):
+    """Diretório dos agregados de uma pasta Parquet"""
+    return os.path.join(parquet_dir, AGGREGATES_DIRNAME)
+
+
+def _as_string(array):
+    """Coluna como texto (códigos em dicionário, inteiros etc.)"""
+    return array.cast(pa.string()) if not pa.types.is_string(array.type) else array
+
+
+def _year_month(array):
+    """AAAA-MM de uma coluna de data (date32 ou texto AAAAMMDD)"""
+    if pa.types.is_date(array.type):
+        return pc.strftime(array, format='%Y-%m')
+    array = _as_string(array)
+    valid = pc.fill_null(pc.match_substring_regex(array, r'^\d{8}$'), False)
+    months = pc.binary_join_element_wise(pc.utf8_slice_codeunits(array, 0, 4),
+                                         pc.utf8_slice_codeunits(array, 4, 6), '-')
+    return pc.if_else(valid, months, pa.scalar(None, pa.string()))
+
+
+def _group_columns(batch, columns):
+    """Colunas de agrupamento de um lote, como texto"""
+    arrays = {}
+    for column in columns:
+        if column == 'mes_inicio_atividade':
+            arrays[column] = _year_month(batch.column('data_inicio_atividade'))
+        else:
+            arrays[column] = _as_string(batch.column(column))
+    return arrays
+
+
+def _source_columns(table_name, columns):
+    """Colunas lidas da tabela para calcular um agregado"""
+    names = ['data_inicio_atividade' if column == 'mes_inicio_atividade' else column for column in columns]
+    if table_name == 'estabelecimentos':
+        names.append('situacao_cadastral')
+    return list(dict.fromkeys(names))
+
+
+def _count_batch(batch, table_name, columns):
+    """Contagens de um lote, agrupadas pelas colunas"""
+    arrays = _group_columns(batch, columns)
+    arrays['total'] = np.ones(batch.num_rows, dtype=np.int64)
+    aggregations = [('total', 'sum')]
+    if table_name == 'estabelecimentos':
+        situacao = _as_string(batch.column('situacao_cadastral'))
+        arrays['ativos'] = pc.cast(pc.fill_null(pc.equal(situacao, SITUACAO_ATIVA), False), pa.int64())
+        aggregations.append(('ativos', 'sum'))
+    return pa.table(arrays).group_by(columns).aggregate(aggregations)
+
+
+def _descriptions(parquet_dir, table_name):
+    """Tabela (codigo, descricao) de uma tabela de domínio, ou None se ela não existir"""
+    path = table_path(parquet_dir, table_name)
+    if path is None:
+        return None
+    table = open_dataset(path).to_table(columns=['codigo', 'descricao'])
+    return pa.table({'codigo': _as_string(table.column('codigo')), 'descricao': _as_string(table.column('descricao'))})
+
+
+def _finish(partials, columns, descriptions):
+    """Soma as contagens parciais dos lotes e acrescenta as descrições dos códigos"""
+    counts = [column for column in partials[0].column_names if column not in columns]
+    result = pa.concat_tables(partials).group_by(columns).aggregate([(column, 'sum') for column in counts])
+    result = result.rename_columns([column[:-len('_sum_sum')] if column.endswith('_sum_sum') else column
+                                    for column in result.column_names])
+    result = result.select(columns + [column for column in result.column_names if column not in columns])
+    if descriptions is not None:
+        positions = pc.index_in(result.column(columns[0]), value_set=descriptions.column('codigo'))
+        result = result.append_column('descricao', descriptions.column('descricao').take(positions))
+    return result.sort_by([('total', 'descending')] + [(column, 'ascending') for column in columns])
+
+
+def compute_aggregates(parquet_dir, names=None):
+    """
+    Calcula os agregados (por padrão todos de AGGREGATES) lendo cada tabela
+    de origem uma única vez; retorna {agregado: tabela}. Agregados cuja
+    tabela de origem não existe ficam de fora.
+    """
+    names = list(names or AGGREGATES)
+    results = {}
+    for table_name in dict.fromkeys(AGGREGATES[name][0] for name in names):
+        path = table_path(parquet_dir, table_name)
+        if path is None:
+            logger.warning(f"Tabela '{table_name}' não encontrada: agregados dela não calculados.")
+            continue
+        table_names = [name for name in names if AGGREGATES[name][0] == table_name]
+        columns = list(dict.fromkeys(column for name in table_names
+                                     for column in _source_columns(table_name, AGGREGATES[name][1])))
+        partials = {name: [] for name in table_names}
+        for batch in open_dataset(path).to_batches(columns=columns):
+            if batch.num_rows:
+                for name in table_names:
+                    partials[name].append(_count_batch(batch, table_name, AGGREGATES[name][1]))
+        for name in table_names:
+            if partials[name]:
+                _, group_columns, lookup = AGGREGATES[name]
+                descriptions = _descriptions(parquet_dir, lookup) if lookup else None
+                results[name] = _finish(partials[name], group_columns, descriptions)
+    return results
+
+
+def table_summary(parquet_dir):
+    """Linhas, colunas e tamanho de cada tabela Parquet, lidos só dos metadados"""
+    rows = []
+    for name in sorted(os.listdir(parquet_dir)):
+        if name.startswith('_') or MONTH_PATTERN.match(name):
+            continue
+        table_name = name[:-len('.parquet')] if name.endswith('.parquet') else name
+        path = table_path(parquet_dir, table_name) if '.' not in table_name else None
+        if path is None:
+            continue
+        files = parquet_files(path)
+        metadatas = [pq.read_metadata(file_path) for file_path in files]
+        rows.append({
+            'tabela': table_name,
+            'registros': sum(metadata.num_rows for metadata in metadatas),
+            'colunas': metadatas[0].num_columns,
+            'colunas_disponiveis': ', '.join(metadatas[0].schema.to_arrow_schema().names),
+            'arquivos': len(files),
+            'tamanho_bytes': sum(os.path.getsize(file_path) for file_path in files),
+        })
+    return pa.Table.from_pylist(rows, schema=pa.schema([
+        ('tabela', pa.string()), ('registros', pa.int64()), ('colunas', pa.int64()),
+        ('colunas_disponiveis', pa.string()), ('arquivos', pa.int64()), ('tamanho_bytes', pa.int64()),
+    ]))
+
+
+def _write(table, path):
+    """Grava um agregado de forma atômica"""
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path, compression='snappy')
+    os.replace(tmp_path, path)
+
+
+def build_aggregates(parquet_dir=PARQUET_DIR, names=None):
+    """
+    Calcula e grava os agregados (por padrão todos de AGGREGATES) e o resumo
+    das tabelas; retorna {agregado: linhas}.
+    """
+    output_dir = aggregates_dir(parquet_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info("--- Calculando agregados ---")
+    totals = {}
+    for name, result in compute_aggregates(parquet_dir, names).items():
+        _write(result, os.path.join(output_dir, f'{name}.parquet'))
+        totals[name] = result.num_rows
+        logger.info(f"Agregado '{name}': {result.num_rows} linhas.")
+    summary = table_summary(parquet_dir)
+    _write(summary, os.path.join(output_dir, f'{SUMMARY_NAME}.parquet'))
+    totals[SUMMARY_NAME] = summary.num_rows
+    return totals
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="Calcula os agregados usados pelo dashboard.")
+    parser.add_argument('--parquet-dir', default=PARQUET_DIR)
+    parser.add_argument('--names', nargs='+', choices=sorted(AGGREGATES), help="agregados a calcular (padrão: todos)")
+    args = parser.parse_args()
+    build_aggregates(args.parquet_dir, args.names)
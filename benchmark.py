@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark do pipeline com dados sintéticos do CNPJ.
+
+Gera arquivos EMPRECSV, ESTABELE e SOCIOCSV no formato da Receita (latin-1,
+separados por ';', com aspas e as colunas de metadata.LAYOUTS), compacta em
+ZIPs, serve-os por um servidor HTTP local no lugar do site da Receita e mede
+cada etapa: download, extração, leitura do CSV, gravação do Parquet, carga
+no SQLite e busca por CNPJ. O resultado (linhas/s, MB/s e pico de memória
+de cada etapa) é gravado em JSON para comparar execuções:
+
+    python benchmark.py --rows 1000000 --output atual.json
+    python benchmark.py --rows 1000000 --compare base.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from metadata import LAYOUTS
+from instrumentation import peak_rss, reset_peak_rss
+
+logger = logging.getLogger(__name__)
+
+ROWS = 100000  # Empresas geradas por padrão
+CHUNK_ROWS = 200000  # Linhas geradas por vez
+LOOKUPS = 1000  # Buscas por CNPJ medidas
+MONTH = '2024-01'
+TOLERANCE = 0.10  # Aumento de tempo tolerado ao comparar com uma execução anterior
+
+# Tabela: (tipo do arquivo, prefixo do ZIP, linhas por empresa)
+TABLES = {
+    'empresas': ('EMPRECSV', 'Empresas', 1.0),
+    'estabelecimentos': ('ESTABELE', 'Estabelecimentos', 1.2),
+    'socios': ('SOCIOCSV', 'Socios', 0.5),
+}
+
+WORDS = ['PADARIA', 'COMERCIO', 'SERVIÇOS', 'CONSTRUÇÕES', 'AÇAÍ', 'TRANSPORTES', 'INDÚSTRIA',
+         'SÃO', 'JOÃO', 'MARIA', 'SILVA', 'SOUZA', 'OLIVEIRA', 'SANTOS', 'BRASIL', 'NORTE',
+         'TECNOLOGIA', 'ALIMENTOS', 'CONSULTORIA', 'MÓVEIS', 'FARMÁCIA', 'AUTO', 'PEÇAS', 'E']
+SUFFIXES = ['LTDA', 'S.A.', 'EIRELI', 'ME', 'EPP']
+UFS = ['SP', 'RJ', 'MG', 'RS', 'PR', 'SC', 'BA', 'PE', 'CE', 'GO', 'DF', 'PA', 'AM', 'ES']
+CNAES = ['1091102', '4711302', '5611201', '4930202', '6201501', '4781400', '8630503', '4120400']
+LOGRADOUROS = ['RUA', 'AVENIDA', 'TRAVESSA', 'ALAMEDA', 'PRAÇA']
+
+
+def _choice(rng, values, n):
+    """Texto aleatório entre `values`"""
+    return pa.array(values).take(pa.array(rng.integers(0, len(values), n)))
+
+
+def _digits(rng, n, width, low=0):
+    """Números aleatórios com `width` dígitos (zeros à esquerda)"""
+    return _zfill(rng.integers(low, 10 ** width, n), width)
+
+
+def _zfill(values, width):
+    return pc.utf8_lpad(pa.array(values).cast(pa.string()), width, '0')
+
+
+def _join(*arrays, separator=' '):
+    return pc.binary_join_element_wise(*arrays, separator)
+
+
+def _name(rng, n, words=2):
+    """Nome com `words` palavras aleatórias"""
+    return _join(*[_choice(rng, WORDS, n) for _ in range(words)])
+
+
+def _date(rng, n, first_year=1970, last_year=2024):
+    """Datas AAAAMMDD aleatórias"""
+    values = (rng.integers(first_year, last_year + 1, n) * 10000 + rng.integers(1, 13, n) * 100
+              + rng.integers(1, 29, n))
+    return pa.array(values).cast(pa.string())
+
+
+def _constant(value, n):
+    return pa.repeat(pa.scalar(value, pa.string()), n)
+
+
+def _empresas(rng, ids, n_empresas):
+    n = len(ids)
+    return {
+        'cnpj_basico': _zfill(ids, 8),
+        'razao_social': _join(_name(rng, n, 3), _choice(rng, SUFFIXES, n)),
+        'natureza_juridica': _choice(rng, ['2062', '2135', '2305', '2240'], n),
+        'qualificacao_responsavel': _choice(rng, ['49', '50', '65'], n),
+        'capital_social': _join(pa.array(rng.integers(0, 1000000, n)).cast(pa.string()), _constant('00', n),
+                                separator=','),
+        'porte_empresa': _choice(rng, ['01', '03', '05'], n),
+        'ente_federativo_responsavel': _constant('', n),
+    }
+
+
+def _estabelecimentos(rng, ids, n_empresas):
+    n = len(ids)
+    ordem = ids // n_empresas + 1
+    return {
+        'cnpj_basico': _zfill(ids % n_empresas, 8),
+        'cnpj_ordem': _zfill(ordem, 4),
+        'cnpj_dv': _digits(rng, n, 2),
+        'identificador_matriz_filial': pa.array(np.where(ordem == 1, '1', '2')),
+        'nome_fantasia': _name(rng, n),
+        'situacao_cadastral': _choice(rng, ['02', '02', '02', '04', '08'], n),
+        'data_situacao_cadastral': _date(rng, n, 2000),
+        'motivo_situacao_cadastral': _choice(rng, ['00', '01', '71'], n),
+        'nome_cidade_exterior': _constant('', n),
+        'pais': _constant('', n),
+        'data_inicio_atividade': _date(rng, n),
+        'cnae_fiscal_principal': _choice(rng, CNAES, n),
+        'cnae_fiscal_secundaria': _join(_choice(rng, CNAES, n), _choice(rng, CNAES, n), separator=','),
+        'tipo_logradouro': _choice(rng, LOGRADOUROS, n),
+        'logradouro': _name(rng, n),
+        'numero': pa.array(rng.integers(1, 5000, n)).cast(pa.string()),
+        'complemento': _constant('', n),
+        'bairro': _choice(rng, WORDS, n),
+        'cep': _digits(rng, n, 8, 10000000),
+        'uf': _choice(rng, UFS, n),
+        'municipio': _digits(rng, n, 4, 1),
+        'ddd_1': _digits(rng, n, 2, 11),
+        'telefone_1': _digits(rng, n, 8, 20000000),
+        'ddd_2': _constant('', n),
+        'telefone_2': _constant('', n),
+        'ddd_fax': _constant('', n),
+        'correio_eletronico': _join(_choice(rng, ['CONTATO', 'ADM', 'FINANCEIRO'], n),
+                                    _choice(rng, ['EMPRESA.COM.BR', 'EMAIL.COM'], n), separator='@'),
+        'situacao_especial': _constant('', n),
+        'data_situacao_especial': _constant('', n),
+    }
+
+
+def _socios(rng, ids, n_empresas):
+    n = len(ids)
+    # 10% dos sócios são pessoas jurídicas (CNPJ de outra empresa gerada)
+    is_pj = rng.random(n) < 0.1
+    cnpj = _join(_zfill(rng.integers(0, n_empresas, n), 8), _constant('0001', n), _digits(rng, n, 2), separator='')
+    cpf = _join(_constant('***', n), _digits(rng, n, 6), _constant('**', n), separator='')
+    return {
+        'cnpj_basico': _zfill(rng.integers(0, n_empresas, n), 8),
+        'identificador_socio': pa.array(np.where(is_pj, '1', '2')),
+        'nome_socio_razao_social': pc.if_else(pa.array(is_pj), _join(_name(rng, n), _constant('LTDA', n)),
+                                              _name(rng, n, 3)),
+        'cnpj_cpf_socio': pc.if_else(pa.array(is_pj), cnpj, cpf),
+        'qualificacao_socio': _choice(rng, ['22', '49', '05'], n),
+        'data_entrada_sociedade': _date(rng, n, 1990),
+        'pais': _constant('', n),
+        'representante_legal': _constant('***000000**', n),
+        'nome_representante': _constant('', n),
+        'qualificacao_representante_legal': _constant('00', n),
+        'faixa_etaria': pa.array(rng.integers(0, 10, n)).cast(pa.string()),
+    }
+
+
+GENERATORS = {'empresas': _empresas, 'estabelecimentos': _estabelecimentos, 'socios': _socios}
+
+
+def csv_chunk(columns):
+    """Linhas no formato da Receita (latin-1, ';', com aspas) a partir das colunas de texto"""
+    lines = _join(_constant('"', len(columns[0])), _join(*columns, separator='";"'), _constant('"\n', len(columns[0])),
+                  separator='')
+    # Os textos do Arrow são UTF-8 contíguos: converte o bloco inteiro de uma vez
+    offsets, data = lines.buffers()[1], lines.buffers()[2]
+    start, end = np.frombuffer(offsets, dtype=np.int32, count=len(lines) + 1, offset=lines.offset * 4)[[0, -1]]
+    return data.to_pybytes()[start:end].decode('utf-8').encode('latin-1')
+
+
+def generate_table(path, table_name, rows, n_empresas, seed=0, chunk_rows=CHUNK_ROWS):
+    """Grava `rows` linhas sintéticas de uma tabela; retorna o tamanho do arquivo"""
+    rng = np.random.default_rng([seed, list(TABLES).index(table_name)])
+    with open(path, 'wb') as f:
+        for start in range(0, rows, chunk_rows):
+            ids = np.arange(start, min(start + chunk_rows, rows), dtype=np.int64)
+            columns = GENERATORS[table_name](rng, ids, n_empresas)
+            f.write(csv_chunk([columns[column] for column in LAYOUTS[table_name]]))
+    return os.path.getsize(path)
+
+
+def generate_month(site_dir, rows=ROWS, seed=0, month=MONTH):
+    """
+    Gera os ZIPs de um mês em `site_dir/<mês>/` (empresas, estabelecimentos e
+    sócios, proporcionais a `rows` empresas); retorna (linhas, bytes de CSV).
+    """
+    month_dir = os.path.join(site_dir, month)
+    os.makedirs(month_dir, exist_ok=True)
+    total_rows = total_bytes = 0
+    for table_name, (type_key, zip_prefix, ratio) in TABLES.items():
+        table_rows = max(1, int(rows * ratio))
+        csv_path = os.path.join(month_dir, f'K3241.K03200Y0.D40113.{type_key}')
+        total_bytes += generate_table(csv_path, table_name, table_rows, rows, seed)
+        total_rows += table_rows
+        with zipfile.ZipFile(os.path.join(month_dir, f'{zip_prefix}0.zip'), 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            zip_ref.write(csv_path, os.path.basename(csv_path))
+        os.remove(csv_path)
+    return total_rows, total_bytes
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_directory(directory):
+    """Servidor HTTP local com a listagem e os arquivos de `directory`; fornece a URL base"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(_QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def measure(stage, func):
+    """
+    Executa uma etapa e mede tempo e pico de memória; `func` retorna
+    (linhas, bytes) processados.
+    """
+    reset_peak_rss()
+    start = time.perf_counter()
+    rows, size = func()
+    seconds = time.perf_counter() - start
+    result = {
+        'etapa': stage,
+        'segundos': round(seconds, 4),
+        'linhas': rows,
+        'bytes': size,
+        'linhas_por_segundo': round(rows / seconds, 1) if seconds else None,
+        'mb_por_segundo': round(size / seconds / 1024 ** 2, 3) if seconds and size else None,
+        'pico_rss_mb': round(peak_rss() / 1024 ** 2, 1),
+    }
+    logger.info(f"{stage}: {seconds:.2f}s, {rows} linhas, {result['mb_por_segundo']} MB/s, "
+                f"pico de {result['pico_rss_mb']} MB")
+    return result
+
+
+@contextmanager
+def _converter_dirs(work_dir):
+    """Aponta os diretórios do import_to_parquet para a pasta do benchmark"""
+    import import_to_parquet
+
+    names = {'DOWNLOAD_DIR': 'downloads', 'EXTRACTED_DIR': 'extracted', 'PARQUET_DIR': 'parquet'}
+    saved = {name: getattr(import_to_parquet, name) for name in names}
+    for name, directory in names.items():
+        setattr(import_to_parquet, name, os.path.join(work_dir, directory))
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(import_to_parquet, name, value)
+
+
+def _files_size(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def run_benchmark(work_dir, rows=ROWS, lookups=LOOKUPS, seed=0, engine=None):
+    """Executa todas as etapas em `work_dir`; retorna o relatório (dict)"""
+    import cnpj_index
+    import db_loader
+    import import_to_parquet
+    from cnpj_downloader import CNPJDownloader
+
+    engine = engine or import_to_parquet.ENGINE
+    site_dir = os.path.join(work_dir, 'site')
+    parquet_dir = os.path.join(work_dir, 'parquet')
+    stages = []
+    generated = {}
+
+    def generate():
+        generated['rows'], generated['bytes'] = generate_month(site_dir, rows, seed)
+        return generated['rows'], generated['bytes']
+    stages.append(measure('gerar', generate))
+
+    with serve_directory(site_dir) as base_url:
+        downloader = CNPJDownloader(base_url=base_url, max_requests_per_second=None,
+                                    download_dir=os.path.join(work_dir, 'downloads'),
+                                    extract_dir=os.path.join(work_dir, 'extracted'))
+        directory = f'{MONTH}/'
+        files = downloader.get_files_from_directory(directory)
+        downloaded = []
+
+        def download():
+            downloaded.extend(downloader.download_files(files, directory))
+            return generated['rows'], _files_size(downloaded)
+        stages.append(measure('download', download))
+
+    def extract():
+        for file_path in downloader.verify_files(downloaded, directory):
+            downloader.extract_file(file_path, directory)
+        return generated['rows'], generated['bytes']
+    stages.append(measure('extracao', extract))
+
+    with _converter_dirs(work_dir):
+        extracted = sorted(import_to_parquet.find_sources().items())
+
+    def parse():
+        total = 0
+        for table_name, sources in extracted:
+            for source in sources:
+                with import_to_parquet.open_source(source) as f:
+                    total += sum(batch.num_rows for batch in import_to_parquet.read_batches(f, table_name, engine))
+        return total, generated['bytes']
+    stages.append(measure('leitura_csv', parse))
+
+    def convert():
+        with _converter_dirs(work_dir):
+            import_to_parquet.process_files_to_parquet(engine=engine)
+        total = sum(pq.read_metadata(os.path.join(parquet_dir, f'{table_name}.parquet')).num_rows
+                    for table_name in TABLES)
+        return total, generated['bytes']
+    stages.append(measure('parquet', convert))
+
+    def load():
+        totals = db_loader.load_database(db_loader.SQLiteBackend(os.path.join(work_dir, 'cnpj.sqlite')), parquet_dir)
+        return sum(totals.values()), os.path.getsize(os.path.join(work_dir, 'cnpj.sqlite'))
+    stages.append(measure('carga_sqlite', load))
+
+    def build_index():
+        totals = cnpj_index.build_index(parquet_dir)
+        return sum(totals.values()), None
+    stages.append(measure('indice', build_index))
+
+    rng = np.random.default_rng(seed)
+    cnpjs = [f'{value:08d}' for value in rng.integers(0, rows, lookups)]
+
+    def lookup():
+        index = cnpj_index.CNPJIndex(parquet_dir)
+        missing = [cnpj for cnpj in cnpjs if index.lookup(cnpj) is None]
+        if missing:
+            raise AssertionError(f"CNPJs gerados não encontrados no índice: {missing[:5]}")
+        return len(cnpjs), None
+    stages.append(measure('busca_cnpj', lookup))
+
+    return {
+        'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parametros': {'empresas': rows, 'buscas': lookups, 'seed': seed, 'engine': engine},
+        'ambiente': {'python': platform.python_version(), 'pyarrow': pa.__version__,
+                     'plataforma': platform.platform(), 'cpus': os.cpu_count()},
+        'etapas': stages,
+    }
+
+
+def compare(baseline, report, tolerance=TOLERANCE):
+    """
+    Compara o tempo de cada etapa com uma execução anterior; retorna as
+    etapas mais lentas que `tolerance` (ex: 0.10 = 10%) como
+    [(etapa, segundos antes, segundos agora)].
+    """
+    before = {stage['etapa']: stage for stage in baseline['etapas']}
+    regressions = []
+    for stage in report['etapas']:
+        previous = before.get(stage['etapa'])
+        if previous and previous['segundos'] and stage['segundos'] > previous['segundos'] * (1 + tolerance):
+            regressions.append((stage['etapa'], previous['segundos'], stage['segundos']))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline com dados sintéticos do CNPJ.")
+    parser.add_argument('--rows', type=int, default=ROWS, help=f"empresas geradas (padrão: {ROWS})")
+    parser.add_argument('--lookups', type=int, default=LOOKUPS, help=f"buscas por CNPJ (padrão: {LOOKUPS})")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engine', choices=['pyarrow', 'pandas'])
+    parser.add_argument('--work-dir', help="pasta de trabalho mantida após a execução (padrão: temporária)")
+    parser.add_argument('--output', help="arquivo JSON do relatório (padrão: saída padrão)")
+    parser.add_argument('--compare', metavar='JSON', help="relatório anterior para detectar regressões")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help=f"aumento de tempo tolerado na comparação (padrão: {TOLERANCE})")
+    parser.add_argument('--verbose', action='store_true', help="mostra os logs de cada etapa")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s [%(levelname)s] - %(message)s')
+    logger.setLevel(logging.INFO)
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        report = run_benchmark(args.work_dir, args.rows, args.lookups, args.seed, args.engine)
+    else:
+        work_dir = tempfile.mkdtemp(prefix='cnpj_benchmark_')
+        try:
+            report = run_benchmark(work_dir, args.rows, args.lookups, args.seed, args.engine)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for stage, before, after in regressions:
+            print(f"⚠️  {stage}: {before:.2f}s -> {after:.2f}s", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
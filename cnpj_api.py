@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+API HTTP assíncrona de consulta aos dados do CNPJ, servida a partir dos
+índices construídos sobre os arquivos Parquet (cnpj_index e cnpj_search):
+
+    GET /cnpj/{cnpj}           empresa, estabelecimentos, sócios e Simples
+    GET /search?q=...&limit=   CNPJs por razão social, nome fantasia ou sócio
+    GET /socios/{cpf_cnpj}     participações de um sócio
+    GET /health                versão (release) dos dados em uso
+
+As respostas ficam em um cache LRU com expiração, com chave que inclui a
+versão dos dados; requisições simultâneas iguais compartilham a mesma
+consulta. Quando os índices da pasta Parquet são reconstruídos (ex: após
+publicar um novo mês), a API passa a usar a nova versão sem reiniciar; se
+os arquivos Parquet mudaram e os índices ainda não, as consultas recebem
+503 até a reconstrução, em vez de dados de outra empresa.
+
+    python cnpj_api.py --port 8000
+"""
+import os
+import time
+import json
+import asyncio
+import logging
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cnpj_index import PARQUET_DIR, CNPJIndex, StaleIndexError, index_dir, manifest_signature
+from cnpj_search import NameIndex, search_dir
+
+try:
+    from aiohttp import web
+except ImportError:  # aiohttp é opcional: só é necessário para servir a API
+    web = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = 10000  # Respostas mantidas em cache
+CACHE_TTL = 3600  # Segundos até uma resposta expirar
+RELOAD_INTERVAL = 30  # Segundos entre verificações de uma nova versão dos dados
+SEARCH_LIMIT = 100  # Máximo de resultados por busca
+QUERY_WORKERS = os.cpu_count() or 1  # Threads das consultas aos índices
+
+_MISSING = object()
+
+
+class ResponseCache:
+    """Cache LRU com expiração (TTL) das respostas da API"""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        """Valor em cache, ou `default` se ausente ou expirado"""
+        item = self._items.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires < self.clock():
+            del self._items[key]
+            return default
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._items[key] = (self.clock() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+def release_id(parquet_dir=PARQUET_DIR):
+    """
+    Identifica a versão publicada dos dados: o caminho real da pasta Parquet
+    (que pode ser um link para a pasta do mês), a data dos manifestos dos
+    índices e a assinatura dos arquivos Parquet indexados, que muda quando
+    um novo mês é publicado mesmo antes de os índices serem reconstruídos.
+    """
+    parts = [os.path.realpath(parquet_dir)]
+    manifests = [os.path.join(index_dir(parquet_dir), 'index.json'),
+                 os.path.join(search_dir(parquet_dir), 'search.json')]
+    for path in manifests:
+        parts.append(str(os.stat(path).st_mtime_ns) if os.path.exists(path) else '-')
+    try:
+        with open(manifests[0], encoding='utf-8') as f:
+            tables = json.load(f)['tables']
+    except (OSError, ValueError, KeyError):
+        tables = {}
+    parts.append(manifest_signature(parquet_dir, tables))
+    return ':'.join(parts)
+
+
+class Release:
+    """Índices de uma versão dos dados"""
+
+    def __init__(self, parquet_dir=PARQUET_DIR):
+        self.id = release_id(parquet_dir)
+        self.index = CNPJIndex(parquet_dir)
+        try:
+            self.names = NameIndex(parquet_dir)
+        except FileNotFoundError:
+            logger.warning("Índice de nomes não encontrado: /search desativado.")
+            self.names = None
+
+    def lookup(self, cnpj):
+        return self.index.lookup(cnpj)
+
+    def search(self, text, limit):
+        if self.names is None:
+            raise LookupError("Índice de nomes não disponível")
+        results = []
+        for cnpj_basico, score in self.names.search(text, limit):
+            empresa = self.index.rows('empresas', cnpj_basico)
+            results.append({
+                'cnpj_basico': cnpj_basico,
+                'razao_social': empresa[0]['razao_social'] if empresa else None,
+                'score': score,
+            })
+        return results
+
+    def partner(self, cpf_cnpj):
+        return self.index.partner(cpf_cnpj)
+
+
+class CNPJService:
+    """
+    Estado da API: versão dos dados em uso, cache de respostas e consultas
+    em andamento. As consultas aos índices rodam em um pool de
+    `workers` threads (por padrão, uma por núcleo).
+    """
+
+    def __init__(self, parquet_dir=PARQUET_DIR, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL, workers=QUERY_WORKERS):
+        self.parquet_dir = parquet_dir
+        self.release = Release(parquet_dir)
+        self.stale = None  # Motivo da recusa das consultas enquanto os índices não correspondem aos arquivos
+        self.cache = ResponseCache(cache_size, cache_ttl)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cnpj-index')
+        self._pending = {}
+        logger.info(f"Dados carregados: {self.release.id}")
+
+    def reload_if_changed(self):
+        """
+        Troca para a nova versão dos dados se os índices ou os arquivos
+        Parquet mudaram; retorna True se trocou. Enquanto os índices não
+        correspondem aos arquivos (novo mês publicado, índices ainda sendo
+        reconstruídos), as consultas são recusadas.
+        """
+        current = release_id(self.parquet_dir)
+        if current == self.release.id:
+            return False
+        try:
+            release = Release(self.parquet_dir)
+        except (FileNotFoundError, ValueError) as e:
+            # As posições do índice anterior não valem para os arquivos novos
+            if self.stale is None:
+                logger.warning(f"Dados alterados e índices ainda não reconstruídos; consultas suspensas: {e}")
+            self.stale = str(e)
+            return False
+        self.release = release
+        self.stale = None
+        logger.info(f"Nova versão dos dados carregada: {release.id}")
+        return True
+
+    async def call(self, method, *args):
+        """
+        Executa uma consulta da versão atual com cache. Chamadas simultâneas
+        com os mesmos argumentos aguardam a mesma consulta; um cliente que
+        desconecta deixa de esperar por ela sem cancelá-la para os demais.
+        """
+        if self.stale is not None:
+            raise StaleIndexError(self.stale)
+        release = self.release
+        key = (release.id, method, *args)
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        pending = self._pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = loop.run_in_executor(self.executor, getattr(release, method), *args)
+            self._pending[key] = pending
+
+            def done(future):
+                self._pending.pop(key, None)
+                if not future.cancelled() and future.exception() is None:
+                    self.cache.set(key, future.result())
+            pending.add_done_callback(done)
+        return await asyncio.shield(pending)
+
+    async def watch(self, interval=RELOAD_INTERVAL):
+        """Verifica periodicamente se uma nova versão dos dados foi publicada"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(self.executor, self.reload_if_changed)
+            except Exception as e:
+                logger.error(f"Erro ao verificar nova versão dos dados: {e}", exc_info=True)
+
+
+def _json(data, status=200):
+    """Resposta JSON (datas e decimais como texto)"""
+    return web.json_response(data, status=status, dumps=lambda value: json.dumps(value, ensure_ascii=False, default=str))
+
+
+def _unavailable(error):
+    """Resposta para consultas recusadas enquanto os índices estão desatualizados"""
+    return _json({'erro': f"Dados em atualização: {error}"}, status=503)
+
+
+def create_app(parquet_dir=PARQUET_DIR, reload_interval=RELOAD_INTERVAL, service=None):
+    """Cria a aplicação aiohttp da API"""
+    if web is None:
+        raise ImportError("A API requer o pacote aiohttp (pip install aiohttp)")
+    service = service or CNPJService(parquet_dir)
+    routes = web.RouteTableDef()
+
+    @routes.get('/cnpj/{cnpj}')
+    async def cnpj(request):
+        try:
+            result = await service.call('lookup', request.match_info['cnpj'])
+        except StaleIndexError as e:
+            return _unavailable(e)
+        except ValueError as e:
+            return _json({'erro': str(e)}, status=400)
+        if result is None:
+            return _json({'erro': 'CNPJ não encontrado'}, status=404)
+        return _json(result)
+
+    @routes.get('/search')
+    async def search(request):
+        text = request.query.get('q', '').strip()
+        if not text:
+            return _json({'erro': "Parâmetro 'q' obrigatório"}, status=400)
+        try:
+            limit = min(int(request.query.get('limit', 20)), SEARCH_LIMIT)
+        except ValueError:
+            return _json({'erro': "Parâmetro 'limit' inválido"}, status=400)
+        try:
+            return _json(await service.call('search', text, limit))
+        except StaleIndexError as e:
+            return _unavailable(e)
+        except LookupError as e:
+            return _json({'erro': str(e)}, status=503)
+
+    @routes.get('/socios/{cpf_cnpj}')
+    async def socios(request):
+        try:
+            result = await service.call('partner', request.match_info['cpf_cnpj'])
+        except StaleIndexError as e:
+            return _unavailable(e)
+        if not result:
+            return _json({'erro': 'Sócio não encontrado'}, status=404)
+        return _json(result)
+
+    @routes.get('/health')
+    async def health(request):
+        return _json({'release': service.release.id, 'cache': len(service.cache), 'desatualizado': service.stale},
+                     status=503 if service.stale else 200)
+
+    watcher = []
+
+    async def start_watcher(app):
+        watcher.append(asyncio.create_task(service.watch(reload_interval)))
+
+    async def stop_watcher(app):
+        for task in watcher:
+            task.cancel()
+        service.executor.shutdown(wait=False)
+
+    app = web.Application()
+    app.add_routes(routes)
+    if reload_interval:
+        app.on_startup.append(start_watcher)
+        app.on_cleanup.append(stop_watcher)
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="API HTTP de consulta aos dados do CNPJ.")
+    parser.add_argument('--parquet-dir', default=PARQUET_DIR)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--reload-interval', type=int, default=RELOAD_INTERVAL,
+                        help=f"segundos entre verificações de novos dados (0 desativa; padrão: {RELOAD_INTERVAL})")
+    args = parser.parse_args()
+    web.run_app(create_app(args.parquet_dir, args.reload_interval), host=args.host, port=args.port)
@@ -7,59 +7,207 @@ Web scraper para baixar dados abertos do CNPJ da Receita Federal
 
 import os
 import re
+import json
+import hashlib
 import requests
 import zipfile
+import zlib
 import logging
 from datetime import datetime
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
 from tqdm import tqdm
+from http_cache import HTTPMetadataCache, response_validators
 import time
-import pytz
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from instrumentation import setup_logger, stage
+from pipeline_state import PipelineState, state_path, zip_fingerprint, DOWNLOAD, VERIFY, EXTRACT, FAILED, QUARANTINED
 
 # Constantes de diretório
 DOWNLOAD_DIR = "downloads"
 EXTRACT_DIR = "extracted"
 LOG_FILE = "cnpj_downloader.log"
 
-class SaoPauloFormatter(logging.Formatter):
-    def converter(self, timestamp):
-        dt = datetime.fromtimestamp(timestamp, pytz.timezone('America/Sao_Paulo'))
-        return dt
+HTTP_CACHE_FILE = ".http_cache.json"
 
-    def formatTime(self, record, datefmt=None):
-        dt = self.converter(record.created)
-        if datefmt:
-            s = dt.strftime(datefmt)
+# Paralelismo e limites de taxa (podem ser ajustados por variáveis de ambiente)
+MAX_WORKERS = int(os.environ.get("CNPJ_MAX_WORKERS", 4))
+MAX_BYTES_PER_SECOND = float(os.environ.get("CNPJ_MAX_BYTES_PER_SECOND", 0)) or None
+MAX_REQUESTS_PER_SECOND = float(os.environ.get("CNPJ_MAX_REQUESTS_PER_SECOND", 1)) or None
+CHUNK_SIZE = int(os.environ.get("CNPJ_CHUNK_SIZE", 1024 * 1024))
+
+# Download segmentado (várias conexões por arquivo) para os arquivos grandes
+SEGMENTS = int(os.environ.get("CNPJ_SEGMENTS", 4))
+SEGMENT_THRESHOLD = int(os.environ.get("CNPJ_SEGMENT_THRESHOLD", 256 * 1024 * 1024))
+JOURNAL_INTERVAL = 16 * 1024 * 1024
+
+# Downloads parciais e retomada
+PART_SUFFIX = ".part"
+JOURNAL_SUFFIX = ".json"
+DOWNLOAD_RETRIES = int(os.environ.get("CNPJ_DOWNLOAD_RETRIES", 3))
+
+# Verificação de integridade dos ZIPs (CRC32 de cada membro)
+VERIFY_WORKERS = int(os.environ.get("CNPJ_VERIFY_WORKERS", 4))
+QUARANTINE_DIR = ".quarantine"  # Dentro de downloads/; oculto para os globs do conversor
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Só o terminal ao importar o módulo; o arquivo de log é aberto por log_to_file
+logger = setup_logger(__name__, None, LOG_FORMAT)
+
+def log_to_file():
+    """Grava também o log do downloader em LOG_FILE (execução pela linha de comando)"""
+    setup_logger(__name__, LOG_FILE, LOG_FORMAT)
+
+class IncompleteDownloadError(IOError):
+    """O arquivo recebido é menor que o tamanho informado pelo servidor"""
+
+class RemoteFileChangedError(IncompleteDownloadError):
+    """O arquivo remoto mudou durante um download segmentado"""
+
+def verify_zip(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Confere o CRC32 de todos os membros de um ZIP lendo-os por streaming, sem
+    gravar nada em disco. Retorna None se o arquivo está íntegro, ou a
+    descrição do problema encontrado.
+    """
+    try:
+        with zipfile.ZipFile(file_path) as zip_ref:
+            for member in zip_ref.infolist():
+                # ZipExtFile confere o CRC ao chegar ao fim do membro
+                with zip_ref.open(member) as source:
+                    while source.read(chunk_size):
+                        pass
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, zlib.error, EOFError, OSError) as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+_pwrite_lock = threading.Lock()
+
+def _pwrite(fd, data, offset):
+    """Grava `data` na posição `offset` do descritor, sem depender da posição atual"""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
         else:
-            s = dt.isoformat()
-        return s
+            with _pwrite_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+def _parse_content_range_total(content_range):
+    """Extrai o tamanho total de um cabeçalho `Content-Range: bytes a-b/total`"""
+    if not content_range or '/' not in content_range:
+        return None
+    total = content_range.rsplit('/', 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+def _parse_directory_links(content):
+    """Extrai os links de diretórios yyyy-mm/ de uma listagem HTML"""
+    soup = BeautifulSoup(content, 'html.parser')
+    
+    # Padrão para diretórios yyyy-mm
+    pattern = re.compile(r'^\d{4}-\d{2}/$')
+    return [link.get('href') for link in soup.find_all('a')
+            if link.get('href') and pattern.match(link.get('href'))]
+
+def _parse_file_links(content, url):
+    """Extrai os links de arquivos (não diretórios) de uma listagem HTML"""
+    soup = BeautifulSoup(content, 'html.parser')
+    
+    files = []
+    for link in soup.find_all('a'):
+        href = link.get('href')
+        if href and not href.endswith('/') and not href.startswith('?'):
+            # Verificar se é um arquivo (não é diretório)
+            files.append({
+                'name': href,
+                'url': urljoin(url, href)
+            })
+    return files
 
-# Substituir a configuração do basicConfig por configuração manual com o formatter customizado
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-if logger.hasHandlers():
-    logger.handlers.clear()
-formatter = SaoPauloFormatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler = logging.FileHandler(LOG_FILE)
-file_handler.setFormatter(formatter)
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+class RateLimiter:
+    """
+    Limitador global de taxa compartilhado entre as threads de download.
+
+    Controla requisições por segundo e bytes por segundo. Permite uma rajada
+    de até um segundo de cota acumulada; um limite None desativa o controle.
+    """
+
+    def __init__(self, bytes_per_second=None, requests_per_second=None):
+        self.bytes_per_second = bytes_per_second
+        self.requests_per_second = requests_per_second
+        self._lock = threading.Lock()
+        self._next_request = 0.0
+        self._next_bytes = 0.0
+
+    def _reserve(self, attr, amount, rate):
+        """Reserva `amount` unidades da cota e aguarda até que estejam disponíveis"""
+        with self._lock:
+            now = time.monotonic()
+            available_at = max(getattr(self, attr), now - 1.0)
+            setattr(self, attr, available_at + amount / rate)
+            delay = available_at - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def acquire_request(self):
+        """Bloqueia até que uma nova requisição possa ser feita"""
+        if self.requests_per_second:
+            self._reserve('_next_request', 1, self.requests_per_second)
+
+    def acquire_bytes(self, n_bytes):
+        """Bloqueia até que `n_bytes` possam ser consumidos"""
+        if self.bytes_per_second and n_bytes > 0:
+            self._reserve('_next_bytes', n_bytes, self.bytes_per_second)
 
 class CNPJDownloader:
-    def __init__(self, base_url="https://arquivos.receitafederal.gov.br/dados/cnpj/dados_abertos_cnpj/"):
+    def __init__(self, base_url="https://arquivos.receitafederal.gov.br/dados/cnpj/dados_abertos_cnpj/",
+                 max_workers=MAX_WORKERS, max_bytes_per_second=MAX_BYTES_PER_SECOND,
+                 max_requests_per_second=MAX_REQUESTS_PER_SECOND,
+                 download_dir=DOWNLOAD_DIR, extract_dir=EXTRACT_DIR,
+                 segments=SEGMENTS, segment_threshold=SEGMENT_THRESHOLD, chunk_size=CHUNK_SIZE):
         self.base_url = base_url
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        }
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self._local = threading.local()
         
-        # Usar constantes para os diretórios
-        self.download_dir = DOWNLOAD_DIR
-        self.extract_dir = EXTRACT_DIR
+        # Paralelismo e limite global de taxa
+        self.max_workers = max(1, int(max_workers))
+        self.rate_limiter = RateLimiter(max_bytes_per_second, max_requests_per_second)
+        self._progress_lock = threading.Lock()
+        
+        # Download segmentado de arquivos grandes
+        self.segments = max(1, int(segments))
+        self.segment_threshold = segment_threshold
+        self.chunk_size = chunk_size
+        
+        self.download_dir = download_dir
+        self.extract_dir = extract_dir
         self._create_directories()
+        
+        # Cache de metadados HTTP para requisições condicionais
+        self.http_cache = HTTPMetadataCache(os.path.join(self.download_dir, HTTP_CACHE_FILE))
+        self.listing_changed = {}
+        
+        # Manifesto do estado de cada arquivo (baixado, verificado, extraído)
+        self.state = PipelineState(state_path(self.download_dir))
+    
+    def _get_session(self):
+        """Retorna a sessão HTTP da thread atual (requests.Session não é thread-safe)"""
+        if threading.current_thread() is threading.main_thread():
+            return self.session
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self._local.session = session
+        return session
     
     def _create_directories(self):
         """Cria os diretórios necessários"""
@@ -72,25 +220,17 @@ class CNPJDownloader:
         """Obtém o diretório mais recente (yyyy-mm) da página"""
         try:
             logger.info("Obtendo lista de diretórios...")
-            response = self.session.get(self.base_url)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Padrão para diretórios yyyy-mm
-            pattern = re.compile(r'^\d{4}-\d{2}/$')
+            hrefs = self._fetch_listing(self.base_url, _parse_directory_links)
             
             directories = []
-            for link in soup.find_all('a'):
-                href = link.get('href')
-                if href and pattern.match(href):
-                    # Extrair a data do diretório
-                    date_str = href.rstrip('/')
-                    try:
-                        date_obj = datetime.strptime(date_str, '%Y-%m')
-                        directories.append((date_obj, href))
-                    except ValueError:
-                        continue
+            for href in hrefs:
+                # Extrair a data do diretório
+                date_str = href.rstrip('/')
+                try:
+                    date_obj = datetime.strptime(date_str, '%Y-%m')
+                    directories.append((date_obj, href))
+                except ValueError:
+                    continue
             
             if not directories:
                 raise Exception("Nenhum diretório válido encontrado")
@@ -112,21 +252,7 @@ class CNPJDownloader:
             url = urljoin(self.base_url, directory)
             logger.info(f"Obtendo arquivos do diretório: {url}")
             
-            response = self.session.get(url)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            files = []
-            for link in soup.find_all('a'):
-                href = link.get('href')
-                if href and not href.endswith('/') and not href.startswith('?'):
-                    # Verificar se é um arquivo (não é diretório)
-                    file_url = urljoin(url, href)
-                    files.append({
-                        'name': href,
-                        'url': file_url
-                    })
+            files = self._fetch_listing(url, lambda content: _parse_file_links(content, url))
             
             logger.info(f"Encontrados {len(files)} arquivos no diretório")
             return files
@@ -135,48 +261,502 @@ class CNPJDownloader:
             logger.error(f"Erro ao obter arquivos do diretório: {e}")
             raise
     
-    def download_file(self, file_info, directory_name):
-        """Download de um arquivo específico"""
+    def _fetch_listing(self, url, parse):
+        """
+        Obtém uma listagem HTML com GET condicional (If-None-Match/If-Modified-Since).
+
+        Em uma resposta 304 a listagem vem do cache sem baixar nem interpretar o
+        HTML. `self.listing_changed[url]` indica se a listagem mudou desde a
+        última execução.
+        """
+        entry = self.http_cache.get(url)
+        headers = self.http_cache.conditional_headers(url) if 'listing' in entry else {}
+        
+        self.rate_limiter.acquire_request()
+        response = self.session.get(url, headers=headers)
+        if response.status_code == 304:
+            logger.info(f"Listagem inalterada desde a última execução: {url}")
+            self.listing_changed[url] = False
+            return entry['listing']
+        response.raise_for_status()
+        
+        # A listagem traz datas e tamanhos: qualquer mudança no HTML indica arquivo novo ou republicado
+        content_hash = hashlib.sha1(response.content).hexdigest()
+        changed = content_hash != entry.get('content_hash')
+        listing = parse(response.content) if changed or 'listing' not in entry else entry['listing']
+        new_entry = {**response_validators(response), 'content_hash': content_hash, 'listing': listing}
+        if not changed and entry.get('complete'):
+            # Servidor sem suporte a requisições condicionais, mas nada mudou
+            new_entry['complete'] = True
+        self.http_cache.set(url, new_entry)
+        self.listing_changed[url] = changed
+        return listing
+    
+    def is_month_up_to_date(self, directory_name, files):
+        """
+        Indica se o mês já foi baixado e extraído por completo e sua listagem
+        não mudou desde então (exige `get_files_from_directory` antes).
+        """
+        url = urljoin(self.base_url, directory_name)
+        if self.listing_changed.get(url, True) or not self.http_cache.get(url).get('complete'):
+            return False
+        month_dir = os.path.join(self.download_dir, directory_name.rstrip('/'))
+        return all(os.path.exists(os.path.join(month_dir, file_info['name'])) for file_info in files)
+    
+    def mark_month_complete(self, directory_name):
+        """Registra no cache que todos os arquivos do mês foram baixados e extraídos"""
+        self.http_cache.update(urljoin(self.base_url, directory_name), complete=True)
+    
+    def _is_remote_unchanged(self, file_url, file_path):
+        """Compara o arquivo local com o remoto usando um único HEAD"""
+        info = self._probe(file_url)
+        if info is None:
+            # Sem como verificar: mantém o comportamento de confiar no arquivo local
+            return True
+        if self.http_cache.get(file_url):
+            return self.http_cache.matches(file_url, info)
+        # Arquivo baixado antes do cache existir: confere o tamanho e registra
+        if info['content_length'] is not None and info['content_length'] != os.path.getsize(file_path):
+            return False
+        self.http_cache.set(file_url, {key: info[key] for key in ('etag', 'last_modified', 'content_length')})
+        return True
+    
+    def download_file(self, file_info, directory_name, progress=None):
+        """
+        Download de um arquivo específico.
+
+        O conteúdo é gravado em `<arquivo>.part` e só é movido para o caminho
+        final depois de conferido o tamanho (e o diretório central, no caso de
+        ZIP). Um `.part` existente é retomado com requisições `Range`, e um
+        diário `<arquivo>.part.json` guarda ETag/Last-Modified para garantir
+        que a retomada é do mesmo arquivo remoto.
+
+        Arquivos maiores que `segment_threshold` são divididos em `segments`
+        faixas de bytes baixadas em paralelo, quando o servidor aceita `Range`.
+
+        Se `progress` (barra tqdm agregada) for informado, o progresso é somado
+        a ela em vez de criar uma barra por arquivo.
+        """
         try:
             file_name = file_info['name']
             file_url = file_info['url']
             
-            # Criar subdiretório para o mês
-            month_dir = os.path.join(self.download_dir, directory_name.rstrip('/'))
-            if not os.path.exists(month_dir):
-                os.makedirs(month_dir)
-            
-            file_path = os.path.join(month_dir, file_name)
-            
-            # Verificar se arquivo já existe
-            if os.path.exists(file_path):
-                logger.info(f"Arquivo já existe, pulando: {file_name}")
+            with stage('download', arquivo=file_name) as record:
+                # Criar subdiretório para o mês
+                month_dir = os.path.join(self.download_dir, directory_name.rstrip('/'))
+                if not os.path.exists(month_dir):
+                    os.makedirs(month_dir)
+            
+                file_path = os.path.join(month_dir, file_name)
+                part_path = file_path + PART_SUFFIX
+            
+                # Verificar se arquivo já existe, está íntegro e não mudou no servidor
+                month = directory_name.rstrip('/')
+                if os.path.exists(file_path):
+                    if self.state.is_done(month, DOWNLOAD, file_name, file_path) or self._is_complete(file_path):
+                        if self._is_remote_unchanged(file_url, file_path):
+                            logger.info(f"Arquivo já existe e não mudou, pulando: {file_name}")
+                            record.labels['resultado'] = 'pulado'
+                            self.state.record(month, DOWNLOAD, file_name, file_path)
+                            return file_path
+                        # Versão nova no servidor: baixa para o .part e substitui ao final
+                        logger.info(f"Arquivo mudou no servidor, baixando novamente: {file_name}")
+                    else:
+                        # Arquivo truncado de execuções anteriores: sem diário não há
+                        # validador (If-Range) que garanta a mesma versão remota
+                        logger.warning(f"Arquivo incompleto encontrado, baixando novamente: {file_name}")
+                        os.remove(file_path)
+            
+                logger.info(f"Baixando: {file_name}")
+                resumed = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            
+                for attempt in range(1, DOWNLOAD_RETRIES + 1):
+                    try:
+                        if self._should_segment(file_url, part_path):
+                            self._download_segmented(file_url, part_path, file_name, progress)
+                        else:
+                            self._download_stream(file_url, part_path, file_name, progress)
+                        break
+                    except (requests.ConnectionError, requests.Timeout,
+                            requests.exceptions.ChunkedEncodingError, IncompleteDownloadError) as e:
+                        if attempt == DOWNLOAD_RETRIES:
+                            raise
+                        record.retry()
+                        logger.warning(f"Download interrompido ({e}), retomando {file_name} "
+                                       f"(tentativa {attempt + 1}/{DOWNLOAD_RETRIES})")
+            
+                self._finalize_part(part_path, file_path)
+                record.add(bytes=os.path.getsize(file_path) - resumed)
+                self.state.record(month, DOWNLOAD, file_name, file_path)
+                logger.info(f"Download concluído: {file_name}")
                 return file_path
             
-            logger.info(f"Baixando: {file_name}")
-            
-            # Download com barra de progresso
-            response = self.session.get(file_url, stream=True)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            
-            with open(file_path, 'wb') as f:
-                with tqdm(total=total_size, unit='B', unit_scale=True, desc=file_name) as pbar:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            pbar.update(len(chunk))
-            
-            logger.info(f"Download concluído: {file_name}")
-            return file_path
-            
         except Exception as e:
             logger.error(f"Erro ao baixar arquivo {file_name}: {e}")
+            self.state.record(directory_name.rstrip('/'), DOWNLOAD, file_name, status=FAILED, error=str(e))
             raise
     
+    def _is_complete(self, file_path):
+        """Verifica se um arquivo baixado está completo (para ZIPs, valida o diretório central)"""
+        if not file_path.lower().endswith('.zip'):
+            return True
+        try:
+            with zipfile.ZipFile(file_path) as zip_ref:
+                zip_ref.infolist()
+            return True
+        except (zipfile.BadZipFile, OSError):
+            return False
+    
+    def _open_progress(self, progress, total_size, desc):
+        """Retorna as funções de atualização e fechamento do progresso de um arquivo"""
+        if progress is None:
+            pbar = tqdm(total=total_size, unit='B', unit_scale=True, desc=desc)
+            return pbar.update, pbar.close
+        
+        with self._progress_lock:
+            progress.total += total_size
+            progress.refresh()
+        
+        def update(n_bytes):
+            with self._progress_lock:
+                progress.update(n_bytes)
+        return update, lambda: None
+    
+    def _read_journal(self, part_path):
+        """Lê o diário de um download parcial (ou None se não existir/for inválido)"""
+        try:
+            with open(part_path + JOURNAL_SUFFIX, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _write_journal(self, part_path, journal):
+        """Grava o diário de um download parcial de forma atômica"""
+        journal_path = part_path + JOURNAL_SUFFIX
+        tmp_path = journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(journal, f)
+        os.replace(tmp_path, journal_path)
+    
+    def _download_stream(self, file_url, part_path, desc, progress=None):
+        """Baixa (ou retoma) o arquivo em uma única conexão, acrescentando ao `.part`"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        journal = self._read_journal(part_path) or {}
+        validator = journal.get('etag') or journal.get('last_modified')
+        if offset > 0 and (journal.get('url') != file_url or not validator):
+            # Sem validador não há como saber se o .part é da versão remota atual
+            logger.warning(f"{desc}: parcial sem ETag/Last-Modified, recomeçando do zero")
+            offset = 0
+        
+        headers = {}
+        if offset > 0:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = validator
+        
+        self.rate_limiter.acquire_request()
+        response = self._get_session().get(file_url, stream=True, headers=headers)
+        
+        if response.status_code == 416 and offset > 0:
+            response.close()
+            if journal.get('total_size') == offset:
+                # O .part já contém o arquivo inteiro
+                return
+            # Faixa fora do arquivo remoto (ex: .part maior que ele): descarta e recomeça
+            logger.warning(f"{desc}: faixa a partir do byte {offset} recusada (HTTP 416), recomeçando do zero")
+            os.remove(part_path)
+            self._remove_journal(part_path)
+            return self._download_stream(file_url, part_path, desc, progress)
+        response.raise_for_status()
+        
+        if offset > 0 and response.status_code == 206:
+            total_size = _parse_content_range_total(response.headers.get('content-range'))
+            mode = 'ab'
+            logger.info(f"Retomando {desc} a partir do byte {offset}")
+        else:
+            # Servidor ignorou o Range ou o arquivo remoto mudou: recomeça do zero
+            offset = 0
+            total_size = int(response.headers.get('content-length', 0)) or None
+            mode = 'wb'
+        
+        self._write_journal(part_path, {
+            'url': file_url,
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'total_size': total_size,
+        })
+        
+        update, close = self._open_progress(progress, (total_size or 0) - offset, desc)
+        try:
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        self.rate_limiter.acquire_bytes(len(chunk))
+                        f.write(chunk)
+                        update(len(chunk))
+        finally:
+            close()
+            response.close()
+        
+        written = os.path.getsize(part_path)
+        if total_size is not None and written != total_size:
+            raise IncompleteDownloadError(f"{desc}: {written} de {total_size} bytes recebidos")
+    
+    def _probe(self, file_url):
+        """Consulta tamanho, suporte a Range e validadores do arquivo remoto via HEAD"""
+        try:
+            self.rate_limiter.acquire_request()
+            response = self._get_session().head(file_url, allow_redirects=True)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f"HEAD falhou para {file_url}, usando conexão única: {e}")
+            return None
+        return {
+            **response_validators(response),
+            'accept_ranges': response.headers.get('accept-ranges', '').lower() == 'bytes',
+        }
+    
+    def _should_segment(self, file_url, part_path):
+        """Decide entre download segmentado e conexão única"""
+        journal = self._read_journal(part_path)
+        if journal and journal.get('url') == file_url and journal.get('segments'):
+            return os.path.exists(part_path)
+        if self.segments < 2 or (os.path.exists(part_path) and os.path.getsize(part_path) > 0):
+            # Retomada de um .part de conexão única
+            return False
+        
+        info = self._probe(file_url)
+        if not info or not info['accept_ranges'] or not info['content_length']:
+            return False
+        if info['content_length'] < self.segment_threshold:
+            return False
+        
+        # Planeja as faixas e pré-aloca o .part (arquivo esparso)
+        total_size = info['content_length']
+        step = -(-total_size // self.segments)
+        segments = [[start, min(start + step, total_size) - 1, 0] for start in range(0, total_size, step)]
+        with open(part_path, 'wb') as f:
+            f.truncate(total_size)
+        self._write_journal(part_path, {
+            'url': file_url,
+            'etag': info['etag'],
+            'last_modified': info['last_modified'],
+            'total_size': total_size,
+            'segments': segments,
+        })
+        return True
+    
+    def _download_segmented(self, file_url, part_path, desc, progress=None):
+        """Baixa as faixas pendentes do diário em paralelo, gravando cada uma na sua posição"""
+        journal = self._read_journal(part_path)
+        segments = journal['segments']
+        validator = journal.get('etag') or journal.get('last_modified')
+        pending = [segment for segment in segments if segment[2] < segment[1] - segment[0] + 1]
+        remaining = sum(segment[1] - segment[0] + 1 - segment[2] for segment in pending)
+        logger.info(f"Download segmentado de {desc}: {len(pending)} faixa(s) pendente(s), {remaining} bytes")
+        
+        journal_lock = threading.Lock()
+        unsaved = [0]
+        
+        def save_journal(n_bytes):
+            with journal_lock:
+                unsaved[0] += n_bytes
+                if unsaved[0] >= JOURNAL_INTERVAL:
+                    unsaved[0] = 0
+                    self._write_journal(part_path, journal)
+        
+        update, close = self._open_progress(progress, remaining, desc)
+        fd = os.open(part_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            with ThreadPoolExecutor(max_workers=len(pending) or 1) as executor:
+                futures = [
+                    executor.submit(self._download_segment, file_url, fd, segment, validator, update, save_journal)
+                    for segment in pending
+                ]
+                errors = []
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(e)
+        finally:
+            os.close(fd)
+            close()
+            with journal_lock:
+                self._write_journal(part_path, journal)
+        
+        if any(isinstance(e, RemoteFileChangedError) for e in errors):
+            # Faixas de versões diferentes não podem ser combinadas: recomeça do zero
+            os.remove(part_path)
+            self._remove_journal(part_path)
+        if errors:
+            raise errors[0]
+    
+    def _download_segment(self, file_url, fd, segment, validator, update, save_journal):
+        """Baixa uma faixa `[início, fim, baixados]` e atualiza `baixados` conforme grava"""
+        start, end, done = segment
+        headers = {'Range': f'bytes={start + done}-{end}'}
+        if validator:
+            headers['If-Range'] = validator
+        
+        self.rate_limiter.acquire_request()
+        response = self._get_session().get(file_url, stream=True, headers=headers)
+        try:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise RemoteFileChangedError(f"Servidor não devolveu a faixa {start + done}-{end} (HTTP {response.status_code})")
+            
+            position = start + done
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                if chunk:
+                    chunk = chunk[:end + 1 - position]
+                    self.rate_limiter.acquire_bytes(len(chunk))
+                    _pwrite(fd, chunk, position)
+                    position += len(chunk)
+                    segment[2] += len(chunk)
+                    update(len(chunk))
+                    save_journal(len(chunk))
+        finally:
+            response.close()
+        
+        if segment[2] != end - start + 1:
+            raise IncompleteDownloadError(f"Faixa {start}-{end}: {segment[2]} de {end - start + 1} bytes recebidos")
+    
+    def _finalize_part(self, part_path, file_path):
+        """Valida o `.part` e o move para o caminho final"""
+        journal = self._read_journal(part_path) or {}
+        total_size = journal.get('total_size')
+        written = os.path.getsize(part_path)
+        if total_size is not None and written != total_size:
+            raise IncompleteDownloadError(f"{os.path.basename(file_path)}: {written} de {total_size} bytes recebidos")
+        
+        if not self._is_complete(part_path):
+            # Conteúdo corrompido: descarta para que a próxima tentativa baixe do zero
+            os.remove(part_path)
+            self._remove_journal(part_path)
+            raise zipfile.BadZipFile(f"ZIP inválido após download: {os.path.basename(file_path)}")
+        
+        os.replace(part_path, file_path)
+        self._remove_journal(part_path)
+        
+        # Registra os validadores para pular o arquivo enquanto não mudar no servidor
+        if journal.get('url'):
+            self.http_cache.set(journal['url'], {
+                'etag': journal.get('etag'),
+                'last_modified': journal.get('last_modified'),
+                'content_length': written,
+            })
+    
+    def _remove_journal(self, part_path):
+        """Remove o diário de um download parcial"""
+        try:
+            os.remove(part_path + JOURNAL_SUFFIX)
+        except FileNotFoundError:
+            pass
+    
+    def download_files(self, files, directory_name, max_workers=None, on_complete=None):
+        """
+        Download paralelo de uma lista de arquivos com um pool de threads.
+
+        O número de downloads simultâneos é limitado por `max_workers` e o
+        progresso de todos os arquivos é agregado em uma única barra.
+        Se informado, `on_complete(file_info, file_path)` é chamado na thread
+        principal assim que cada arquivo termina, enquanto os demais continuam
+        baixando. Retorna os caminhos baixados com sucesso, na ordem de `files`.
+        """
+        workers = max(1, int(max_workers or self.max_workers))
+        logger.info(f"Baixando {len(files)} arquivos com {workers} download(s) simultâneo(s)")
+        
+        results = {}
+        with tqdm(total=0, unit='B', unit_scale=True, desc=f"Downloads {directory_name.rstrip('/')}") as progress:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self.download_file, file_info, directory_name, progress): index
+                    for index, file_info in enumerate(files)
+                }
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        results[index] = future.result()
+                    except Exception as e:
+                        logger.error(f"Falha no download de {files[index]['name']}: {e}")
+                        continue
+                    with self._progress_lock:
+                        progress.set_postfix(arquivos=f"{len(results)}/{len(files)}")
+                    if on_complete is not None:
+                        on_complete(files[index], results[index])
+        
+        return [results[index] for index in sorted(results)]
+    
+    def quarantine_file(self, file_path, directory_name, reason):
+        """
+        Move um ZIP corrompido para `downloads/.quarantine/<mês>/` e esquece
+        seus validadores HTTP, para que o próximo download o baixe de novo.
+        """
+        quarantine_dir = os.path.join(self.download_dir, QUARANTINE_DIR, directory_name.rstrip('/'))
+        os.makedirs(quarantine_dir, exist_ok=True)
+        target = os.path.join(quarantine_dir, os.path.basename(file_path))
+        os.replace(file_path, target)
+        file_url = urljoin(urljoin(self.base_url, directory_name), os.path.basename(file_path))
+        self.http_cache.remove(file_url)
+        month_url = urljoin(self.base_url, directory_name)
+        if self.http_cache.get(month_url):
+            self.http_cache.update(month_url, complete=False)
+        self.state.record(directory_name.rstrip('/'), DOWNLOAD, os.path.basename(file_path), target,
+                          status=QUARANTINED, error=reason)
+        logger.error(f"ZIP corrompido ({reason}), movido para quarentena: {target}")
+        return target
+    
+    def verify_files(self, file_paths, directory_name, max_workers=VERIFY_WORKERS):
+        """
+        Confere o CRC32 de vários ZIPs em paralelo (a descompressão e o CRC do
+        zlib liberam o GIL). Os corrompidos vão para a quarentena; retorna os
+        caminhos íntegros, na ordem de `file_paths`.
+        """
+        month = directory_name.rstrip('/')
+        # ZIPs já verificados e inalterados em disco (manifesto) não são relidos
+        zip_paths = [file_path for file_path in file_paths if file_path.lower().endswith('.zip')
+                     and not self.state.is_done(month, VERIFY, os.path.basename(file_path), file_path)]
+        if not zip_paths:
+            return list(file_paths)
+        logger.info(f"Verificando a integridade de {len(zip_paths)} ZIP(s)...")
+        with stage('verificacao', arquivos=len(zip_paths)) as record, \
+                ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+            errors = dict(zip(zip_paths, executor.map(lambda path: verify_zip(path, self.chunk_size), zip_paths)))
+            record.add(bytes=sum(os.path.getsize(path) for path in zip_paths))
+            record.labels['corrompidos'] = sum(1 for error in errors.values() if error)
+        verified = []
+        for file_path in file_paths:
+            name = os.path.basename(file_path)
+            if errors.get(file_path):
+                self.state.record(month, VERIFY, name, status=FAILED, error=errors[file_path])
+                self.quarantine_file(file_path, directory_name, errors[file_path])
+                continue
+            if file_path in errors:
+                self.state.record(month, VERIFY, name, file_path, checksum=zip_fingerprint(file_path))
+            verified.append(file_path)
+        return verified
+    
+    def download_verified(self, files, directory_name, max_workers=None):
+        """
+        Baixa os arquivos e confere a integridade dos ZIPs; os corrompidos vão
+        para a quarentena e são baixados uma segunda vez. Retorna os caminhos
+        baixados e íntegros, na ordem de `files`.
+        """
+        verified = self.verify_files(self.download_files(files, directory_name, max_workers), directory_name)
+        names = {os.path.basename(file_path) for file_path in verified}
+        retry = [file_info for file_info in files if file_info['name'] not in names]
+        if retry:
+            logger.warning(f"Baixando novamente {len(retry)} arquivo(s) ausente(s) ou corrompido(s)")
+            verified += self.verify_files(self.download_files(retry, directory_name, max_workers), directory_name)
+        order = {file_info['name']: index for index, file_info in enumerate(files)}
+        return sorted(verified, key=lambda file_path: order.get(os.path.basename(file_path), len(order)))
+    
     def extract_file(self, file_path, directory_name):
-        """Extrai um arquivo compactado"""
+        """
+        Extrai um arquivo compactado. Cada membro é gravado em um arquivo
+        temporário oculto e só é renomeado após o CRC ser conferido, para que
+        uma extração interrompida não deixe CSVs truncados em 'extracted'.
+        """
         try:
             if not file_path.endswith('.zip'):
                 logger.info(f"Arquivo não é ZIP, pulando extração: {file_path}")
@@ -190,14 +770,25 @@ class CNPJDownloader:
             file_name = os.path.basename(file_path)
             logger.info(f"Extraindo: {file_name}")
             
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            with stage('extracao', arquivo=file_name) as record, zipfile.ZipFile(file_path, 'r') as zip_ref:
                 # Listar conteúdo antes de extrair
                 file_list = zip_ref.namelist()
                 logger.info(f"Arquivo contém {len(file_list)} itens")
                 
                 # Extrair com barra de progresso
                 for file_info in tqdm(zip_ref.infolist(), desc=f"Extraindo {file_name}"):
-                    zip_ref.extract(file_info, extract_month_dir)
+                    if file_info.is_dir():
+                        continue
+                    member = os.path.basename(file_info.filename)
+                    target = os.path.join(extract_month_dir, member)
+                    checksum = f'crc32:{file_info.CRC:08x}'
+                    month = directory_name.rstrip('/')
+                    if self.state.is_done(month, EXTRACT, member, target, checksum):
+                        logger.info(f"Já extraído e inalterado, pulando: {member}")
+                        continue
+                    self._extract_member(zip_ref, file_info, extract_month_dir)
+                    self.state.record(month, EXTRACT, member, target, checksum=checksum, source=file_name)
+                    record.add(bytes=file_info.file_size)
             
             logger.info(f"Extração concluída: {file_name}")
             
@@ -205,6 +796,23 @@ class CNPJDownloader:
             logger.error(f"Erro ao extrair arquivo {file_path}: {e}")
             raise
     
+    def _extract_member(self, zip_ref, file_info, extract_month_dir):
+        """Extrai um membro de forma atômica (temporário + os.replace)"""
+        target = os.path.join(extract_month_dir, os.path.basename(file_info.filename))
+        tmp_path = os.path.join(extract_month_dir, f".{os.path.basename(file_info.filename)}{PART_SUFFIX}")
+        try:
+            with zip_ref.open(file_info) as source, open(tmp_path, 'wb') as target_file:
+                while True:
+                    chunk = source.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    target_file.write(chunk)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
     def run(self):
         """Executa o processo completo de download e extração"""
         try:
@@ -220,27 +828,28 @@ class CNPJDownloader:
                 logger.warning("Nenhum arquivo encontrado para download")
                 return
             
-            # 3. Download dos arquivos
-            downloaded_files = []
-            for file_info in files:
-                try:
-                    file_path = self.download_file(file_info, latest_directory)
-                    downloaded_files.append(file_path)
-                    # Pequena pausa para não sobrecarregar o servidor
-                    time.sleep(1)
-                except Exception as e:
-                    logger.error(f"Falha no download de {file_info['name']}: {e}")
-                    continue
+            if self.is_month_up_to_date(latest_directory, files):
+                logger.info(f"Nenhuma alteração em {latest_directory} desde a última execução, nada a fazer")
+                return
+            
+            # 3. Download dos arquivos (em paralelo, respeitando o limite global de taxa)
+            #    e verificação do CRC dos ZIPs, com quarentena dos corrompidos
+            downloaded_files = self.download_verified(files, latest_directory)
             
             # 4. Extração dos arquivos
             logger.info("Iniciando extração dos arquivos...")
+            extraction_failed = False
             for file_path in downloaded_files:
                 try:
                     self.extract_file(file_path, latest_directory)
                 except Exception as e:
                     logger.error(f"Falha na extração de {file_path}: {e}")
+                    extraction_failed = True
                     continue
             
+            if len(downloaded_files) == len(files) and not extraction_failed:
+                self.mark_month_complete(latest_directory)
+            
             logger.info("Processo concluído com sucesso!")
             logger.info(f"Arquivos baixados: {len(downloaded_files)}")
             logger.info(f"Diretório de downloads: {self.download_dir}")
@@ -252,6 +861,7 @@ class CNPJDownloader:
 
 def main():
     """Função principal"""
+    log_to_file()
     try:
         downloader = CNPJDownloader()
         downloader.run()
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Grafo de participações societárias a partir da tabela `socios`.
+
+Cada empresa (cnpj_basico) e cada sócio é um nó com um id inteiro. Sócios
+pessoa jurídica (cnpj_cpf_socio com 14 dígitos) são o próprio nó da empresa
+sócia, o que permite seguir cadeias de participação. Pessoas físicas são
+identificadas pelo CPF mascarado e o nome, como publicados pela Receita;
+sócios estrangeiros, pelo nome.
+
+As arestas sócio -> empresa ficam em formato CSR (offsets + destinos, em
+vetores .npy abertos com mmap), nos dois sentidos:
+
+    <parquet>/_graph/nodes.arrow          tipo, chave e nome de cada nó (Arrow IPC, mmap)
+    <parquet>/_graph/down.*.npy           empresas de cada sócio
+    <parquet>/_graph/up.*.npy             sócios de cada empresa
+    <parquet>/_graph/components.*.npy     grupos de nós conectados
+    <parquet>/_graph/lookup.*.npy         hash da chave -> id, para achar os nós
+
+    from cnpj_graph import SociosGraph
+    SociosGraph().ownership_chain('41273593', direction='up', depth=3)
+"""
+import os
+import json
+import logging
+import argparse
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from parquet_dataset import table_path, parquet_files, open_dataset
+from cnpj_index import PARQUET_DIR, manifest_entry, check_manifest, normalize_cnpj, normalize_socio, hash_values
+
+logger = logging.getLogger(__name__)
+
+GRAPH_DIRNAME = '_graph'
+
+# Tipos de nó (prefixo da identidade do nó durante a construção)
+EMPRESA = 'E'
+PESSOA_FISICA = 'P'
+ESTRANGEIRO = 'X'
+
+# Separa tipo, chave e nome na identidade de um nó; não aparece em nomes,
+# ao contrário de ':' (ex: sócios estrangeiros)
+SEPARATOR = '\x1f'
+
+MAX_DEPTH = 10  # Níveis máximos percorridos em ownership_chain
+
+
+def graph_dir(parquet_dir=PARQUET_DIR):
+    """Diretório do grafo de uma pasta Parquet"""
+    return os.path.join(parquet_dir, GRAPH_DIRNAME)
+
+
+def _identities(batch):
+    """Identidades (texto) do sócio e da empresa de cada linha de um lote de socios"""
+    basico = batch.column('cnpj_basico').cast(pa.string())
+    documento = pc.fill_null(batch.column('cnpj_cpf_socio').cast(pa.string()), '')
+    nome = pc.fill_null(batch.column('nome_socio_razao_social').cast(pa.string()), '')
+
+    empresa = pc.binary_join_element_wise(EMPRESA, basico, SEPARATOR)
+    socio_pj = pc.binary_join_element_wise(EMPRESA, pc.utf8_slice_codeunits(documento, 0, 8), SEPARATOR)
+    socio_pf = pc.binary_join_element_wise(PESSOA_FISICA, documento, nome, SEPARATOR)
+    socio_estrangeiro = pc.binary_join_element_wise(ESTRANGEIRO, nome, SEPARATOR)
+
+    is_pj = pc.match_substring_regex(documento, r'^\d{14}$')
+    is_pf = pc.match_substring_regex(documento, r'[\d*]')
+    socio = pc.if_else(is_pj, socio_pj, pc.if_else(is_pf, socio_pf, socio_estrangeiro))
+    return socio, empresa, nome
+
+
+def _node_attributes(identities):
+    """Tipo e chave (cnpj_basico, CPF mascarado ou nome) de cada identidade de nó"""
+    parts = pc.split_pattern(identities, SEPARATOR, max_splits=2)
+    tipo = pc.list_element(parts, 0)
+    chave = pc.list_element(parts, 1)
+    return tipo, chave
+
+
+def _csr(sources, targets, num_nodes):
+    """Offsets e destinos em CSR das arestas, ordenadas pela origem"""
+    order = np.lexsort((targets, sources))
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(sources, minlength=num_nodes))
+    return offsets, targets[order].astype(np.int32)
+
+
+def connected_components(sources, targets, num_nodes):
+    """Rótulo do componente conexo de cada nó (o menor id do componente)"""
+    labels = np.arange(num_nodes, dtype=np.int64)
+    while True:
+        previous = labels.copy()
+        smallest = np.minimum(labels[sources], labels[targets])
+        np.minimum.at(labels, sources, smallest)
+        np.minimum.at(labels, targets, smallest)
+        # Salta ponteiros até cada nó apontar para a raiz do seu rótulo
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def _save(output_dir, name, array):
+    tmp_path = os.path.join(output_dir, f'{name}.tmp.npy')
+    np.save(tmp_path, array)
+    os.replace(tmp_path, os.path.join(output_dir, f'{name}.npy'))
+
+
+def build_graph(parquet_dir=PARQUET_DIR):
+    """Constrói o grafo a partir da tabela socios; retorna {'nos': n, 'arestas': m}"""
+    path = table_path(parquet_dir, 'socios')
+    if path is None:
+        raise FileNotFoundError(f"Tabela 'socios' não encontrada em {parquet_dir}.")
+    logger.info("--- Construindo grafo de sócios ---")
+
+    socios, empresas, nomes = [], [], []
+    columns = ['cnpj_basico', 'cnpj_cpf_socio', 'nome_socio_razao_social']
+    for batch in open_dataset(path).to_batches(columns=columns):
+        if batch.num_rows:
+            socio, empresa, nome = _identities(batch)
+            socios.append(socio)
+            empresas.append(empresa)
+            nomes.append(nome)
+    socios = pa.chunked_array(socios, pa.string()).combine_chunks()
+    empresas = pa.chunked_array(empresas, pa.string()).combine_chunks()
+    nomes = pa.chunked_array(nomes, pa.string()).combine_chunks()
+
+    # Ids dos nós: identidades distintas em ordem
+    identities = pc.unique(pa.concat_arrays([socios, empresas]))
+    identities = identities.take(pc.array_sort_indices(identities))
+    sources = pc.index_in(socios, value_set=identities).to_numpy().astype(np.int64)
+    targets = pc.index_in(empresas, value_set=identities).to_numpy().astype(np.int64)
+    edges = np.unique(sources << 32 | targets)
+    sources, targets = edges >> 32, edges & 0xFFFFFFFF
+    num_nodes = len(identities)
+
+    # Nome de cada nó: razão social das empresas, ou o nome como sócio
+    tipo, chave = _node_attributes(identities)
+    nome = nomes.take(pc.index_in(identities, value_set=socios))
+    empresas_path = table_path(parquet_dir, 'empresas')
+    if empresas_path is not None:
+        table = open_dataset(empresas_path).to_table(columns=['cnpj_basico', 'razao_social'])
+        ids = pc.binary_join_element_wise(EMPRESA, table.column('cnpj_basico').cast(pa.string()), SEPARATOR)
+        razao = table.column('razao_social').cast(pa.string()).take(pc.index_in(identities, value_set=ids))
+        nome = pc.if_else(pc.is_valid(razao), razao, nome)
+
+    output_dir = graph_dir(parquet_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    nodes = pa.table({'tipo': tipo, 'chave': chave, 'nome': nome})
+    tmp_path = os.path.join(output_dir, 'nodes.tmp.arrow')
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, nodes.schema) as writer:
+        writer.write_table(nodes)
+    os.replace(tmp_path, os.path.join(output_dir, 'nodes.arrow'))
+
+    for name, (edge_sources, edge_targets) in {'down': (sources, targets), 'up': (targets, sources)}.items():
+        offsets, neighbors = _csr(edge_sources, edge_targets, num_nodes)
+        _save(output_dir, f'{name}.offsets', offsets)
+        _save(output_dir, f'{name}.targets', neighbors)
+
+    labels = connected_components(sources, targets, num_nodes)
+    order = np.argsort(labels, kind='stable')
+    _save(output_dir, 'components.labels', labels.astype(np.int32))
+    _save(output_dir, 'components.order', order.astype(np.int32))
+
+    keys = hash_values(chave.to_pylist())
+    order = np.argsort(keys, kind='stable')
+    _save(output_dir, 'lookup.keys', keys[order])
+    _save(output_dir, 'lookup.ids', order.astype(np.int32))
+
+    manifest = {'nodes': num_nodes, 'edges': int(len(sources)),
+                'tables': {'socios': manifest_entry(parquet_dir, parquet_files(path))}}
+    tmp_path = os.path.join(output_dir, 'graph.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(output_dir, 'graph.json'))
+    logger.info(f"Grafo de sócios: {num_nodes} nós, {len(sources)} arestas, {len(np.unique(labels))} componentes.")
+    return {'nos': num_nodes, 'arestas': int(len(sources))}
+
+
+class SociosGraph:
+    """Consultas ao grafo de build_graph, com os vetores abertos com mmap"""
+
+    def __init__(self, parquet_dir=PARQUET_DIR, check=True):
+        directory = graph_dir(parquet_dir)
+        manifest_path = os.path.join(directory, 'graph.json')
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"Grafo não encontrado em {directory}; execute build_graph primeiro.")
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if check:
+            check_manifest(parquet_dir, manifest['tables'])
+        self.nodes = pa.ipc.open_file(pa.memory_map(os.path.join(directory, 'nodes.arrow'))).read_all()
+        self.arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+            for name in ('down.offsets', 'down.targets', 'up.offsets', 'up.targets',
+                         'components.labels', 'components.order', 'lookup.keys', 'lookup.ids')
+        }
+        self._component_starts = None
+
+    def node(self, node_id):
+        """Dados de um nó: id, tipo ('E', 'P' ou 'X'), chave e nome"""
+        return {
+            'id': int(node_id),
+            'tipo': self.nodes.column('tipo')[node_id].as_py(),
+            'chave': self.nodes.column('chave')[node_id].as_py(),
+            'nome': self.nodes.column('nome')[node_id].as_py(),
+        }
+
+    def find(self, chave, tipo=None, nome=None):
+        """Ids dos nós com a chave (e, opcionalmente, o tipo e o nome)"""
+        keys, ids = self.arrays['lookup.keys'], self.arrays['lookup.ids']
+        key = hash_values([chave])[0]
+        start, end = np.searchsorted(keys, key, side='left'), np.searchsorted(keys, key, side='right')
+        found = []
+        for node_id in ids[start:end].tolist():
+            node = self.node(node_id)
+            if node['chave'] != chave or (tipo and node['tipo'] != tipo):
+                continue
+            if nome and (node['nome'] or '').upper() != nome.upper():
+                continue
+            found.append(node_id)
+        return found
+
+    def find_company(self, cnpj):
+        """Id do nó de uma empresa, ou None"""
+        basico, _ = normalize_cnpj(cnpj)
+        found = self.find(basico, EMPRESA)
+        return found[0] if found else None
+
+    def find_partner(self, cpf_cnpj, nome=None):
+        """Ids dos nós de um sócio: CNPJ (a própria empresa), CPF (com o nome, se informado) ou nome estrangeiro"""
+        value = normalize_socio(cpf_cnpj)
+        if len(value) == 14 and value.isdigit():
+            node_id = self.find_company(value)
+            return [node_id] if node_id is not None else []
+        if value:
+            return self.find(value, PESSOA_FISICA, nome)
+        return self.find(str(cpf_cnpj).strip(), ESTRANGEIRO)
+
+    def neighbors(self, node_id, direction='down'):
+        """Nós vizinhos: 'down' = empresas de que o nó é sócio; 'up' = sócios da empresa"""
+        offsets = self.arrays[f'{direction}.offsets']
+        return self.arrays[f'{direction}.targets'][offsets[node_id]:offsets[node_id + 1]]
+
+    def companies_of(self, cpf_cnpj, nome=None):
+        """Empresas das quais o sócio participa"""
+        ids = {int(target) for node_id in self.find_partner(cpf_cnpj, nome) for target in self.neighbors(node_id)}
+        return [self.node(node_id) for node_id in sorted(ids)]
+
+    def partners_of(self, cnpj):
+        """Sócios de uma empresa"""
+        node_id = self.find_company(cnpj)
+        if node_id is None:
+            return []
+        return [self.node(target) for target in self.neighbors(node_id, 'up')]
+
+    def ownership_chain(self, cnpj, direction='up', depth=3):
+        """
+        Percorre as participações a partir de uma empresa, até `depth` níveis:
+        'up' segue os sócios (quem controla), 'down' as empresas investidas.
+        Retorna as arestas [{'nivel', 'socio', 'empresa'}] em ordem de nível.
+        """
+        if direction not in ('up', 'down'):
+            raise ValueError(f"Direção inválida: {direction}")
+        start = self.find_company(cnpj)
+        if start is None:
+            return []
+        visited = {start}
+        frontier = [start]
+        chain = []
+        for level in range(1, min(depth, MAX_DEPTH) + 1):
+            next_frontier = []
+            for node_id in frontier:
+                for target in self.neighbors(node_id, direction).tolist():
+                    socio, empresa = (target, node_id) if direction == 'up' else (node_id, target)
+                    chain.append({'nivel': level, 'socio': self.node(socio), 'empresa': self.node(empresa)})
+                    if target not in visited:
+                        visited.add(target)
+                        next_frontier.append(target)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return chain
+
+    def component(self, cnpj):
+        """Nós do grupo (componente conexo) de uma empresa"""
+        node_id = self.find_company(cnpj)
+        if node_id is None:
+            return []
+        labels, order = self.arrays['components.labels'], self.arrays['components.order']
+        if self._component_starts is None:
+            self._component_starts = np.asarray(labels[order])
+        label = labels[node_id]
+        start = np.searchsorted(self._component_starts, label, side='left')
+        end = np.searchsorted(self._component_starts, label, side='right')
+        return [self.node(member) for member in order[start:end].tolist()]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="Grafo de participações societárias dos dados do CNPJ.")
+    parser.add_argument('--parquet-dir', default=PARQUET_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="constrói o grafo a partir da tabela socios")
+    for command, help_text in (('empresas', "empresas de um sócio (CPF ou CNPJ)"),
+                               ('cadeia', "cadeia de participações de uma empresa"),
+                               ('grupo', "grupo (componente conexo) de uma empresa")):
+        command_parser = subparsers.add_parser(command, help=help_text)
+        command_parser.add_argument('documento')
+    subparsers.choices['cadeia'].add_argument('--direction', choices=['up', 'down'], default='up')
+    subparsers.choices['cadeia'].add_argument('--depth', type=int, default=3)
+    subparsers.choices['empresas'].add_argument('--nome', help="nome do sócio pessoa física")
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_graph(args.parquet_dir)
+    else:
+        graph = SociosGraph(args.parquet_dir)
+        if args.command == 'empresas':
+            result = graph.companies_of(args.documento, args.nome)
+        elif args.command == 'cadeia':
+            result = graph.ownership_chain(args.documento, args.direction, args.depth)
+        else:
+            result = graph.component(args.documento)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+"""
+Histórico de vários meses dos dados do CNPJ, com consultas "como era em".
+
+Em vez de guardar um retrato completo por mês, cada mês ingerido grava só
+as versões novas das linhas (inseridas ou alteradas em relação ao mês
+anterior, comparadas como no delta.py) e fecha as versões alteradas ou
+removidas, no estilo SCD tipo 2:
+
+    <parquet>/_history/history.json                   meses ingeridos de cada tabela, com o esquema
+                                                      e a versão do hash das linhas
+    <parquet>/_history/<tabela>/<AAAA-MM>.parquet     versões novas do mês (coluna valido_de)
+    <parquet>/_history/<tabela>/versions-<AAAA-MM>.npy
+        uma entrada por versão, ordenada por (cnpj_basico, chave, valido_de):
+        hash da chave e da linha, valido_de, valido_ate e posição da linha
+
+Os arquivos de dados nunca são regravados; o fim da validade de cada versão
+(valido_ate, exclusivo) fica no vetor de versões, aberto com mmap nas
+consultas e substituído a cada mês ingerido. Os meses precisam ser
+ingeridos em ordem crescente.
+
+    from cnpj_history import HistoryStore
+    HistoryStore().as_of('41273593', '2023-06')
+"""
+import os
+import json
+import shutil
+import logging
+import argparse
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from metadata import LAYOUTS
+from delta import HASH_VERSION, row_hashes, compare, schema_signature, check_schemas
+from parquet_dataset import MONTH_PATTERN, table_path, open_dataset, months as parquet_months
+from cnpj_index import PARQUET_DIR, INDEX_TABLES, normalize_cnpj
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIRNAME = '_history'
+VALID_FROM = 'valido_de'
+VALID_TO = 'valido_ate'
+OPEN = np.iinfo(np.int32).max  # valido_ate de uma versão ainda vigente
+ROW_GROUP_SIZE = 100000  # Linhas por row group nos arquivos de versões
+MONTH_WORKERS = int(os.environ.get('CNPJ_MONTH_WORKERS', 2))  # Meses baixados ao mesmo tempo
+
+VERSION_DTYPE = np.dtype([
+    ('cnpj', '<u8'), ('key', '<u8'), ('hash', '<u8'),
+    ('valid_from', '<i4'), ('valid_to', '<i4'), ('file', '<u2'), ('row', '<u4'),
+])
+
+
+def history_dir(parquet_dir=PARQUET_DIR):
+    """Diretório do histórico de uma pasta Parquet"""
+    return os.path.join(parquet_dir, HISTORY_DIRNAME)
+
+
+def month_number(month):
+    """Número sequencial de um mês 'AAAA-MM' (ou de uma data 'AAAA-MM-DD')"""
+    month = str(month)[:7]
+    if not MONTH_PATTERN.match(month):
+        raise ValueError(f"Mês inválido: {month!r} (use AAAA-MM)")
+    year, number = map(int, month.split('-'))
+    if not 1 <= number <= 12:
+        raise ValueError(f"Mês inválido: {month!r} (use AAAA-MM)")
+    return year * 12 + number - 1
+
+
+def month_name(number):
+    """Mês 'AAAA-MM' de um número de month_number (None para uma versão vigente)"""
+    if number == OPEN:
+        return None
+    return f'{number // 12:04d}-{number % 12 + 1:02d}'
+
+
+def parse_months(spec):
+    """Meses de um intervalo 'AAAA-MM..AAAA-MM' (ou de um único mês), em ordem"""
+    start, _, end = spec.partition('..')
+    first, last = month_number(start), month_number(end or start)
+    if first > last:
+        raise ValueError(f"Intervalo invertido: {spec!r}")
+    return [month_name(number) for number in range(first, last + 1)]
+
+
+def _cnpj_numbers(batch):
+    """cnpj_basico de cada linha como inteiro (0 se a tabela não tem a coluna ou o valor não é numérico)"""
+    if 'cnpj_basico' not in batch.schema.names:
+        return np.zeros(batch.num_rows, dtype=np.uint64)
+    values = batch.column('cnpj_basico').cast(pa.string())
+    numeric = pc.fill_null(pc.match_substring_regex(values, r'^\d+$'), False)
+    return pc.if_else(numeric, values, '0').cast(pa.uint64()).to_numpy(zero_copy_only=False)
+
+
+def _month_rows(path, table_name):
+    """
+    (cnpj, chaves, hashes, posições) das linhas de uma tabela mensal,
+    ordenados pela chave. Chaves repetidas mantêm a última ocorrência.
+    """
+    cnpjs, keys, hashes = [], [], []
+    for batch in open_dataset(path).to_batches():
+        if batch.num_rows:
+            batch_keys, batch_hashes = row_hashes(batch, table_name)
+            cnpjs.append(_cnpj_numbers(batch))
+            keys.append(batch_keys)
+            hashes.append(batch_hashes)
+    if not keys:
+        empty = np.empty(0, dtype=np.uint64)
+        return empty, empty, empty, np.empty(0, dtype=np.int64)
+    cnpjs, keys, hashes = np.concatenate(cnpjs), np.concatenate(keys), np.concatenate(hashes)
+    positions = np.argsort(keys, kind='stable')
+    last = np.append(keys[positions][1:] != keys[positions][:-1], True)
+    if not last.all():
+        logger.warning(f"'{table_name}': {int((~last).sum())} linha(s) com chave repetida ignorada(s).")
+    positions = positions[last]
+    return cnpjs[positions], keys[positions], hashes[positions], positions
+
+
+def _write_versions(path, positions, month, output_path):
+    """
+    Copia para `output_path` as linhas da tabela nas posições `positions`
+    (ordenadas), com a coluna valido_de; retorna o total de linhas.
+    """
+    dataset = open_dataset(path)
+    schema = dataset.schema.append(pa.field(VALID_FROM, pa.string()))
+    tmp_path = output_path + '.tmp'
+    offset = 0
+    with pq.ParquetWriter(tmp_path, schema, compression='snappy') as writer:
+        for batch in dataset.to_batches():
+            start = np.searchsorted(positions, offset)
+            end = np.searchsorted(positions, offset + batch.num_rows)
+            if end > start:
+                selected = batch.take(pa.array(positions[start:end] - offset))
+                arrays = selected.columns + [pa.array([month] * selected.num_rows, pa.string())]
+                selected = pa.RecordBatch.from_arrays(arrays, schema=schema)
+                writer.write_table(pa.Table.from_batches([selected], schema=schema), row_group_size=ROW_GROUP_SIZE)
+            offset += batch.num_rows
+        if not len(positions):
+            writer.write_table(schema.empty_table())
+    os.replace(tmp_path, output_path)
+    return len(positions)
+
+
+def _read_manifest(directory):
+    path = os.path.join(directory, 'history.json')
+    if not os.path.exists(path):
+        return {'tables': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(directory, manifest):
+    tmp_path = os.path.join(directory, 'history.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, 'history.json'))
+
+
+def _save_array(path, array):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def ingest_table(parquet_dir, month, table_name, manifest):
+    """
+    Ingere a tabela de um mês (`<parquet>/<AAAA-MM>/<tabela>`) no histórico.
+    Atualiza `manifest` (gravado pelo chamador) e retorna as contagens
+    {'inseridas', 'alteradas', 'removidas', 'versoes'}, ou None se o mês já
+    foi ingerido.
+    """
+    info = manifest['tables'].setdefault(table_name, {'months': [], 'versions': None})
+    if month in info['months']:
+        logger.info(f"'{table_name}' de {month} já está no histórico, pulando.")
+        return None
+    number = month_number(month)
+    if info['months'] and number < month_number(info['months'][-1]):
+        raise ValueError(f"'{table_name}': {month} é anterior ao último mês do histórico "
+                         f"({info['months'][-1]}); os meses devem ser ingeridos em ordem.")
+
+    directory = os.path.join(history_dir(parquet_dir), table_name)
+    os.makedirs(directory, exist_ok=True)
+    if info['versions']:
+        versions = np.load(os.path.join(directory, info['versions']))
+    else:
+        versions = np.empty(0, dtype=VERSION_DTYPE)
+
+    path = table_path(os.path.join(parquet_dir, month), table_name)
+    signature = schema_signature(open_dataset(path).schema, table_name)
+    if info['months']:
+        # Os hashes gravados só são comparáveis com os de um mês com os mesmos tipos e a mesma função de hash
+        if info.get('hash') != HASH_VERSION:
+            raise ValueError(f"'{table_name}': histórico gravado com outra versão do hash das linhas; "
+                             f"recrie o histórico ({history_dir(parquet_dir)}) ingerindo os meses de novo.")
+        check_schemas(info['schema'], signature, table_name)
+    cnpjs, keys, hashes, positions = _month_rows(path, table_name)
+
+    # Versões vigentes, pela chave (no máximo uma por chave)
+    current = np.flatnonzero(versions['valid_to'] == OPEN)
+    current = current[np.argsort(versions['key'][current], kind='stable')]
+    inserted, updated, deleted = compare((versions['key'][current], versions['hash'][current]), (keys, hashes))
+
+    # Fecha as versões alteradas e removidas
+    closed = current[np.isin(versions['key'][current], np.concatenate([updated, deleted]))]
+    versions['valid_to'][closed] = number
+
+    # Grava as versões novas, na ordem das linhas do mês
+    new = np.isin(keys, np.concatenate([inserted, updated]))
+    order = np.argsort(positions[new])
+    _write_versions(path, positions[new][order], month, os.path.join(directory, f'{month}.parquet'))
+    added = np.empty(int(new.sum()), dtype=VERSION_DTYPE)
+    added['cnpj'] = cnpjs[new][order]
+    added['key'] = keys[new][order]
+    added['hash'] = hashes[new][order]
+    added['valid_from'] = number
+    added['valid_to'] = OPEN
+    added['file'] = len(info['months'])
+    added['row'] = np.arange(len(added))
+
+    versions = np.concatenate([versions, added])
+    versions = versions[np.lexsort((versions['valid_from'], versions['key'], versions['cnpj']))]
+    info['versions'] = f'versions-{month}.npy'
+    _save_array(os.path.join(directory, info['versions']), versions)
+    info['months'].append(month)
+    info['hash'], info['schema'] = HASH_VERSION, signature
+    counts = {'inseridas': int(len(inserted)), 'alteradas': int(len(updated)),
+              'removidas': int(len(deleted)), 'versoes': int(len(versions))}
+    info.setdefault('counts', {})[month] = counts
+    logger.info(f"Histórico '{table_name}' {month}: {counts['inseridas']} inseridas, "
+                f"{counts['alteradas']} alteradas, {counts['removidas']} removidas ({len(versions)} versões).")
+    return counts
+
+
+def ingest_month(month, parquet_dir=PARQUET_DIR, tables=None):
+    """
+    Ingere no histórico as tabelas convertidas de um mês
+    (`import_to_parquet.py --month AAAA-MM`). O manifesto só aponta para os
+    novos vetores de versões depois que todos foram gravados. Retorna
+    {tabela: contagens} das tabelas ingeridas.
+
+    As tabelas pedidas em `tables` (ou, sem `tables`, as que já estão no
+    histórico) precisam existir no mês: pular uma delas dataria as suas
+    mudanças no mês seguinte, então o mês é recusado antes de gravar.
+    """
+    month_number(month)
+    source_dir = os.path.join(parquet_dir, month)
+    if not os.path.isdir(source_dir):
+        raise FileNotFoundError(f"Mês não convertido: {source_dir}; execute import_to_parquet.py --month {month}.")
+    directory = history_dir(parquet_dir)
+    os.makedirs(directory, exist_ok=True)
+    manifest = _read_manifest(directory)
+    previous = {table_name: info['versions'] for table_name, info in manifest['tables'].items()}
+    expected = tables or [table_name for table_name, info in manifest['tables'].items() if info['months']]
+    missing = [table_name for table_name in expected
+               if month not in manifest['tables'].get(table_name, {}).get('months', [])
+               and table_path(source_dir, table_name) is None]
+    if missing:
+        raise FileNotFoundError(f"Tabela(s) ausente(s) em {source_dir}: {', '.join(missing)}; "
+                                f"converta o mês de novo antes de ingerir.")
+    summary = {}
+    for table_name in tables or LAYOUTS:
+        if table_path(source_dir, table_name) is None:
+            continue
+        counts = ingest_table(parquet_dir, month, table_name, manifest)
+        if counts is not None:
+            summary[table_name] = counts
+    _write_manifest(directory, manifest)
+
+    # Remove os vetores de versões substituídos
+    for table_name, name in previous.items():
+        if name and name != manifest['tables'][table_name]['versions']:
+            os.remove(os.path.join(directory, table_name, name))
+    return summary
+
+
+def ingest_months(months, downloader=None, workers=MONTH_WORKERS, prune=False, tables=None):
+    """
+    Baixa, converte e ingere no histórico uma lista de meses. Até `workers`
+    meses ficam baixando ou à espera da ingestão: a conversão e a ingestão
+    seguem a ordem dos meses, e cada mês ingerido libera o download do
+    próximo. Meses não publicados são pulados; um mês com falha (inclusive
+    uma tabela que não converteu) interrompe a ingestão dos seguintes (o
+    histórico exige a ordem). Com `prune`, as pastas Parquet e de downloads
+    de cada mês ingerido são removidas, exceto as do mês mais recente. Retorna {mês:
+    contagens por tabela ou {'erro': ...}}.
+    """
+    import requests
+    import import_to_parquet
+    from cnpj_downloader import CNPJDownloader
+
+    downloader = downloader or CNPJDownloader()
+    parquet_dir = import_to_parquet.PARQUET_DIR
+
+    def download(month):
+        directory = f'{month}/'
+        try:
+            files = downloader.get_files_from_directory(directory)
+        except requests.HTTPError as e:
+            # Mês não publicado pela Receita
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+        if not files:
+            return None
+        downloaded = downloader.download_verified(files, directory)
+        if len(downloaded) < len(files):
+            raise RuntimeError(f"{len(files) - len(downloaded)} arquivo(s) falharam no download ou estão corrompidos")
+        return downloaded
+
+    summary = {}
+    pending = iter(months)
+    window = deque()  # Meses baixando ou baixados e ainda não ingeridos
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        def fill():
+            for month in itertools.islice(pending, max(1, workers) - len(window)):
+                window.append((month, executor.submit(download, month)))
+
+        fill()
+        while window:
+            month, future = window.popleft()
+            try:
+                if future.result() is None:
+                    logger.warning(f"Nenhum arquivo encontrado para {month}, pulando.")
+                    fill()
+                    continue
+                failures = import_to_parquet.process_files_to_parquet(from_zip=True, month=month)
+                if failures.get(month):
+                    raise RuntimeError(f"Falha na conversão de {', '.join(failures[month])}")
+                summary[month] = ingest_month(month, parquet_dir, tables)
+            except Exception as e:
+                logger.error(f"Erro ao ingerir {month}: {e}", exc_info=True)
+                summary[month] = {'erro': str(e)}
+                for _, queued in window:
+                    queued.cancel()
+                break
+            if prune:
+                _prune_months(summary, parquet_dir, downloader)
+            fill()
+    return summary
+
+
+def _prune_months(summary, parquet_dir, downloader):
+    """Remove as pastas Parquet e de downloads dos meses ingeridos, exceto as do mais recente"""
+    latest = max(parquet_months(parquet_dir))
+    for ingested in summary:
+        if ingested == latest:
+            continue
+        for directory in (os.path.join(parquet_dir, ingested), os.path.join(downloader.download_dir, ingested)):
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+                logger.info(f"Pasta {directory} removida (mês mantido no histórico).")
+        downloader.state.forget(month=ingested)
+
+
+class HistoryStore:
+    """Consultas ao histórico, com os vetores de versões abertos com mmap"""
+
+    def __init__(self, parquet_dir=PARQUET_DIR):
+        self.directory = history_dir(parquet_dir)
+        manifest_path = os.path.join(self.directory, 'history.json')
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"Histórico não encontrado em {self.directory}; execute ingest_month primeiro.")
+        self.tables = _read_manifest(self.directory)['tables']
+        self._versions = {}
+
+    def months(self, table_name='empresas'):
+        """Meses ingeridos de uma tabela"""
+        return list(self.tables.get(table_name, {}).get('months', []))
+
+    def versions(self, table_name):
+        """Vetor de versões de uma tabela (mmap)"""
+        if table_name not in self._versions:
+            info = self.tables[table_name]
+            self._versions[table_name] = np.load(os.path.join(self.directory, table_name, info['versions']),
+                                                 mmap_mode='r')
+        return self._versions[table_name]
+
+    def _file_path(self, table_name, file_id):
+        return os.path.join(self.directory, table_name, f"{self.tables[table_name]['months'][file_id]}.parquet")
+
+    def _rows(self, table_name, entries):
+        """Linhas (dicts, com valido_de e valido_ate) das versões `entries`, na ordem dada"""
+        rows = [None] * len(entries)
+        for file_id in np.unique(entries['file']).tolist():
+            parquet_file = pq.ParquetFile(self._file_path(table_name, file_id))
+            metadata = parquet_file.metadata
+            starts = np.cumsum([0] + [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)])
+            row_groups = {}
+            for index in np.flatnonzero(entries['file'] == file_id).tolist():
+                row = int(entries['row'][index])
+                row_group = int(np.searchsorted(starts, row, side='right')) - 1
+                if row_group not in row_groups:
+                    row_groups[row_group] = parquet_file.read_row_group(row_group)
+                values = row_groups[row_group].slice(row - starts[row_group], 1).to_pylist()[0]
+                values[VALID_TO] = month_name(int(entries['valid_to'][index]))
+                rows[index] = values
+        return rows
+
+    def _company_versions(self, table_name, cnpj_basico):
+        versions = self.versions(table_name)
+        value = np.uint64(int(cnpj_basico))
+        start = np.searchsorted(versions['cnpj'], value, side='left')
+        end = np.searchsorted(versions['cnpj'], value, side='right')
+        return np.asarray(versions[start:end])
+
+    def history(self, cnpj, table_name='empresas'):
+        """Todas as versões das linhas de um CNPJ em uma tabela, por chave e valido_de"""
+        if table_name not in self.tables:
+            return []
+        basico, completo = normalize_cnpj(cnpj)
+        rows = self._rows(table_name, self._company_versions(table_name, basico))
+        return [row for row in rows if completo is None or _matches(row, completo)]
+
+    def as_of(self, cnpj, month, tables=None):
+        """
+        Como um CNPJ estava em um mês ('AAAA-MM' ou data): {tabela: linhas
+        vigentes}, para as tabelas com cnpj_basico (por padrão INDEX_TABLES).
+        Um CNPJ completo limita 'estabelecimentos' ao estabelecimento.
+        """
+        number = month_number(month)
+        basico, completo = normalize_cnpj(cnpj)
+        result = {}
+        for table_name in tables or INDEX_TABLES:
+            if table_name not in self.tables:
+                continue
+            entries = self._company_versions(table_name, basico)
+            entries = entries[(entries['valid_from'] <= number) & (number < entries['valid_to'])]
+            rows = self._rows(table_name, entries)
+            if completo is not None and table_name == 'estabelecimentos':
+                rows = [row for row in rows if _matches(row, completo)]
+            result[table_name] = rows
+        return result
+
+    def snapshot(self, table_name, month, columns=None):
+        """Tabela inteira como estava em um mês (pyarrow.Table), remontada a partir das versões"""
+        number = month_number(month)
+        versions = self.versions(table_name)
+        current = np.flatnonzero((versions['valid_from'] <= number) & (number < versions['valid_to']))
+        entries = np.asarray(versions[current])
+        parts = []
+        for file_id in np.unique(entries['file']).tolist() or [0]:
+            rows = np.sort(entries['row'][entries['file'] == file_id])
+            table = pq.read_table(self._file_path(table_name, file_id), columns=columns)
+            parts.append(table.take(pa.array(rows, pa.int64())))
+        return pa.concat_tables(parts)
+
+
+def _matches(row, completo):
+    """Indica se a linha de estabelecimentos é a do CNPJ completo (linhas sem cnpj_ordem sempre casam)"""
+    if 'cnpj_ordem' not in row:
+        return True
+    return f"{row['cnpj_basico']}{row['cnpj_ordem']}{row['cnpj_dv']}" == completo
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="Histórico de vários meses dos dados do CNPJ.")
+    parser.add_argument('--parquet-dir', default=PARQUET_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = subparsers.add_parser('ingest', help="ingere meses já convertidos (AAAA-MM ou AAAA-MM..AAAA-MM)")
+    ingest_parser.add_argument('meses')
+    ingest_parser.add_argument('--tables', nargs='+', choices=sorted(LAYOUTS), help="tabelas (padrão: todas)")
+    history_parser = subparsers.add_parser('historico', help="todas as versões de um CNPJ")
+    history_parser.add_argument('cnpj')
+    history_parser.add_argument('--tabela', default='empresas', choices=sorted(LAYOUTS))
+    as_of_parser = subparsers.add_parser('em', help="como um CNPJ estava em um mês")
+    as_of_parser.add_argument('cnpj')
+    as_of_parser.add_argument('mes', metavar='AAAA-MM')
+    args = parser.parse_args()
+    if args.command == 'ingest':
+        result = {month: ingest_month(month, args.parquet_dir, args.tables) for month in parse_months(args.meses)}
+    elif args.command == 'historico':
+        result = HistoryStore(args.parquet_dir).history(args.cnpj, args.tabela)
+    else:
+        result = HistoryStore(args.parquet_dir).as_of(args.cnpj, args.mes)
+    print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
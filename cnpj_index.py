@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de busca pontual por CNPJ sobre os arquivos Parquet.
+
+A construção lê apenas as colunas de chave das tabelas e grava, para cada
+uma, um vetor ordenado de chaves uint64 e as posições correspondentes
+(arquivo, row group, linha) em formato .npy. Na consulta esses vetores são
+abertos com mmap e percorridos por busca binária, e só os row groups que
+contêm o CNPJ procurado são lidos:
+
+    <parquet>/_index/index.json                    arquivos indexados de cada tabela
+    <parquet>/_index/<tabela>.keys.npy             chaves (cnpj_basico)
+    <parquet>/_index/<tabela>.rows.npy             posições de cada chave
+    <parquet>/_index/estabelecimentos_cnpj.*.npy   chave = CNPJ completo (14 dígitos)
+    <parquet>/_index/socios_cpf_cnpj.*.npy         chave = hash de cnpj_cpf_socio
+
+Row groups menores (`import_to_parquet.py --partition --row-group-size`)
+deixam cada consulta mais barata.
+
+    from cnpj_index import CNPJIndex
+    CNPJIndex().lookup('41.273.593/0001-50')
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from parquet_dataset import table_path, parquet_files, partition_values
+
+logger = logging.getLogger(__name__)
+
+PARQUET_DIR = 'parquet'
+INDEX_DIRNAME = '_index'
+INDEX_TABLES = ['empresas', 'estabelecimentos', 'socios', 'simples']
+CNPJ_KEY = 'estabelecimentos_cnpj'  # Índice pelo CNPJ completo
+SOCIO_KEY = 'socios_cpf_cnpj'  # Índice pelo CPF/CNPJ do sócio (hash de 64 bits)
+EXTRA_INDEXES = {'estabelecimentos': [CNPJ_KEY], 'socios': [SOCIO_KEY]}  # Além do índice por cnpj_basico
+ROW_GROUP_CACHE = 256  # Row groups decodificados mantidos em memória
+
+ROW_DTYPE = np.dtype([('file', '<u4'), ('row_group', '<u4'), ('row', '<u4')])
+
+
+def index_dir(parquet_dir=PARQUET_DIR):
+    """Diretório do índice de uma pasta Parquet"""
+    return os.path.join(parquet_dir, INDEX_DIRNAME)
+
+
+def normalize_cnpj(cnpj):
+    """
+    Remove a pontuação de um CNPJ e retorna (cnpj_basico, cnpj completo ou None).
+    Aceita o CNPJ básico (8 dígitos) ou completo (14 dígitos).
+    """
+    digits = re.sub(r'\D', '', str(cnpj))
+    if len(digits) == 14:
+        return digits[:8], digits
+    if 0 < len(digits) <= 8:
+        return digits.zfill(8), None
+    raise ValueError(f"CNPJ inválido: {cnpj!r}")
+
+
+def normalize_socio(cpf_cnpj):
+    """
+    Documento do sócio como gravado pela Receita: CNPJ com 14 dígitos ou
+    CPF mascarado (***NNNNNN**). Um CPF completo é mascarado.
+    """
+    value = str(cpf_cnpj).strip()
+    digits = re.sub(r'\D', '', value)
+    if len(digits) == 11 and '*' not in value:
+        return f'***{digits[3:9]}**'
+    if '*' in value:
+        return re.sub(r'[^\d*]', '', value)
+    return digits
+
+
+def hash_values(values):
+    """Hash de 64 bits de cada texto (chave do índice SOCIO_KEY)"""
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def _digits(array):
+    """Converte uma coluna de dígitos em uint64; valores não numéricos viram nulo"""
+    array = array.cast(pa.string())
+    valid = pc.fill_null(pc.match_substring_regex(array, r'^\d+$'), False)
+    return pc.if_else(valid, array, pa.scalar(None, pa.string())).cast(pa.uint64())
+
+
+def _uint64(value):
+    """Escalar uint64 para as operações do pyarrow.compute"""
+    return pa.scalar(value, pa.uint64())
+
+
+# Colunas lidas por cada índice; os demais usam apenas cnpj_basico
+KEY_COLUMNS = {
+    CNPJ_KEY: ['cnpj_basico', 'cnpj_ordem', 'cnpj_dv'],
+    SOCIO_KEY: ['cnpj_cpf_socio'],
+}
+
+
+def _index_keys(table, name):
+    """Retorna (chaves uint64, máscara das linhas válidas) de um row group"""
+    if name == SOCIO_KEY:
+        values = table.column('cnpj_cpf_socio').cast(pa.string()).combine_chunks()
+        valid = pc.is_valid(values).to_numpy(zero_copy_only=False)
+        return hash_values(values.filter(pc.is_valid(values)).to_pylist()), valid
+    key = _digits(table.column('cnpj_basico'))
+    if name == CNPJ_KEY:
+        ordem = pc.multiply(_digits(table.column('cnpj_ordem')), _uint64(100))
+        key = pc.add(pc.add(pc.multiply(key, _uint64(10 ** 6)), ordem), _digits(table.column('cnpj_dv')))
+    key = key.combine_chunks() if isinstance(key, pa.ChunkedArray) else key
+    valid = pc.is_valid(key).to_numpy(zero_copy_only=False)
+    return pc.fill_null(key, 0).to_numpy()[valid], valid
+
+
+def _file_entries(path, file_id, name):
+    """Gera (chaves, posições) do índice `name` para um arquivo Parquet, row group a row group"""
+    parquet_file = pq.ParquetFile(path)
+    for row_group in range(parquet_file.num_row_groups):
+        table = parquet_file.read_row_group(row_group, columns=KEY_COLUMNS.get(name, ['cnpj_basico']))
+        keys, valid = _index_keys(table, name)
+        rows = np.empty(len(keys), dtype=ROW_DTYPE)
+        rows['file'] = file_id
+        rows['row_group'] = row_group
+        rows['row'] = np.flatnonzero(valid)
+        yield keys, rows
+
+
+def file_signature(path):
+    """Tamanho e data de modificação, usados para detectar um índice desatualizado"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def manifest_entry(parquet_dir, files):
+    """Arquivos de uma tabela (relativos a `parquet_dir`) e suas assinaturas, para o manifesto de um índice"""
+    return {
+        'files': [os.path.relpath(file_path, parquet_dir) for file_path in files],
+        'signatures': [file_signature(file_path) for file_path in files],
+    }
+
+
+class StaleIndexError(ValueError):
+    """Os arquivos Parquet mudaram depois da construção do índice"""
+
+
+def check_manifest(parquet_dir, tables):
+    """Falha (StaleIndexError) se algum arquivo Parquet mudou depois da construção de um índice"""
+    for table_name, info in tables.items():
+        for relative, signature in zip(info['files'], info['signatures']):
+            path = os.path.join(parquet_dir, relative)
+            if not os.path.exists(path) or file_signature(path) != signature:
+                raise StaleIndexError(f"Índice desatualizado para '{table_name}' ({relative}); reconstrua o índice.")
+
+
+def manifest_signature(parquet_dir, tables):
+    """Assinatura atual dos arquivos Parquet de um manifesto; muda quando algum deles é trocado"""
+    parts = []
+    for table_name, info in sorted(tables.items()):
+        for relative in info['files']:
+            path = os.path.join(parquet_dir, relative)
+            parts.append(f"{relative}={file_signature(path) if os.path.exists(path) else '-'}")
+    return hashlib.sha1(';'.join(parts).encode()).hexdigest()[:16]
+
+
+def row_key(row, name):
+    """Chave de uma linha lida da tabela no índice `name` (como em _index_keys), ou None"""
+    if name == SOCIO_KEY:
+        value = row.get('cnpj_cpf_socio')
+        return None if value is None else int(hash_values([str(value)])[0])
+    values = [row.get(column) for column in KEY_COLUMNS.get(name, ['cnpj_basico'])]
+    if any(value is None or not str(value).isdigit() for value in values):
+        return None
+    if name == CNPJ_KEY:
+        basico, ordem, dv = (int(value) for value in values)
+        return basico * 10 ** 6 + ordem * 100 + dv
+    return int(values[0])
+
+
+def build_index(parquet_dir=PARQUET_DIR, tables=None):
+    """
+    Constrói o índice das tabelas com cnpj_basico (por padrão INDEX_TABLES)
+    e retorna {nome do índice: entradas}.
+    """
+    output_dir = index_dir(parquet_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {'parquet_dir': os.path.abspath(parquet_dir), 'tables': {}}
+    totals = {}
+
+    for table_name in tables or INDEX_TABLES:
+        path = table_path(parquet_dir, table_name)
+        if path is None:
+            logger.warning(f"Tabela '{table_name}' não encontrada em {parquet_dir}. Pulando.")
+            continue
+        logger.info(f"--- Indexando tabela: {table_name} ---")
+        files = parquet_files(path)
+        manifest['tables'][table_name] = manifest_entry(parquet_dir, files)
+        for name in [table_name] + EXTRA_INDEXES.get(table_name, []):
+            parts = [part for file_id, file_path in enumerate(files)
+                     for part in _file_entries(file_path, file_id, name)]
+            keys = np.concatenate([part[0] for part in parts]) if parts else np.empty(0, dtype=np.uint64)
+            rows = np.concatenate([part[1] for part in parts]) if parts else np.empty(0, dtype=ROW_DTYPE)
+            order = np.argsort(keys, kind='stable')
+            for suffix, array in (('keys', keys[order]), ('rows', rows[order])):
+                tmp_path = os.path.join(output_dir, f'{name}.{suffix}.tmp.npy')
+                np.save(tmp_path, array)
+                os.replace(tmp_path, os.path.join(output_dir, f'{name}.{suffix}.npy'))
+            totals[name] = len(keys)
+            logger.info(f"Índice '{name}': {len(keys)} entradas em {len(files)} arquivo(s).")
+
+    tmp_path = os.path.join(output_dir, 'index.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(output_dir, 'index.json'))
+    return totals
+
+
+class CNPJIndex:
+    """
+    Consulta pontual por CNPJ usando o índice de build_index. Os vetores
+    são abertos com mmap e os row groups lidos ficam em um cache LRU de
+    `cache_size` entradas; várias threads podem consultar o mesmo índice.
+    A chave de cada linha lida é conferida: se os arquivos mudaram depois
+    da abertura, a consulta falha com StaleIndexError em vez de devolver
+    outra empresa.
+    """
+
+    def __init__(self, parquet_dir=PARQUET_DIR, cache_size=ROW_GROUP_CACHE, check=True):
+        self.parquet_dir = parquet_dir
+        manifest_path = os.path.join(index_dir(parquet_dir), 'index.json')
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"Índice não encontrado em {index_dir(parquet_dir)}; execute build_index primeiro.")
+        with open(manifest_path, encoding='utf-8') as f:
+            self.tables = json.load(f)['tables']
+        if check:
+            check_manifest(parquet_dir, self.tables)
+
+        self.entries = {}
+        names = [name for table_name in self.tables for name in [table_name] + EXTRA_INDEXES.get(table_name, [])]
+        for name in names:
+            self.entries[name] = tuple(np.load(os.path.join(index_dir(parquet_dir), f'{name}.{suffix}.npy'),
+                                               mmap_mode='r') for suffix in ('keys', 'rows'))
+        self.cache_size = cache_size
+        self._files = {}
+        self._row_groups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _find(self, name, key):
+        """Posições (arquivo, row group, linha) do índice `name` com a chave `key`"""
+        keys, rows = self.entries[name]
+        start = np.searchsorted(keys, key, side='left')
+        end = np.searchsorted(keys, key, side='right')
+        return rows[start:end]
+
+    def _row_group(self, table_name, file_id, row_group):
+        """Row group decodificado (com cache LRU), com as colunas de partição lidas do caminho do arquivo"""
+        cache_key = (table_name, file_id, row_group)
+        with self._lock:
+            table = self._row_groups.get(cache_key)
+            if table is not None:
+                self._row_groups.move_to_end(cache_key)
+                return table
+            metadata, partitions = self._files.get((table_name, file_id), (None, None))
+        relative = self.tables[table_name]['files'][file_id]
+        file_path = os.path.join(self.parquet_dir, relative)
+        try:
+            # Um leitor por consulta (as consultas podem rodar em várias threads); o rodapé lido fica em cache
+            parquet_file = pq.ParquetFile(file_path, metadata=metadata)
+        except FileNotFoundError:
+            raise StaleIndexError(f"Índice desatualizado para '{table_name}' ({relative}); reconstrua o índice.")
+        if metadata is None:
+            partitions = partition_values(os.path.join(self.parquet_dir, table_name), file_path)
+            with self._lock:
+                self._files[(table_name, file_id)] = parquet_file.metadata, partitions
+        if row_group >= parquet_file.num_row_groups:
+            raise StaleIndexError(f"Índice desatualizado para '{table_name}'; reconstrua o índice.")
+        table = parquet_file.read_row_group(row_group)
+        for column, value in partitions.items():
+            if column not in table.column_names:
+                table = table.append_column(column, pa.array([value] * table.num_rows, pa.string()))
+        with self._lock:
+            self._row_groups[cache_key] = table
+            if len(self._row_groups) > self.cache_size:
+                self._row_groups.popitem(last=False)
+        return table
+
+    def _rows(self, table_name, index_name, key):
+        """Linhas de uma tabela com a chave `key` no índice `index_name`, como dicionários"""
+        if index_name not in self.entries:
+            return []
+        rows = []
+        for entry in self._find(index_name, np.uint64(key)):
+            table = self._row_group(table_name, int(entry['file']), int(entry['row_group']))
+            row = table.slice(int(entry['row']), 1).to_pylist()
+            # Arquivo trocado depois da abertura do índice (ex: novo mês publicado): a posição
+            # aponta para outra linha, que não pode ser devolvida no lugar da procurada
+            if not row or row_key(row[0], index_name) != int(key):
+                raise StaleIndexError(f"Índice desatualizado para '{table_name}'; reconstrua o índice.")
+            rows.extend(row)
+        return rows
+
+    def rows(self, table_name, cnpj, index_name=None):
+        """Linhas de uma tabela para a chave do CNPJ, como lista de dicionários"""
+        basico, full = normalize_cnpj(cnpj)
+        index_name = index_name or table_name
+        return self._rows(table_name, index_name, int(full if index_name == CNPJ_KEY else basico))
+
+    def partner(self, cpf_cnpj):
+        """Participações de um sócio (linhas de socios com o CPF/CNPJ informado)"""
+        value = normalize_socio(cpf_cnpj)
+        rows = self._rows('socios', SOCIO_KEY, hash_values([value])[0])
+        # Confere o valor para descartar colisões de hash
+        return [row for row in rows if row['cnpj_cpf_socio'] == value]
+
+    def lookup(self, cnpj):
+        """
+        Todos os dados de um CNPJ: a empresa, seus estabelecimentos (apenas
+        o informado, se o CNPJ for completo), sócios e opção pelo Simples.
+        Retorna None se o CNPJ não existir.
+        """
+        basico, full = normalize_cnpj(cnpj)
+        if full is not None:
+            estabelecimentos = self.rows('estabelecimentos', full, CNPJ_KEY)
+        else:
+            estabelecimentos = self.rows('estabelecimentos', basico)
+        empresa = self.rows('empresas', basico)
+        if not empresa and not estabelecimentos:
+            return None
+        simples = self.rows('simples', basico)
+        return {
+            'cnpj_basico': basico,
+            'empresa': empresa[0] if empresa else None,
+            'estabelecimentos': estabelecimentos,
+            'socios': self.rows('socios', basico),
+            'simples': simples[0] if simples else None,
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="Índice de busca pontual por CNPJ sobre os arquivos Parquet.")
+    parser.add_argument('--parquet-dir', default=PARQUET_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="constrói o índice")
+    lookup_parser = subparsers.add_parser('lookup', help="mostra os dados de um CNPJ")
+    lookup_parser.add_argument('cnpj')
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_index(args.parquet_dir)
+    else:
+        print(json.dumps(CNPJIndex(args.parquet_dir).lookup(args.cnpj), indent=2, ensure_ascii=False, default=str))
@@ -10,8 +10,9 @@ import sys
 import argparse
 import json
 from datetime import datetime
-from cnpj_downloader import CNPJDownloader
+from cnpj_downloader import CNPJDownloader, log_to_file
 from metadata import TABLE_NAMES  # Importa os nomes das tabelas
+from pipeline_state import PipelineState, state_path, EXTRACT, DONE
 
 # Diretórios padrão
 DOWNLOAD_DIR = "downloads"
@@ -39,9 +40,34 @@ def format_size(size_bytes):
     s = round(size_bytes / p, 2)
     return f"{s} {size_names[i]}"
 
+def show_manifest_status(state):
+    """Mostra o status a partir do manifesto do pipeline, sem percorrer os diretórios"""
+    print(f"📋 Manifesto do pipeline: {state.path}")
+    for month, stages in state.summary().items():
+        print(f"   └── {month or '(sem mês)'}")
+        for stage_name, totals in stages.items():
+            line = f"       ├── {stage_name}: {totals['concluidos']}/{totals['arquivos']} arquivo(s)"
+            if totals['bytes']:
+                line += f", {format_size(totals['bytes'])}"
+            if totals['linhas']:
+                line += f", {totals['linhas']:,} linhas"
+            if totals['erros']:
+                line += f", ❌ {totals['erros']} com erro"
+            print(f"{line} (atualizado em {totals['atualizado_em']})")
+    for row in state.files(status='erro') + state.files(status='quarentena'):
+        print(f"   ❌ {row['mes']}/{row['arquivo']} ({row['etapa']}, {row['status']}): {row['erro'] or ''}")
+
 def show_status():
     """Mostra o status dos downloads e extrações"""
     print("=== STATUS DOS DADOS CNPJ ===\n")
+
+    state = PipelineState(state_path(DOWNLOAD_DIR))
+    if state.exists():
+        show_manifest_status(state)
+        print()
+        if os.path.exists(LOG_FILE):
+            print(f"📄 Arquivo de Log: {LOG_FILE} ({format_size(os.path.getsize(LOG_FILE))})")
+        return
     
     # Verificar diretório de downloads
     if os.path.exists(DOWNLOAD_DIR):
@@ -111,6 +137,7 @@ def clean_extracted():
     if os.path.exists(EXTRACT_DIR):
         import shutil
         shutil.rmtree(EXTRACT_DIR)
+        PipelineState(state_path(DOWNLOAD_DIR)).forget(EXTRACT)
         print(f"🗑️  Diretório de extração removido: {EXTRACT_DIR}")
     else:
         print(f"❌ Diretório de extração não encontrado: {EXTRACT_DIR}")
@@ -135,25 +162,29 @@ def download_specific_month(year_month):
             print(f"❌ Nenhum arquivo encontrado para {year_month}")
             return
         
-        # Download dos arquivos
-        downloaded_files = []
-        for file_info in files:
-            try:
-                file_path = downloader.download_file(file_info, directory)
-                downloaded_files.append(file_path)
-            except Exception as e:
-                print(f"❌ Erro no download de {file_info['name']}: {e}")
-                continue
+        if downloader.is_month_up_to_date(directory, files):
+            print(f"✅ {year_month} já está atualizado, nada a baixar")
+            return
+        
+        # Download dos arquivos (em paralelo) e verificação do CRC dos ZIPs
+        downloaded_files = downloader.download_verified(files, directory)
+        if len(downloaded_files) < len(files):
+            print(f"❌ {len(files) - len(downloaded_files)} arquivo(s) falharam no download ou estão corrompidos")
         
         # Extração dos arquivos
         print("📦 Extraindo arquivos...")
+        extraction_failed = False
         for file_path in downloaded_files:
             try:
                 downloader.extract_file(file_path, directory)
             except Exception as e:
                 print(f"❌ Erro na extração de {file_path}: {e}")
+                extraction_failed = True
                 continue
         
+        if len(downloaded_files) == len(files) and not extraction_failed:
+            downloader.mark_month_complete(directory)
+        
         print(f"✅ Download e extração concluídos para {year_month}")
         
     except ValueError:
@@ -169,10 +200,13 @@ def list_files(file_type=None):
         
     print(f"📂 Listando arquivos em {EXTRACT_DIR}:\n")
 
-    all_files = []
-    for root, _, files in os.walk(EXTRACT_DIR):
-        for name in files:
-            all_files.append(os.path.join(root, name))
+    # Com o manifesto do pipeline, lista os arquivos registrados na extração
+    state = PipelineState(state_path(DOWNLOAD_DIR))
+    all_files = [row['caminho'] for row in state.files(stage=EXTRACT, status=DONE) if row['caminho']]
+    if not all_files:
+        for root, _, files in os.walk(EXTRACT_DIR):
+            for name in files:
+                all_files.append(os.path.join(root, name))
     
     if file_type:
         # Normalizar tipo para busca
@@ -201,6 +235,96 @@ def list_files(file_type=None):
             for f in sorted(all_files):
                 print(f"- {f}")
 
+def run_query(sql):
+    """Executa uma consulta SQL (ou mostra uma tabela/view) sobre os arquivos Parquet"""
+    from cnpj_query import query_command
+
+    try:
+        result = query_command(sql)
+        if result.empty:
+            print("Nenhuma linha encontrada.")
+        else:
+            print(result.to_string(index=False))
+        print(f"\n📊 {len(result)} linha(s)")
+    except Exception as e:
+        print(f"❌ Erro na consulta: {e}")
+
+def run_lookup(cnpj):
+    """Mostra todos os dados de um CNPJ usando o índice de busca pontual"""
+    from cnpj_index import CNPJIndex
+
+    try:
+        result = CNPJIndex().lookup(cnpj)
+        if result is None:
+            print(f"❌ CNPJ não encontrado: {cnpj}")
+        else:
+            print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
+    except Exception as e:
+        print(f"❌ Erro na busca: {e}")
+
+def run_search(text):
+    """Busca CNPJs por razão social, nome fantasia ou nome de sócio"""
+    from cnpj_search import NameIndex
+
+    try:
+        results = NameIndex().search(text)
+        if not results:
+            print("Nenhum CNPJ encontrado.")
+        for cnpj_basico, score in results:
+            print(f"- {cnpj_basico} ({score})")
+    except Exception as e:
+        print(f"❌ Erro na busca: {e}")
+
+def run_group(cnpj):
+    """Mostra os sócios de um CNPJ e os de seus sócios pessoa jurídica (cadeia de participações)"""
+    from cnpj_graph import SociosGraph
+
+    try:
+        chain = SociosGraph().ownership_chain(cnpj, direction='up')
+        if not chain:
+            print(f"❌ Nenhum sócio encontrado para o CNPJ: {cnpj}")
+        for edge in chain:
+            socio, empresa = edge['socio'], edge['empresa']
+            print(f"{'  ' * edge['nivel']}- {socio['nome']} ({socio['chave']}) -> {empresa['chave']}")
+    except Exception as e:
+        print(f"❌ Erro na consulta ao grafo: {e}")
+
+def download_month_range(spec, prune=False):
+    """Baixa, converte e ingere no histórico um intervalo de meses (formato: YYYY-MM..YYYY-MM)"""
+    from cnpj_history import ingest_months, parse_months, MONTH_WORKERS
+
+    try:
+        months = parse_months(spec)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    print(f"📥 Baixando {len(months)} mês(es), {MONTH_WORKERS} por vez: {months[0]} a {months[-1]}")
+    for month, result in ingest_months(months, prune=prune).items():
+        if 'erro' in result:
+            print(f"❌ {month}: {result['erro']}")
+            continue
+        changes = sum(counts['inseridas'] + counts['alteradas'] + counts['removidas'] for counts in result.values())
+        print(f"✅ {month}: {changes} mudança(s) em {len(result)} tabela(s)")
+
+def run_as_of(cnpj, month):
+    """Mostra como um CNPJ estava em um mês, a partir do histórico"""
+    from cnpj_history import HistoryStore
+
+    try:
+        result = HistoryStore().as_of(cnpj, month)
+        if not any(result.values()):
+            print(f"❌ CNPJ {cnpj} não encontrado no histórico em {month}")
+            return
+        print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
+    except Exception as e:
+        print(f"❌ Erro na consulta ao histórico: {e}")
+
+def scan_files():
+    """Registra no manifesto do pipeline os arquivos já baixados e extraídos"""
+    state = PipelineState(state_path(DOWNLOAD_DIR))
+    count = state.scan(DOWNLOAD_DIR, EXTRACT_DIR)
+    print(f"📋 {count} arquivo(s) registrados no manifesto: {state.path}")
+
 def main():
     """Função principal para gerenciar os dados"""
     if len(sys.argv) < 2:
@@ -211,6 +335,8 @@ def main():
 
     if command == "status":
         show_status()
+    elif command == "scan":
+        scan_files()
     elif command == "clean-all":
         clean_downloads()
         clean_extracted()
@@ -218,11 +344,27 @@ def main():
         clean_downloads()
     elif command == "clean-extracted":
         clean_extracted()
+    elif command == "download" and len(sys.argv) > 2 and ".." in sys.argv[2]:
+        import import_to_parquet
+        log_to_file()
+        import_to_parquet.log_to_file()
+        download_month_range(sys.argv[2], prune="--prune" in sys.argv[3:])
     elif command == "download" and len(sys.argv) > 2:
+        log_to_file()
         download_specific_month(sys.argv[2])
     elif command == "list":
         file_type = sys.argv[2] if len(sys.argv) > 2 else None
         list_files(file_type)
+    elif command == "query" and len(sys.argv) > 2:
+        run_query(" ".join(sys.argv[2:]))
+    elif command == "lookup" and len(sys.argv) > 2:
+        run_lookup(sys.argv[2])
+    elif command == "search" and len(sys.argv) > 2:
+        run_search(" ".join(sys.argv[2:]))
+    elif command == "group" and len(sys.argv) > 2:
+        run_group(sys.argv[2])
+    elif command == "asof" and len(sys.argv) > 3:
+        run_as_of(sys.argv[2], sys.argv[3])
     else:
         show_help()
 
@@ -231,11 +373,19 @@ def show_help():
     print("Uso: python cnpj_manager.py <comando> [argumento]")
     print("\nComandos disponíveis:")
     print("  status               - Mostra o status dos downloads e extrações")
+    print("  scan                 - Registra no manifesto os arquivos já baixados e extraídos")
     print("  clean-all            - Remove os diretórios 'downloads' e 'extracted'")
     print("  clean-downloads      - Remove o diretório 'downloads'")
     print("  clean-extracted      - Remove o diretório 'extracted'")
     print("  download <YYYY-MM>   - Baixa e extrai dados de um mês específico")
+    print("  download <YYYY-MM..YYYY-MM> [--prune]")
+    print("                       - Baixa, converte e ingere no histórico um intervalo de meses")
     print("  list [tipo]          - Lista arquivos extraídos (filtra por tipo, ex: 'empresas')")
+    print("  query <SQL|tabela>   - Consulta os arquivos Parquet com DuckDB (ex: vw_estatisticas_uf)")
+    print("  lookup <CNPJ>        - Mostra empresa, estabelecimentos, sócios e Simples de um CNPJ")
+    print("  search <nome>        - Busca CNPJs por razão social, nome fantasia ou sócio")
+    print("  group <CNPJ>         - Mostra a cadeia de sócios de um CNPJ (grafo de sócios)")
+    print("  asof <CNPJ> <YYYY-MM> - Mostra como um CNPJ estava em um mês (histórico)")
     print("  help                 - Mostra esta ajuda")
 
 if __name__ == "__main__":
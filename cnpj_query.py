@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Consultas SQL sobre os arquivos Parquet com DuckDB, sem servidor de banco.
+
+Cada tabela convertida pelo import_to_parquet é registrada como view do
+DuckDB (arquivo único ou dataset particionado), e sobre elas são criadas
+views equivalentes às do database_schema.sql:
+
+- vw_estabelecimentos_completos: estabelecimentos com dados da empresa e
+  descrições de CNAE, município e natureza jurídica;
+- vw_empresas_ativas: empresas com a matriz ativa e contagem de estabelecimentos;
+- vw_estatisticas_uf: totais de empresas e estabelecimentos por UF.
+
+Nos arquivos da Receita a situação cadastral e a UF ficam nos
+estabelecimentos; a situação da empresa é a de sua matriz.
+
+    from cnpj_query import query
+    query("SELECT uf, total_estabelecimentos FROM vw_estatisticas_uf ORDER BY 2 DESC")
+"""
+import os
+import logging
+import argparse
+
+from metadata import LAYOUTS
+from parquet_dataset import table_path, partition_columns
+
+try:
+    import duckdb
+except ImportError:  # DuckDB é opcional: só é necessário para as consultas
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+PARQUET_DIR = 'parquet'
+
+# Tabelas registradas além das de metadata.LAYOUTS (geradas na conversão)
+DERIVED_TABLES = {
+    'cnaes_secundarios': ['cnpj_basico', 'cnpj_ordem', 'cnpj_dv', 'cnae_secundario', 'cnae_secundario_descricao'],
+}
+
+ATIVA = "est.situacao_cadastral = '02'"
+MATRIZ = "CAST(est.identificador_matriz_filial AS VARCHAR) = '1'"
+
+VIEWS = {
+    'vw_estabelecimentos_completos': """
+        SELECT
+            est.*,
+            est.cnpj_basico || est.cnpj_ordem || est.cnpj_dv AS cnpj,
+            e.razao_social,
+            e.natureza_juridica,
+            nj.descricao AS natureza_juridica_descricao,
+            e.porte_empresa,
+            e.capital_social,
+            c.descricao AS cnae_descricao,
+            m.descricao AS municipio_nome
+        FROM estabelecimentos est
+        JOIN empresas e ON est.cnpj_basico = e.cnpj_basico
+        LEFT JOIN cnaes c ON CAST(est.cnae_fiscal_principal AS VARCHAR) = c.codigo
+        LEFT JOIN municipios m ON CAST(est.municipio AS VARCHAR) = m.codigo
+        LEFT JOIN naturezas_juridicas nj ON CAST(e.natureza_juridica AS VARCHAR) = nj.codigo
+    """,
+    'vw_empresas_ativas': f"""
+        SELECT
+            e.*,
+            COUNT(*) AS total_estabelecimentos,
+            COUNT(*) FILTER (WHERE {ATIVA}) AS estabelecimentos_ativos
+        FROM empresas e
+        JOIN estabelecimentos est ON e.cnpj_basico = est.cnpj_basico
+        GROUP BY ALL
+        HAVING bool_or({MATRIZ} AND {ATIVA})
+    """,
+    'vw_estatisticas_uf': f"""
+        SELECT
+            est.uf,
+            COUNT(DISTINCT est.cnpj_basico) AS total_empresas,
+            COUNT(*) AS total_estabelecimentos,
+            COUNT(DISTINCT est.cnpj_basico) FILTER (WHERE {MATRIZ} AND {ATIVA}) AS empresas_ativas,
+            COUNT(*) FILTER (WHERE {ATIVA}) AS estabelecimentos_ativos
+        FROM estabelecimentos est
+        GROUP BY est.uf
+    """,
+}
+
+
+def _sql_string(value):
+    """Literal de string SQL"""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def table_source(parquet_dir, table_name, columns):
+    """SELECT que lê a tabela Parquet, ou uma tabela vazia com as colunas do layout"""
+    path = table_path(parquet_dir, table_name)
+    if path is None:
+        return 'SELECT ' + ', '.join(f'NULL::VARCHAR AS {column}' for column in columns) + ' WHERE false'
+    if os.path.isfile(path):
+        return f'SELECT * FROM read_parquet({_sql_string(path)})'
+    pattern = os.path.join(path, '**', '*.parquet')
+    # Colunas de partição como texto, preservando zeros à esquerda (ex: cnpj_prefixo=01)
+    hive = ', hive_partitioning = true, hive_types_autocast = false' if partition_columns(path) else ''
+    return f'SELECT * FROM read_parquet({_sql_string(pattern)}{hive})'
+
+
+def connect(parquet_dir=PARQUET_DIR, database=':memory:'):
+    """Abre uma conexão DuckDB com as tabelas Parquet e as views registradas"""
+    if duckdb is None:
+        raise ImportError("As consultas requerem o pacote duckdb (pip install duckdb)")
+    conn = duckdb.connect(database)
+    for table_name, columns in {**LAYOUTS, **DERIVED_TABLES}.items():
+        conn.execute(f'CREATE OR REPLACE VIEW {table_name} AS {table_source(parquet_dir, table_name, columns)}')
+    for view_name, sql in VIEWS.items():
+        conn.execute(f'CREATE OR REPLACE VIEW {view_name} AS {sql}')
+    return conn
+
+
+def query(sql, params=None, parquet_dir=PARQUET_DIR):
+    """Executa uma consulta sobre as tabelas Parquet e retorna um DataFrame"""
+    conn = connect(parquet_dir)
+    try:
+        return conn.execute(sql, params or []).df()
+    finally:
+        conn.close()
+
+
+def query_command(sql, parquet_dir=PARQUET_DIR, limit=20):
+    """
+    Consulta usada pela linha de comando: aceita SQL ou o nome de uma
+    tabela/view (mostra as primeiras `limit` linhas).
+    """
+    name = sql.strip()
+    if name in LAYOUTS or name in DERIVED_TABLES or name in VIEWS:
+        sql = f'SELECT * FROM {name} LIMIT {int(limit)}'
+    return query(sql, parquet_dir=parquet_dir)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="Consulta os arquivos Parquet do CNPJ com DuckDB.")
+    parser.add_argument('sql', help="consulta SQL ou nome de uma tabela/view")
+    parser.add_argument('--parquet-dir', default=PARQUET_DIR)
+    parser.add_argument('--limit', type=int, default=20, help="linhas mostradas ao consultar uma tabela/view")
+    args = parser.parse_args()
+    print(query_command(args.sql, args.parquet_dir, args.limit).to_string(index=False))
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Busca por nome (razão social, nome fantasia e nome do sócio) sobre os
+arquivos Parquet, com um índice invertido construído offline.
+
+Os nomes são normalizados (sem acentos, em maiúsculas) e separados em
+palavras. Para cada campo de SEARCH_FIELDS o índice guarda:
+
+    <parquet>/_search/<campo>.vocab.npy     palavras distintas, em ordem
+    <parquet>/_search/<campo>.offsets.npy   início da lista de cada palavra
+    <parquet>/_search/<campo>.postings.npy  cnpj_basico (uint32) ordenados, por palavra
+
+A busca de uma palavra é uma busca binária no vocabulário (um intervalo,
+para prefixos), e o resultado vem da interseção das listas de cnpj_basico.
+
+    from cnpj_search import NameIndex
+    NameIndex().search('padaria sao joao')
+"""
+import os
+import json
+import math
+import logging
+import argparse
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from parquet_dataset import table_path, parquet_files, open_dataset
+from cnpj_index import PARQUET_DIR, manifest_entry, check_manifest
+
+logger = logging.getLogger(__name__)
+
+SEARCH_DIRNAME = '_search'
+
+# Campo: (tabela, coluna, peso na ordenação)
+SEARCH_FIELDS = {
+    'razao_social': ('empresas', 'razao_social', 3.0),
+    'nome_fantasia': ('estabelecimentos', 'nome_fantasia', 2.0),
+    'nome_socio': ('socios', 'nome_socio_razao_social', 1.0),
+}
+
+MAX_TOKEN_LENGTH = 24  # Palavras maiores são truncadas (continuam achadas por prefixo)
+MIN_PREFIX_LENGTH = 3  # Palavras menores da consulta só casam por inteiro
+MAX_PREFIX_TERMS = 2000  # Palavras do vocabulário expandidas por um prefixo
+PREFIX_WEIGHT = 0.5  # Peso de uma palavra achada por prefixo, em relação à exata
+
+
+def search_dir(parquet_dir=PARQUET_DIR):
+    """Diretório do índice de nomes de uma pasta Parquet"""
+    return os.path.join(parquet_dir, SEARCH_DIRNAME)
+
+
+def normalize(array):
+    """Remove acentos e passa para maiúsculas uma coluna de nomes"""
+    array = pc.utf8_normalize(array.cast(pa.string()), 'NFKD')
+    return pc.utf8_upper(pc.replace_substring_regex(array, r'\p{M}', ''))
+
+
+def tokenize(array):
+    """Retorna (palavras, índice da linha de origem de cada palavra) de uma coluna de nomes"""
+    words = pc.split_pattern_regex(normalize(array), r'[^A-Z0-9]+')
+    tokens = pc.utf8_slice_codeunits(pc.list_flatten(words), 0, MAX_TOKEN_LENGTH)
+    parents = pc.list_parent_indices(words)
+    valid = pc.fill_null(pc.not_equal(tokens, ''), False)
+    return tokens.filter(valid), parents.filter(valid)
+
+
+def query_tokens(text):
+    """Palavras normalizadas de uma consulta"""
+    tokens, _ = tokenize(pa.array([text]))
+    return list(dict.fromkeys(tokens.to_pylist()))
+
+
+def _field_pairs(path, column):
+    """Pares (palavra, cnpj_basico) de uma coluna, lidos lote a lote"""
+    tokens, docs = [], []
+    for batch in open_dataset(path).to_batches(columns=['cnpj_basico', column]):
+        if not batch.num_rows:
+            continue
+        batch_tokens, parents = tokenize(batch.column(column))
+        basico = batch.column('cnpj_basico').cast(pa.string())
+        valid = pc.fill_null(pc.match_substring_regex(basico, r'^\d{1,8}$'), False)
+        basico = pc.if_else(valid, basico, pa.scalar(None, pa.string())).cast(pa.uint32())
+        batch_docs = basico.take(parents)
+        keep = pc.is_valid(batch_docs)
+        tokens.append(batch_tokens.filter(keep))
+        docs.append(batch_docs.filter(keep).to_numpy())
+    if not tokens:
+        return pa.array([], pa.string()), np.empty(0, dtype=np.uint32)
+    return pa.chunked_array(tokens, pa.string()).combine_chunks(), np.concatenate(docs)
+
+
+def build_field(parquet_dir, field):
+    """Constrói o índice invertido de um campo; retorna sua entrada no manifesto (ou None)"""
+    table_name, column, _ = SEARCH_FIELDS[field]
+    path = table_path(parquet_dir, table_name)
+    if path is None:
+        logger.warning(f"Tabela '{table_name}' não encontrada em {parquet_dir}. Pulando '{field}'.")
+        return None
+    logger.info(f"--- Indexando nomes: {field} ({table_name}.{column}) ---")
+
+    tokens, docs = _field_pairs(path, column)
+    vocabulary = pc.unique(tokens)
+    vocabulary = vocabulary.take(pc.array_sort_indices(vocabulary))
+    token_ids = pc.index_in(tokens, value_set=vocabulary).to_numpy().astype(np.int64)
+
+    # Ordena por (palavra, cnpj_basico) e remove pares repetidos
+    pairs = np.unique(token_ids << 32 | docs.astype(np.int64))
+    token_ids, postings = pairs >> 32, (pairs & 0xFFFFFFFF).astype(np.uint32)
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(token_ids, minlength=len(vocabulary)))
+
+    words = vocabulary.to_pylist()
+    arrays = {
+        'vocab': np.array(words, dtype=f'S{max([1] + [len(word) for word in words])}'),
+        'offsets': offsets,
+        'postings': postings,
+    }
+    output_dir = search_dir(parquet_dir)
+    for suffix, array in arrays.items():
+        tmp_path = os.path.join(output_dir, f'{field}.{suffix}.tmp.npy')
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(output_dir, f'{field}.{suffix}.npy'))
+    logger.info(f"'{field}': {len(vocabulary)} palavras, {len(postings)} ocorrências.")
+    return {
+        'table': table_name,
+        'documents': int(len(np.unique(postings))),
+        **manifest_entry(parquet_dir, parquet_files(path)),
+    }
+
+
+def build_search_index(parquet_dir=PARQUET_DIR, fields=None):
+    """Constrói o índice de nomes dos campos (por padrão todos de SEARCH_FIELDS)"""
+    os.makedirs(search_dir(parquet_dir), exist_ok=True)
+    manifest = {'fields': {}}
+    for field in fields or SEARCH_FIELDS:
+        info = build_field(parquet_dir, field)
+        if info is not None:
+            manifest['fields'][field] = info
+
+    tmp_path = os.path.join(search_dir(parquet_dir), 'search.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(search_dir(parquet_dir), 'search.json'))
+    return {field: info['documents'] for field, info in manifest['fields'].items()}
+
+
+class NameIndex:
+    """Busca por nome usando o índice de build_search_index (vetores abertos com mmap)"""
+
+    def __init__(self, parquet_dir=PARQUET_DIR, check=True):
+        manifest_path = os.path.join(search_dir(parquet_dir), 'search.json')
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"Índice de nomes não encontrado em {search_dir(parquet_dir)}; "
+                                    "execute build_search_index primeiro.")
+        with open(manifest_path, encoding='utf-8') as f:
+            self.fields = json.load(f)['fields']
+        if check:
+            check_manifest(parquet_dir, {info['table']: info for info in self.fields.values()})
+        self.arrays = {
+            field: {suffix: np.load(os.path.join(search_dir(parquet_dir), f'{field}.{suffix}.npy'), mmap_mode='r')
+                    for suffix in ('vocab', 'offsets', 'postings')}
+            for field in self.fields
+        }
+
+    def _term_range(self, field, token, prefix):
+        """Intervalo [início, fim) do vocabulário com a palavra (ou palavras com o prefixo)"""
+        vocab = self.arrays[field]['vocab']
+        key = token.encode('ascii')
+        start = int(np.searchsorted(vocab, key, side='left'))
+        if prefix and len(token) >= MIN_PREFIX_LENGTH:
+            end = int(np.searchsorted(vocab, key + b'\xff', side='left'))
+            return start, min(end, start + MAX_PREFIX_TERMS)
+        end = start + 1 if start < len(vocab) and vocab[start] == key else start
+        return start, end
+
+    def postings(self, field, token, prefix=False):
+        """Retorna (cnpj_basico, peso) dos documentos do campo com a palavra"""
+        start, end = self._term_range(field, token, prefix)
+        if start == end:
+            return np.empty(0, dtype=np.uint32), np.empty(0)
+        arrays = self.arrays[field]
+        offsets = arrays['offsets']
+        vocab = arrays['vocab']
+        exact = vocab[start] == token.encode('ascii')
+        parts, weights = [], []
+        for term in range(start, end):
+            docs = arrays['postings'][offsets[term]:offsets[term + 1]]
+            parts.append(docs)
+            weights.append(np.full(len(docs), 1.0 if exact and term == start else PREFIX_WEIGHT))
+        docs, weights = np.concatenate(parts), np.concatenate(weights)
+        # Mantém o maior peso de cada documento
+        order = np.lexsort((-weights, docs))
+        docs, weights = docs[order], weights[order]
+        first = np.append(True, docs[1:] != docs[:-1])
+        return docs[first], weights[first]
+
+    def search(self, text, limit=20, fields=None, prefix=True):
+        """
+        Busca os CNPJs cujos nomes contêm todas as palavras de `text` (a
+        última também por prefixo, com `prefix`). Retorna [(cnpj_basico,
+        pontuação)] ordenados pela pontuação: peso do campo x raridade da
+        palavra (idf), com palavras exatas valendo mais que prefixos.
+        """
+        tokens = query_tokens(text)
+        if not tokens:
+            return []
+        fields = [field for field in (fields or SEARCH_FIELDS) if field in self.fields]
+        matched = None
+        all_docs, all_scores = [], []
+        for position, token in enumerate(tokens):
+            is_prefix = prefix and position == len(tokens) - 1
+            term_docs = []
+            for field in fields:
+                docs, weights = self.postings(field, token, is_prefix)
+                if not len(docs):
+                    continue
+                idf = math.log(1 + self.fields[field]['documents'] / len(docs))
+                all_docs.append(docs)
+                all_scores.append(SEARCH_FIELDS[field][2] * idf * weights)
+                term_docs.append(docs)
+            docs = np.unique(np.concatenate(term_docs)) if term_docs else np.empty(0, dtype=np.uint32)
+            matched = docs if matched is None else np.intersect1d(matched, docs, assume_unique=True)
+            if not len(matched):
+                return []
+
+        # Soma as pontuações de cada documento encontrado por todas as palavras
+        docs, scores = np.concatenate(all_docs), np.concatenate(all_scores)
+        keep = np.isin(docs, matched)
+        unique_docs, inverse = np.unique(docs[keep], return_inverse=True)
+        totals = np.bincount(inverse, weights=scores[keep])
+        order = np.lexsort((unique_docs, -totals))[:limit]
+        return [(str(doc).zfill(8), round(float(score), 4)) for doc, score in zip(unique_docs[order], totals[order])]
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="Busca por nome sobre os arquivos Parquet do CNPJ.")
+    parser.add_argument('--parquet-dir', default=PARQUET_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="constrói o índice de nomes")
+    search_parser = subparsers.add_parser('search', help="busca CNPJs por nome")
+    search_parser.add_argument('texto')
+    search_parser.add_argument('--limit', type=int, default=20)
+    search_parser.add_argument('--fields', nargs='+', choices=sorted(SEARCH_FIELDS))
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_search_index(args.parquet_dir)
+    else:
+        for cnpj_basico, score in NameIndex(args.parquet_dir).search(args.texto, args.limit, args.fields):
+            print(f"{cnpj_basico}\t{score}")
@@ -3,48 +3,31 @@ import pandas as pd
 import streamlit as st
 import pyarrow.parquet as pq
 
+from aggregates import SUMMARY_NAME, aggregates_dir
+
 PARQUET_DIR = 'parquet'
+AGGREGATES_DIR = aggregates_dir(PARQUET_DIR)
 
 st.set_page_config(page_title='CNPJ Parquet Dashboard', layout='wide')
 st.title('📊 Dashboard de Estatísticas dos Arquivos Parquet do CNPJ')
 
-if not os.path.exists(PARQUET_DIR):
-    st.error(f"Diretório '{PARQUET_DIR}' não encontrado.")
-    st.stop()
-
-parquet_files = [f for f in os.listdir(PARQUET_DIR) if f.endswith('.parquet')]
-
-if not parquet_files:
-    st.warning('Nenhum arquivo Parquet encontrado na pasta ./parquet.')
+# O dashboard lê apenas os agregados pré-calculados pelo aggregates.py,
+# pequenos e independentes do tamanho dos dados
+if not os.path.exists(os.path.join(AGGREGATES_DIR, f'{SUMMARY_NAME}.parquet')):
+    st.error(f"Agregados não encontrados em '{AGGREGATES_DIR}'. Execute 'python aggregates.py' após a conversão.")
     st.stop()
 
-stats = []
-for fname in sorted(parquet_files):
-    fpath = os.path.join(PARQUET_DIR, fname)
-    try:
-        pf = pq.ParquetFile(fpath)
-        n_rows = pf.metadata.num_rows
-        n_cols = pf.metadata.num_columns
-        col_names = pf.schema.names
-        colunas_disp = ', '.join(col_names)
-    except Exception as e:
-        n_rows = None
-        n_cols = None
-        colunas_disp = 'Erro'
-    size_mb = os.path.getsize(fpath) / (1024*1024)
-    stats.append({
-        'Tabela': fname.replace('.parquet',''),
-        'Arquivo': fname,
-        'Registros': n_rows,
-        'Colunas': n_cols,
-        'Colunas disponíveis': colunas_disp,
-        'Tamanho (MB)': size_mb
-    })
+@st.cache_data
+def load_aggregate(path, mtime):
+    """Lê um agregado; `mtime` faz parte da chave do cache, que é refeito quando o arquivo muda"""
+    return pq.read_table(path).to_pandas()
 
-# Cria DataFrame para facilitar ordenação
-stats_df = pd.DataFrame(stats)
-# Ordena por Registros, depois Colunas, depois Tamanho (MB)
-stats_df = stats_df.sort_values(['Registros', 'Colunas', 'Tamanho (MB)'], ascending=[False, False, False])
+def aggregate(name):
+    """DataFrame de um agregado, ou None se ele não foi calculado"""
+    path = os.path.join(AGGREGATES_DIR, f'{name}.parquet')
+    if not os.path.exists(path):
+        return None
+    return load_aggregate(path, os.path.getmtime(path))
 
 # Formatação: ponto para milhar, vírgula para decimal (apenas para exibição)
 def format_num(val, dec=0):
@@ -56,10 +39,52 @@ def format_num(val, dec=0):
         return f"{val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
     return val
 
+stats_df = aggregate(SUMMARY_NAME)
+stats_df = pd.DataFrame({
+    'Tabela': stats_df['tabela'],
+    'Registros': stats_df['registros'].astype(object),
+    'Colunas': stats_df['colunas'].astype(object),
+    'Colunas disponíveis': stats_df['colunas_disponiveis'],
+    'Tamanho (MB)': stats_df['tamanho_bytes'] / (1024*1024),
+})
+# Ordena por Registros, depois Colunas, depois Tamanho (MB)
+stats_df = stats_df.sort_values(['Registros', 'Colunas', 'Tamanho (MB)'], ascending=[False, False, False])
+
 stats_df_viz = stats_df.copy()
 stats_df_viz['Registros'] = stats_df_viz['Registros'].apply(format_num)
 stats_df_viz['Colunas'] = stats_df_viz['Colunas'].apply(format_num)
 stats_df_viz['Tamanho (MB)'] = stats_df_viz['Tamanho (MB)'].apply(lambda x: format_num(x, 2))
 
 st.subheader('Resumo das Tabelas')
-st.dataframe(stats_df_viz, hide_index=True) 
\ No newline at end of file
+st.dataframe(stats_df_viz, hide_index=True)
+
+# Gráficos dos agregados: (título, agregado, coluna do eixo, linhas exibidas)
+CHARTS = [
+    ('Estabelecimentos por UF', 'estabelecimentos_por_uf', 'uf', None),
+    ('Estabelecimentos por situação cadastral', 'estabelecimentos_por_situacao', 'situacao_cadastral', None),
+    ('Empresas por porte', 'empresas_por_porte', 'porte_empresa', None),
+    ('CNAEs principais mais frequentes', 'estabelecimentos_por_cnae', 'cnae_fiscal_principal', 20),
+    ('Municípios com mais estabelecimentos', 'estabelecimentos_por_municipio', 'municipio', 20),
+]
+
+columns = st.columns(2)
+for i, (title, name, column, top) in enumerate(CHARTS):
+    df = aggregate(name)
+    if df is None:
+        continue
+    if top:
+        df = df.head(top)
+    if 'descricao' in df.columns:
+        df = df.assign(**{column: df['descricao'].fillna(df[column])})
+    # Municípios com o mesmo nome em UFs diferentes viram barras separadas ("<nome> - <UF>")
+    if 'uf' in df.columns and column != 'uf':
+        df = df.assign(**{column: df[column].astype(str) + ' - ' + df['uf'].astype(object).fillna('?').astype(str)})
+    with columns[i % 2]:
+        st.subheader(title)
+        st.bar_chart(df.set_index(column)[['total']])
+
+aberturas = aggregate('aberturas_por_mes')
+if aberturas is not None:
+    st.subheader('Aberturas de estabelecimentos por mês')
+    aberturas = aberturas.dropna(subset=['mes_inicio_atividade']).sort_values('mes_inicio_atividade')
+    st.line_chart(aberturas.set_index('mes_inicio_atividade')[['total']])
@@ -0,0 +1,808 @@
+# -*- coding: utf-8 -*-
+"""
+Carga em massa dos arquivos Parquet nas tabelas do database_schema.sql.
+
+Lê as tabelas Parquet geradas pelo import_to_parquet em lotes e grava no
+banco pelos caminhos de carga em massa de cada backend:
+
+- MySQL: LOAD DATA LOCAL INFILE (padrão), com cada lote Arrow gravado
+  direto em TSV pelo pyarrow.csv, ou INSERTs de várias linhas
+  (executemany do PyMySQL);
+- SQLite: executemany em uma transação, usado como substituto local do
+  MySQL (testes e uso sem servidor).
+
+Durante a carga de cada tabela os índices secundários não únicos e os
+triggers de auditoria (ex: tr_empresas_audit_insert) são removidos e depois
+recriados. As instruções removidas ficam registradas em logs_importacao
+antes da remoção, e uma carga interrompida as restaura na execução
+seguinte.
+
+Tabelas independentes são carregadas em paralelo (LOAD_WORKERS), cada uma
+com uma conexão de um pool. Cada arquivo Parquet tem um registro em
+importacoes, e cada lote de BATCH_SIZE linhas é confirmado na mesma
+transação que atualiza registros_importados desse registro: após uma queda
+a carga recomeça do último lote confirmado, sem duplicar nem truncar.
+
+Os registros de importacoes levam a versão da tabela Parquet (assinatura
+dos rodapés dos arquivos, que descrevem o conteúdo). Uma versão diferente
+da última carregada substitui o conteúdo da tabela do banco: ela é
+esvaziada antes da carga, em vez de receber as linhas novas por cima, e a
+limpeza fica registrada em importacoes (`tabela@versão`). Só os arquivos
+carregados depois da última limpeza contam como concluídos, então voltar a
+uma versão já carregada antes a carrega de novo.
+"""
+import os
+import time
+import struct
+import hashlib
+import logging
+import argparse
+import queue
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from parquet_dataset import table_path, parquet_files, partition_values
+
+try:
+    import pymysql
+except ImportError:  # MySQL é opcional: o backend SQLite não precisa dele
+    pymysql = None
+
+logger = logging.getLogger(__name__)
+
+PARQUET_DIR = 'parquet'
+BATCH_SIZE = int(os.environ.get('CNPJ_LOAD_BATCH_SIZE', 50000))  # linhas por transação
+LOAD_WORKERS = int(os.environ.get('CNPJ_LOAD_WORKERS', 3))  # tabelas carregadas em paralelo
+
+# Tabela do banco -> (tabela Parquet, [(coluna do banco, coluna do Parquet)])
+# Na Receita o CNPJ de empresas/sócios é o cnpj_basico (8 dígitos); no
+# database_schema.sql ele é a coluna `cnpj` que liga as tabelas.
+COLUMN_MAP = {
+    'empresas': ('empresas', [
+        ('cnpj', 'cnpj_basico'),
+        ('razao_social', 'razao_social'),
+        ('natureza_juridica', 'natureza_juridica'),
+        ('capital_social', 'capital_social'),
+        ('porte_empresa', 'porte_empresa'),
+        ('ente_federativo', 'ente_federativo_responsavel'),
+    ]),
+    'estabelecimentos': ('estabelecimentos', [
+        ('cnpj', 'cnpj_basico'),
+        ('cnpj_ordem', 'cnpj_ordem'),
+        ('cnpj_dv', 'cnpj_dv'),
+        ('identificador_matriz_filial', 'identificador_matriz_filial'),
+        ('nome_fantasia', 'nome_fantasia'),
+        ('situacao_cadastral', 'situacao_cadastral'),
+        ('data_situacao_cadastral', 'data_situacao_cadastral'),
+        ('motivo_situacao_cadastral', 'motivo_situacao_cadastral'),
+        ('nome_cidade_exterior', 'nome_cidade_exterior'),
+        ('pais', 'pais'),
+        ('data_inicio_atividade', 'data_inicio_atividade'),
+        ('cnae_fiscal', 'cnae_fiscal_principal'),
+        ('tipo_logradouro', 'tipo_logradouro'),
+        ('logradouro', 'logradouro'),
+        ('numero', 'numero'),
+        ('complemento', 'complemento'),
+        ('bairro', 'bairro'),
+        ('cep', 'cep'),
+        ('uf', 'uf'),
+        ('municipio', 'municipio'),
+        ('ddd_1', 'ddd_1'),
+        ('telefone_1', 'telefone_1'),
+        ('ddd_2', 'ddd_2'),
+        ('telefone_2', 'telefone_2'),
+        ('ddd_fax', 'ddd_fax'),
+        ('email', 'correio_eletronico'),
+        ('situacao_especial', 'situacao_especial'),
+        ('data_situacao_especial', 'data_situacao_especial'),
+    ]),
+    'socios': ('socios', [
+        ('cnpj', 'cnpj_basico'),
+        ('identificador_socio', 'identificador_socio'),
+        ('nome_socio', 'nome_socio_razao_social'),
+        ('cnpj_cpf_socio', 'cnpj_cpf_socio'),
+        ('codigo_qualificacao_socio', 'qualificacao_socio'),
+        ('data_entrada_sociedade', 'data_entrada_sociedade'),
+        ('cpf_representante_legal', 'representante_legal'),
+        ('nome_representante_legal', 'nome_representante'),
+        ('codigo_qualificacao_representante_legal', 'qualificacao_representante_legal'),
+        ('faixa_etaria', 'faixa_etaria'),
+    ]),
+    'cnaes_secundarios': ('cnaes_secundarios', [
+        ('cnpj', 'cnpj_basico'),
+        ('cnpj_ordem', 'cnpj_ordem'),
+        ('cnpj_dv', 'cnpj_dv'),
+        ('cnae_secundario', 'cnae_secundario'),
+        ('cnae_secundario_descricao', 'cnae_secundario_descricao'),
+    ]),
+    'cnaes': ('cnaes', [('codigo', 'codigo'), ('descricao', 'descricao')]),
+    'naturezas_juridicas': ('naturezas_juridicas', [('codigo', 'codigo'), ('descricao', 'descricao')]),
+    'qualificacoes_socios': ('qualificacoes_socios', [('codigo', 'codigo'), ('descricao', 'descricao')]),
+    'municipios': ('municipios', [('codigo', 'codigo'), ('nome', 'descricao')]),
+    'paises': ('paises', [('codigo', 'codigo'), ('nome', 'descricao')]),
+}
+
+# Valores fixos para colunas NOT NULL sem correspondente nos arquivos da Receita
+CONSTANT_COLUMNS = {
+    'municipios': {'uf': ''},
+}
+
+# Esquema equivalente ao database_schema.sql para o backend SQLite, com os
+# mesmos índices secundários e o trigger de auditoria de empresas.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS empresas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cnpj TEXT NOT NULL UNIQUE,
+    razao_social TEXT, nome_fantasia TEXT, data_abertura TEXT, porte_empresa TEXT,
+    natureza_juridica TEXT, capital_social NUMERIC, ente_federativo TEXT,
+    situacao_cadastral TEXT, uf TEXT, cnae_fiscal TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_empresas_razao_social ON empresas(razao_social);
+CREATE INDEX IF NOT EXISTS idx_empresas_situacao ON empresas(situacao_cadastral);
+
+CREATE TABLE IF NOT EXISTS estabelecimentos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cnpj TEXT NOT NULL, cnpj_ordem TEXT NOT NULL, cnpj_dv TEXT NOT NULL,
+    identificador_matriz_filial TEXT, nome_fantasia TEXT, situacao_cadastral TEXT,
+    data_situacao_cadastral TEXT, motivo_situacao_cadastral TEXT, nome_cidade_exterior TEXT,
+    pais TEXT, data_inicio_atividade TEXT, cnae_fiscal TEXT, cnae_fiscal_descricao TEXT,
+    tipo_logradouro TEXT, logradouro TEXT, numero TEXT, complemento TEXT, bairro TEXT,
+    cep TEXT, uf TEXT, municipio TEXT, ddd_1 TEXT, telefone_1 TEXT, ddd_2 TEXT,
+    telefone_2 TEXT, ddd_fax TEXT, fax TEXT, email TEXT, situacao_especial TEXT,
+    data_situacao_especial TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (cnpj, cnpj_ordem, cnpj_dv)
+);
+CREATE INDEX IF NOT EXISTS idx_estabelecimentos_cnpj ON estabelecimentos(cnpj);
+CREATE INDEX IF NOT EXISTS idx_estabelecimentos_situacao_uf ON estabelecimentos(situacao_cadastral, uf);
+CREATE INDEX IF NOT EXISTS idx_estabelecimentos_municipio ON estabelecimentos(municipio);
+CREATE INDEX IF NOT EXISTS idx_estabelecimentos_cnae_fiscal ON estabelecimentos(cnae_fiscal);
+
+CREATE TABLE IF NOT EXISTS socios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cnpj TEXT NOT NULL, identificador_socio TEXT, nome_socio TEXT, cnpj_cpf_socio TEXT,
+    codigo_qualificacao_socio TEXT, percentual_capital_social NUMERIC,
+    data_entrada_sociedade TEXT, cpf_representante_legal TEXT, nome_representante_legal TEXT,
+    codigo_qualificacao_representante_legal TEXT, faixa_etaria TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_socios_cnpj ON socios(cnpj);
+CREATE INDEX IF NOT EXISTS idx_socios_cpf_cnpj_socio ON socios(cnpj_cpf_socio);
+CREATE INDEX IF NOT EXISTS idx_socios_nome_socio ON socios(nome_socio);
+
+CREATE TABLE IF NOT EXISTS cnaes_secundarios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cnpj TEXT NOT NULL, cnpj_ordem TEXT NOT NULL, cnpj_dv TEXT NOT NULL,
+    cnae_secundario TEXT, cnae_secundario_descricao TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_cnaes_secundarios_cnpj ON cnaes_secundarios(cnpj, cnpj_ordem, cnpj_dv);
+CREATE INDEX IF NOT EXISTS idx_cnaes_secundarios_cnae ON cnaes_secundarios(cnae_secundario);
+
+CREATE TABLE IF NOT EXISTS qualificacoes_socios (codigo TEXT PRIMARY KEY, descricao TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS naturezas_juridicas (codigo TEXT PRIMARY KEY, descricao TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS cnaes (codigo TEXT PRIMARY KEY, descricao TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS municipios (codigo TEXT PRIMARY KEY, nome TEXT NOT NULL, uf TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS paises (codigo TEXT PRIMARY KEY, nome TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS importacoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    arquivo TEXT NOT NULL,
+    data_importacao TEXT DEFAULT CURRENT_TIMESTAMP,
+    registros_processados INTEGER DEFAULT 0,
+    registros_importados INTEGER DEFAULT 0,
+    registros_com_erro INTEGER DEFAULT 0,
+    status TEXT DEFAULT 'em_andamento' CHECK (status IN ('em_andamento', 'concluida', 'erro')),
+    mensagem_erro TEXT,
+    tempo_processamento_seconds INTEGER,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS logs_importacao (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    importacao_id INTEGER REFERENCES importacoes(id) ON DELETE CASCADE,
+    linha_arquivo INTEGER, cnpj TEXT, tipo_registro TEXT, mensagem TEXT,
+    nivel TEXT DEFAULT 'INFO',
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS empresas_audit (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cnpj TEXT NOT NULL, acao TEXT NOT NULL, dados_anteriores TEXT, dados_novos TEXT,
+    usuario TEXT, data_auditoria TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TRIGGER IF NOT EXISTS tr_empresas_audit_insert
+AFTER INSERT ON empresas
+FOR EACH ROW
+BEGIN
+    INSERT INTO empresas_audit (cnpj, acao, dados_novos)
+    VALUES (NEW.cnpj, 'INSERT', json_object('razao_social', NEW.razao_social,
+                                            'situacao_cadastral', NEW.situacao_cadastral,
+                                            'uf', NEW.uf));
+END;
+"""
+
+# Tipos de registro usados em logs_importacao para a DDL removida durante a carga
+DDL_PENDING = 'ddl_pendente'
+DDL_RESTORED = 'ddl_restaurada'
+
+
+class SQLiteBackend:
+    """Backend SQLite: substituto local do MySQL, com o esquema de SQLITE_SCHEMA"""
+
+    placeholder = '?'
+
+    def __init__(self, database):
+        self.database = database
+
+    def connect(self):
+        conn = sqlite3.connect(self.database, timeout=60, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA foreign_keys = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        return conn
+
+    def create_schema(self, conn):
+        conn.executescript(SQLITE_SCHEMA)
+        conn.commit()
+
+    def begin_bulk(self, conn):
+        pass
+
+    def end_bulk(self, conn):
+        pass
+
+    def secondary_indexes(self, conn, table):
+        """Índices secundários não únicos: [(nome, instrução de criação)]"""
+        rows = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table,)).fetchall()
+        return [(name, sql) for name, sql in rows if not sql.upper().startswith('CREATE UNIQUE')]
+
+    def triggers(self, conn, table):
+        """Triggers da tabela: [(nome, instrução de criação)]"""
+        return conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table,)).fetchall()
+
+    def drop_index(self, conn, table, name):
+        conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+    def drop_trigger(self, conn, name):
+        conn.execute(f'DROP TRIGGER IF EXISTS "{name}"')
+
+    def truncate(self, conn, table):
+        conn.execute(f'DELETE FROM {table}')
+
+    def insert_rows(self, conn, table, columns, rows):
+        placeholders = ', '.join(['?'] * len(columns))
+        conn.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})', rows)
+
+    def insert_batch(self, conn, table, batch):
+        self.insert_rows(conn, table, batch.schema.names, batch_rows(batch))
+
+
+class MySQLBackend:
+    """Backend MySQL/MariaDB via PyMySQL, com LOAD DATA LOCAL INFILE ou INSERTs de várias linhas"""
+
+    placeholder = '%s'
+
+    def __init__(self, host='localhost', port=3306, user='root', password='', database='cnpj', method='load_data'):
+        if pymysql is None:
+            raise ImportError("O backend MySQL requer o pacote PyMySQL (pip install pymysql)")
+        self.options = dict(host=host, port=int(port), user=user, password=password, database=database,
+                            charset='utf8mb4', local_infile=True)
+        self.method = method
+
+    def connect(self):
+        return pymysql.connect(**self.options)
+
+    def create_schema(self, conn):
+        # O esquema MySQL é criado com database_schema.sql
+        pass
+
+    def begin_bulk(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute('SET unique_checks = 0')
+            cursor.execute('SET foreign_key_checks = 0')
+
+    def end_bulk(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute('SET unique_checks = 1')
+            cursor.execute('SET foreign_key_checks = 1')
+
+    def secondary_indexes(self, conn, table):
+        """Índices secundários não únicos: [(nome, instrução de criação)]"""
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT INDEX_NAME, INDEX_TYPE, COLUMN_NAME, SUB_PART "
+                "FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND NON_UNIQUE = 1 "
+                "ORDER BY INDEX_NAME, SEQ_IN_INDEX", (table,))
+            rows = cursor.fetchall()
+        return mysql_index_ddl(table, rows)
+
+    def triggers(self, conn, table):
+        """Triggers da tabela: [(nome, instrução de criação)]"""
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT TRIGGER_NAME FROM information_schema.TRIGGERS "
+                "WHERE EVENT_OBJECT_SCHEMA = DATABASE() AND EVENT_OBJECT_TABLE = %s", (table,))
+            names = [row[0] for row in cursor.fetchall()]
+            triggers = []
+            for name in names:
+                cursor.execute(f'SHOW CREATE TRIGGER `{name}`')
+                triggers.append((name, cursor.fetchone()[2]))
+        return triggers
+
+    def drop_index(self, conn, table, name):
+        with conn.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE `{table}` DROP INDEX `{name}`')
+
+    def drop_trigger(self, conn, name):
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER IF EXISTS `{name}`')
+
+    def truncate(self, conn, table):
+        with conn.cursor() as cursor:
+            # Sem checagem de chaves estrangeiras o TRUNCATE é aceito e não apaga em cascata as tabelas filhas
+            cursor.execute('SET foreign_key_checks = 0')
+            cursor.execute(f'TRUNCATE TABLE `{table}`')
+            cursor.execute('SET foreign_key_checks = 1')
+
+    def insert_rows(self, conn, table, columns, rows):
+        # O PyMySQL agrupa o executemany de INSERT ... VALUES em INSERTs de várias linhas
+        column_list = ', '.join(f'`{column}`' for column in columns)
+        placeholders = ', '.join(['%s'] * len(columns))
+        with conn.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO `{table}` ({column_list}) VALUES ({placeholders})', rows)
+
+    def insert_batch(self, conn, table, batch):
+        if self.method == 'insert':
+            self.insert_rows(conn, table, batch.schema.names, batch_rows(batch))
+            return
+        # O lote vai direto do Arrow para o arquivo do LOAD DATA, sem passar por objetos Python
+        column_list = ', '.join(f'`{column}`' for column in batch.schema.names)
+        with tempfile.NamedTemporaryFile('wb', suffix='.tsv', delete=False) as f:
+            write_tsv(batch, f)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table}` CHARACTER SET utf8mb4 "
+                    f"FIELDS TERMINATED BY '\\t' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\\\\' "
+                    f"LINES TERMINATED BY '\\n' ({column_list})",
+                    (f.name,))
+        finally:
+            os.remove(f.name)
+
+
+def mysql_index_ddl(table, rows):
+    """
+    Instruções de criação dos índices a partir das linhas de
+    information_schema.STATISTICS (nome, tipo, coluna, SUB_PART), na ordem
+    SEQ_IN_INDEX: [(nome, instrução)]. Índices de prefixo mantêm o tamanho.
+    """
+    columns = {}
+    for name, index_type, column, sub_part in rows:
+        columns.setdefault((name, index_type), []).append(f'`{column}`({sub_part})' if sub_part else f'`{column}`')
+    indexes = []
+    for (name, index_type), column_list in columns.items():
+        kind = 'FULLTEXT INDEX' if index_type == 'FULLTEXT' else 'INDEX'
+        indexes.append((name, f'ALTER TABLE `{table}` ADD {kind} `{name}` ({", ".join(column_list)})'))
+    return indexes
+
+
+# Escapes do LOAD DATA (ESCAPED BY '\\'); a barra vem primeiro para não escapar os escapes. O escritor
+# CSV do Arrow põe os textos entre aspas (OPTIONALLY ENCLOSED BY '"'), dobrando as aspas dentro deles.
+TSV_ESCAPES = [('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')]
+TSV_OPTIONS = pa_csv.WriteOptions(include_header=False, delimiter='\t', null_string='\\N')
+
+
+def write_tsv(batch, f):
+    """Grava um lote Arrow para o LOAD DATA (nulo = \\N; textos entre aspas, com escape de \\, tab e quebra de linha)"""
+    columns = []
+    for column in batch.columns:
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            for char, escaped in TSV_ESCAPES:
+                column = pc.replace_substring(column, char, escaped)
+        columns.append(column)
+    pa_csv.write_csv(pa.record_batch(columns, names=batch.schema.names), f, TSV_OPTIONS)
+
+
+def _sql_value(value):
+    """Converte valores do Arrow que o driver SQLite não aceita (Decimal, date)"""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _execute(conn, backend, sql, params=()):
+    """Executa uma instrução e retorna o cursor (o SQLite não tem cursor como context manager)"""
+    cursor = conn.cursor()
+    cursor.execute(sql.replace('?', backend.placeholder), params)
+    return cursor
+
+
+def _footer(file_path):
+    """Rodapé (metadados) de um arquivo Parquet: esquema, row groups e estatísticas"""
+    with open(file_path, 'rb') as f:
+        f.seek(-8, os.SEEK_END)
+        (length,) = struct.unpack('<i', f.read(4))
+        f.seek(-8 - length, os.SEEK_END)
+        return f.read(length)
+
+
+def table_version(path):
+    """
+    Versão de uma tabela Parquet: assinatura do nome, tamanho e rodapé de
+    cada arquivo. Muda quando o conteúdo muda, não quando os mesmos dados
+    são apenas gravados de novo.
+    """
+    digest = hashlib.sha1()
+    for file_path in parquet_files(path):
+        digest.update(f"{os.path.relpath(file_path, path)}:{os.path.getsize(file_path)}:".encode())
+        digest.update(_footer(file_path))
+    return digest.hexdigest()[:16]
+
+
+def import_name(db_table, version, path, file_path):
+    """Identificação do arquivo em importacoes: tabela do banco, versão da tabela Parquet e arquivo"""
+    relative = os.path.relpath(file_path, os.path.dirname(path))
+    return f"{db_table}@{version}:{relative}"
+
+
+def load_marker(conn, backend, db_table):
+    """
+    Última troca de conteúdo da tabela do banco: (id, versão, concluída) do
+    registro `tabela@versão` gravado em importacoes ao esvaziá-la, ou None.
+    """
+    prefix = f"{db_table}@"
+    row = _execute(conn, backend,
+                   "SELECT id, arquivo, status FROM importacoes WHERE SUBSTR(arquivo, 1, ?) = ? "
+                   "AND arquivo NOT LIKE '%:%' ORDER BY id DESC LIMIT 1",
+                   (len(prefix), prefix)).fetchone()
+    if row is None:
+        return None
+    marker_id, arquivo, status = row
+    return marker_id, arquivo[len(prefix):], status == 'concluida'
+
+
+def replace_contents(conn, backend, db_table, version):
+    """
+    Esvazia a tabela do banco para a carga de uma nova versão e retorna o id
+    do registro `tabela@versão`. O registro é gravado antes e concluído
+    depois da limpeza: uma queda no meio só repete a limpeza.
+    """
+    cursor = _execute(conn, backend, "INSERT INTO importacoes (arquivo, status) VALUES (?, 'em_andamento')",
+                      (f"{db_table}@{version}",))
+    marker_id = cursor.lastrowid
+    conn.commit()
+    backend.truncate(conn, db_table)
+    _execute(conn, backend, "UPDATE importacoes SET status = 'concluida' WHERE id = ?", (marker_id,))
+    conn.commit()
+    return marker_id
+
+
+def start_import(conn, backend, arquivo, since=0):
+    """
+    Registra o início da carga de um arquivo em importacoes, ou retoma a
+    última carga do mesmo arquivo feita depois do registro `since` (a
+    última limpeza da tabela). Retorna (id, linhas já gravadas, concluída).
+    """
+    row = _execute(conn, backend,
+                   "SELECT id, status, registros_importados FROM importacoes WHERE arquivo = ? AND id > ? "
+                   "ORDER BY id DESC LIMIT 1", (arquivo, since)).fetchone()
+    if row is not None:
+        importacao_id, status, rows = row
+        if status != 'concluida':
+            _execute(conn, backend, "UPDATE importacoes SET status = 'em_andamento', mensagem_erro = NULL "
+                                    "WHERE id = ?", (importacao_id,))
+            conn.commit()
+        return importacao_id, rows or 0, status == 'concluida'
+    cursor = _execute(conn, backend, "INSERT INTO importacoes (arquivo, status) VALUES (?, 'em_andamento')", (arquivo,))
+    conn.commit()
+    return cursor.lastrowid, 0, False
+
+
+def checkpoint_import(conn, backend, importacao_id, rows):
+    """Grava o total de linhas carregadas; deve ser confirmado na mesma transação do lote"""
+    _execute(conn, backend,
+             "UPDATE importacoes SET registros_processados = ?, registros_importados = ? WHERE id = ?",
+             (rows, rows, importacao_id))
+
+
+def finish_import(conn, backend, importacao_id, started, error=None):
+    """Registra o resultado da carga de um arquivo em importacoes"""
+    _execute(conn, backend,
+             "UPDATE importacoes SET status = ?, mensagem_erro = ?, "
+             "tempo_processamento_seconds = COALESCE(tempo_processamento_seconds, 0) + ? WHERE id = ?",
+             ('erro' if error else 'concluida', str(error) if error else None,
+              int(time.monotonic() - started), importacao_id))
+    conn.commit()
+
+
+def disable_indexes_and_triggers(conn, backend, table, importacao_id):
+    """
+    Remove índices secundários não únicos e triggers da tabela, registrando
+    antes a DDL de recriação em logs_importacao. Retorna a DDL removida.
+    """
+    statements = []
+    for name, sql in backend.triggers(conn, table):
+        statements.append(('trigger', name, sql))
+    for name, sql in backend.secondary_indexes(conn, table):
+        statements.append(('index', name, sql))
+
+    for kind, name, sql in statements:
+        _execute(conn, backend,
+                 "INSERT INTO logs_importacao (importacao_id, tipo_registro, mensagem, nivel) VALUES (?, ?, ?, 'INFO')",
+                 (importacao_id, DDL_PENDING, sql))
+    conn.commit()
+
+    removed = []
+    for kind, name, sql in statements:
+        try:
+            if kind == 'trigger':
+                backend.drop_trigger(conn, name)
+            else:
+                backend.drop_index(conn, table, name)
+            removed.append(sql)
+        except Exception as e:
+            # Ex: índice exigido por uma chave estrangeira no MySQL
+            logger.warning(f"Não foi possível remover {name} de '{table}', mantendo: {e}")
+            _mark_restored(conn, backend, sql)
+    conn.commit()
+    if removed:
+        logger.info(f"'{table}': {len(removed)} índice(s)/trigger(s) desativado(s) durante a carga.")
+    return removed
+
+
+def _mark_restored(conn, backend, sql):
+    """Marca uma DDL pendente como restaurada em logs_importacao"""
+    _execute(conn, backend,
+             "UPDATE logs_importacao SET tipo_registro = ? WHERE tipo_registro = ? AND mensagem = ?",
+             (DDL_RESTORED, DDL_PENDING, sql))
+
+
+def restore_indexes_and_triggers(conn, backend, statements):
+    """Recria índices e triggers removidos (índices primeiro, triggers por último)"""
+    for sql in sorted(statements, key=lambda statement: 'TRIGGER' in statement.upper()):
+        try:
+            _execute(conn, backend, sql)
+        except Exception as e:
+            if 'already exists' not in str(e) and 'Duplicate' not in str(e):
+                raise
+        _mark_restored(conn, backend, sql)
+        conn.commit()
+
+
+def restore_pending_ddl(conn, backend):
+    """Restaura a DDL deixada pendente por uma carga interrompida"""
+    rows = _execute(conn, backend,
+                    "SELECT DISTINCT mensagem FROM logs_importacao WHERE tipo_registro = ?", (DDL_PENDING,)).fetchall()
+    if rows:
+        logger.warning(f"Restaurando {len(rows)} índice(s)/trigger(s) de uma carga interrompida.")
+        restore_indexes_and_triggers(conn, backend, [row[0] for row in rows])
+
+
+def _sources(db_table, names, partitions):
+    """Colunas do Parquet carregadas, na ordem do mapeamento: as do arquivo ou, na falta delas, as de partição"""
+    _, mapping = COLUMN_MAP[db_table]
+    return [(target, source) for target, source in mapping if source in names or source in partitions]
+
+
+def iter_batches(file_path, db_table, batch_size=BATCH_SIZE, skip=0, partitions=None):
+    """
+    Gera lotes Arrow com as colunas do banco a partir de um arquivo Parquet,
+    pulando as `skip` primeiras linhas (já carregadas). `partitions`
+    ({coluna: valor}, do caminho do arquivo em um dataset Hive) completa as
+    colunas que não estão dentro do arquivo.
+    """
+    partitions = partitions or {}
+    constants = CONSTANT_COLUMNS.get(db_table, {})
+    parquet_file = pq.ParquetFile(file_path)
+    names = parquet_file.schema_arrow.names
+    sources = _sources(db_table, names, partitions)
+    file_columns = [source for _, source in sources if source in names]
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=file_columns):
+        if skip >= batch.num_rows:
+            skip -= batch.num_rows
+            continue
+        if skip:
+            batch, skip = batch.slice(skip), 0
+        columns = [batch.column(source) if source in names
+                   else pa.array([partitions[source]] * batch.num_rows, pa.string()) for _, source in sources]
+        columns += [pa.array([value] * batch.num_rows, pa.string()) for value in constants.values()]
+        yield pa.record_batch(columns, names=[target for target, _ in sources] + list(constants))
+
+
+def batch_rows(batch):
+    """Tuplas de um lote, na ordem das colunas, para os caminhos de carga com executemany"""
+    columns = [[_sql_value(value) for value in column.to_pylist()] for column in batch.columns]
+    return list(zip(*columns))
+
+
+class ConnectionPool:
+    """Pool de conexões do backend, criadas sob demanda até `size`"""
+
+    def __init__(self, backend, size):
+        self.backend = backend
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão do pool (espera se todas estiverem em uso)"""
+        with self._lock:
+            create = self._idle.empty() and self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                conn = self.backend.connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        else:
+            conn = self._idle.get()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        """Fecha as conexões ociosas"""
+        while not self._idle.empty():
+            self._idle.get().close()
+
+
+def load_file(conn, backend, db_table, file_path, importacao_id, skip=0, batch_size=BATCH_SIZE, partitions=None):
+    """
+    Carrega um arquivo Parquet em lotes de `batch_size` linhas. Cada lote é
+    confirmado junto com o checkpoint em importacoes, então uma carga
+    interrompida recomeça do último lote confirmado. Retorna as linhas gravadas.
+    """
+    started = time.monotonic()
+    total_rows = skip
+    if skip:
+        logger.info(f"Retomando '{file_path}' a partir da linha {skip}.")
+    try:
+        for batch in iter_batches(file_path, db_table, batch_size, skip, partitions):
+            backend.insert_batch(conn, db_table, batch)
+            total_rows += batch.num_rows
+            checkpoint_import(conn, backend, importacao_id, total_rows)
+            conn.commit()
+            logger.info(f"- {db_table} - {total_rows} linhas carregadas de {os.path.basename(file_path)}")
+    except Exception as e:
+        conn.rollback()
+        finish_import(conn, backend, importacao_id, started, error=e)
+        raise
+    finish_import(conn, backend, importacao_id, started)
+    return total_rows - skip
+
+
+def load_table(pool, backend, db_table, parquet_dir=PARQUET_DIR, batch_size=BATCH_SIZE):
+    """
+    Carrega os arquivos de uma tabela Parquet em uma tabela do banco, pulando
+    os já concluídos. Se a versão da tabela Parquet mudou desde a última
+    carga, a tabela do banco é esvaziada antes. Retorna as linhas gravadas
+    (None se a tabela não existir).
+    """
+    source_table, _ = COLUMN_MAP[db_table]
+    path = table_path(parquet_dir, source_table)
+    if path is None:
+        logger.warning(f"Tabela Parquet '{source_table}' não encontrada em {parquet_dir}. Pulando.")
+        return None
+
+    logger.info(f"--- Carregando tabela: {db_table} ---")
+    started = time.monotonic()
+    total_rows = 0
+    version = table_version(path)
+    with pool.connection() as conn:
+        marker = load_marker(conn, backend, db_table)
+        if marker is None or marker[1] != version or not marker[2]:
+            logger.info(f"'{db_table}': nova versão ({version}) da tabela Parquet, substituindo o conteúdo.")
+            marker_id = replace_contents(conn, backend, db_table, version)
+        else:
+            marker_id = marker[0]
+        pending = []
+        for file_path in parquet_files(path):
+            # Só contam as cargas feitas depois da última limpeza (a mesma versão pode voltar)
+            importacao_id, skip, done = start_import(conn, backend, import_name(db_table, version, path, file_path),
+                                                     since=marker_id)
+            if done:
+                logger.info(f"'{file_path}' já carregado. Pulando.")
+            else:
+                pending.append((file_path, importacao_id, skip))
+        if not pending:
+            return 0
+
+        removed = disable_indexes_and_triggers(conn, backend, db_table, pending[0][1])
+        try:
+            backend.begin_bulk(conn)
+            for file_path, importacao_id, skip in pending:
+                total_rows += load_file(conn, backend, db_table, file_path, importacao_id, skip, batch_size,
+                                        partition_values(path, file_path))
+            backend.end_bulk(conn)
+        finally:
+            logger.info(f"'{db_table}': recriando {len(removed)} índice(s)/trigger(s).")
+            restore_indexes_and_triggers(conn, backend, removed)
+
+    logger.info(f"Total de {total_rows} linhas carregadas em '{db_table}' em {time.monotonic() - started:.1f}s.")
+    return total_rows
+
+
+def load_database(backend, parquet_dir=PARQUET_DIR, tables=None, batch_size=BATCH_SIZE, workers=LOAD_WORKERS):
+    """
+    Carrega as tabelas Parquet no banco, `workers` tabelas em paralelo com
+    um pool de conexões. Retorna {tabela: linhas gravadas}.
+    """
+    pool = ConnectionPool(backend, max(1, workers))
+    try:
+        with pool.connection() as conn:
+            backend.create_schema(conn)
+            restore_pending_ddl(conn, backend)
+
+        totals = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {
+                executor.submit(load_table, pool, backend, db_table, parquet_dir, batch_size): db_table
+                for db_table in tables or COLUMN_MAP.keys()
+            }
+            for future in as_completed(futures):
+                db_table = futures[future]
+                try:
+                    rows = future.result()
+                    if rows is not None:
+                        totals[db_table] = rows
+                except Exception as e:
+                    logger.error(f"Erro ao carregar a tabela '{db_table}': {e}", exc_info=True)
+        return totals
+    finally:
+        pool.close()
+
+
+def make_backend(args):
+    """Cria o backend a partir dos argumentos da linha de comando"""
+    if args.backend == 'sqlite':
+        return SQLiteBackend(args.database)
+    return MySQLBackend(host=args.host, port=args.port, user=args.user, password=args.password,
+                        database=args.database, method=args.method)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="Carrega os arquivos Parquet do CNPJ no banco de dados.")
+    parser.add_argument('--backend', choices=['mysql', 'sqlite'], default='mysql')
+    parser.add_argument('--database', default=os.environ.get('MYSQL_DATABASE', 'cnpj'),
+                        help="nome do banco (MySQL) ou caminho do arquivo (SQLite)")
+    parser.add_argument('--host', default=os.environ.get('MYSQL_HOST', 'localhost'))
+    parser.add_argument('--port', default=os.environ.get('MYSQL_PORT', 3306))
+    parser.add_argument('--user', default=os.environ.get('MYSQL_USER', 'root'))
+    parser.add_argument('--password', default=os.environ.get('MYSQL_PASSWORD', ''))
+    parser.add_argument('--method', choices=['load_data', 'insert'], default='load_data',
+                        help="caminho de carga no MySQL (padrão: load_data)")
+    parser.add_argument('--parquet-dir', default=PARQUET_DIR)
+    parser.add_argument('--tables', nargs='+', choices=sorted(COLUMN_MAP))
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="linhas por transação")
+    parser.add_argument('--workers', type=int, default=LOAD_WORKERS, help="tabelas carregadas em paralelo")
+    args = parser.parse_args()
+    load_database(make_backend(args), args.parquet_dir, args.tables, args.batch_size, args.workers)
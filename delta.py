@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Extração incremental (delta) entre duas versões mensais dos dados em Parquet.
+
+Cada liberação mensal da Receita é um retrato completo. Este módulo compara
+a versão nova com a anterior e grava, por tabela, apenas as linhas
+inseridas, alteradas e removidas:
+
+    <saida>/<tabela>/inserted.parquet   linhas novas (versão nova)
+    <saida>/<tabela>/updated.parquet    linhas alteradas (versão nova)
+    <saida>/<tabela>/deleted.parquet    linhas removidas (versão anterior)
+
+A comparação não faz junções em pandas: cada versão é reduzida a dois
+vetores de inteiros de 64 bits por linha (hash da chave e hash da linha
+inteira), calculados lote a lote sobre os buffers do Arrow, e as diferenças
+saem de buscas binárias sobre esses vetores ordenados. Versões com tipos
+diferentes (ex: uma delas convertida com --untyped) não são comparadas. Os dados completos são relidos apenas para
+copiar as linhas do delta.
+"""
+import os
+import json
+import logging
+import argparse
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from metadata import LAYOUTS
+from parquet_dataset import table_path, open_dataset
+
+logger = logging.getLogger(__name__)
+
+# Chave de cada tabela. Sócios não têm chave natural na Receita: a
+# combinação abaixo identifica o vínculo sócio-empresa.
+DELTA_KEYS = {
+    'empresas': ['cnpj_basico'],
+    'estabelecimentos': ['cnpj_basico', 'cnpj_ordem', 'cnpj_dv'],
+    'socios': ['cnpj_basico', 'identificador_socio', 'cnpj_cpf_socio', 'nome_socio_razao_social'],
+    'simples': ['cnpj_basico'],
+    'cnaes': ['codigo'],
+    'municipios': ['codigo'],
+    'naturezas_juridicas': ['codigo'],
+    'paises': ['codigo'],
+    'qualificacoes_socios': ['codigo'],
+    'motivos': ['codigo'],
+}
+
+# Muda quando a função de hash muda: hashes gravados com outra versão (ex: no
+# histórico do cnpj_history) não são comparáveis com os novos
+HASH_VERSION = 2
+
+_NULL_HASH = np.uint64(0x6A09E667F3BCC909)
+_COLUMN_SEED = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(values):
+    """Finalizador do splitmix64: espalha os bits de cada uint64 (com overflow em módulo 2^64)"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _hash_strings(array):
+    """
+    Hash de 64 bits de cada valor de um StringArray, calculado sobre os
+    buffers do Arrow: soma dos bytes multiplicados por um peso por posição,
+    misturada com o tamanho. Nulos têm um hash próprio, diferente do texto vazio.
+    """
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int32)[array.offset:array.offset + len(array) + 1]
+    start = int(offsets[0])
+    lengths = np.diff(offsets)
+    data = array.buffers()[2]
+    data = np.frombuffer(data, dtype=np.uint8)[start:int(offsets[-1])] if data is not None else np.empty(0, np.uint8)
+
+    sums = np.zeros(len(array), dtype=np.uint64)
+    if len(data):
+        rows = np.repeat(np.arange(len(array)), lengths)
+        positions = np.arange(len(data)) - (offsets[:-1] - start)[rows]
+        weights = _mix(np.arange(1, int(lengths.max()) + 1, dtype=np.uint64))
+        nonempty = lengths > 0
+        sums[nonempty] = np.add.reduceat(data.astype(np.uint64) * weights[positions], (offsets[:-1] - start)[nonempty])
+    hashes = _mix(sums ^ _mix(lengths.astype(np.uint64)))
+    if array.null_count:
+        hashes[~pc.is_valid(array).to_numpy(zero_copy_only=False)] = _NULL_HASH
+    return hashes
+
+
+def _hash_columns(batch, columns):
+    """
+    Hash de 64 bits por linha dos valores das colunas indicadas, lidos como
+    texto (a mesma representação com ou sem codificação em dicionário)
+    """
+    hashes = np.zeros(batch.num_rows, dtype=np.uint64)
+    for column in columns:
+        values = batch.column(column).cast(pa.string())
+        hashes = _mix(hashes * _COLUMN_SEED + _hash_strings(values))
+    return hashes
+
+
+def row_hashes(batch, table_name):
+    """Retorna (hash da chave, hash da linha inteira) de cada linha de um lote"""
+    columns = [column for column in LAYOUTS[table_name] if column in batch.schema.names]
+    return _hash_columns(batch, DELTA_KEYS[table_name]), _hash_columns(batch, columns)
+
+
+def normalized_schema(schema, table_name):
+    """Esquema das colunas do layout presentes em `schema`, com os dicionários trocados pelo tipo dos valores"""
+    fields = []
+    for name in LAYOUTS[table_name]:
+        if name in schema.names:
+            field_type = schema.field(name).type
+            if pa.types.is_dictionary(field_type):
+                field_type = field_type.value_type
+            fields.append(pa.field(name, field_type))
+    return pa.schema(fields)
+
+
+def schema_signature(schema, table_name):
+    """Colunas e tipos de normalized_schema como texto (['coluna:tipo', ...])"""
+    return [f'{field.name}:{field.type}' for field in normalized_schema(schema, table_name)]
+
+
+def check_schemas(old, new, table_name):
+    """
+    Recusa (ValueError) comparar versões com colunas ou tipos diferentes
+    (assinaturas de schema_signature), como uma convertida com tipos e outra
+    com --untyped: os valores de todas as linhas difeririam e todas sairiam
+    como alteradas.
+    """
+    if old != new:
+        differences = sorted(set(old) ^ set(new))
+        raise ValueError(f"'{table_name}': as versões têm esquemas diferentes ({', '.join(differences)}); "
+                         f"converta as duas com os mesmos tipos antes de compará-las.")
+
+
+def hash_table(path, table_name):
+    """
+    Lê uma tabela em lotes e retorna (chaves, hashes) ordenados pela chave.
+    Chaves repetidas mantêm apenas a última ocorrência.
+    """
+    keys, hashes = [], []
+    for batch in open_dataset(path).to_batches():
+        if batch.num_rows:
+            batch_keys, batch_hashes = row_hashes(batch, table_name)
+            keys.append(batch_keys)
+            hashes.append(batch_hashes)
+    if not keys:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64)
+
+    keys = np.concatenate(keys)
+    hashes = np.concatenate(hashes)
+    order = np.argsort(keys, kind='stable')
+    keys, hashes = keys[order], hashes[order]
+
+    # Mantém a última ocorrência de cada chave
+    last = np.append(keys[1:] != keys[:-1], True)
+    if not last.all():
+        logger.warning(f"'{table_name}': {int((~last).sum())} linha(s) com chave repetida ignorada(s).")
+    return keys[last], hashes[last]
+
+
+def compare(old, new):
+    """
+    Compara (chaves, hashes) ordenados de duas versões e retorna as chaves
+    inseridas, alteradas e removidas (ordenadas).
+    """
+    old_keys, old_hashes = old
+    new_keys, new_hashes = new
+
+    if len(old_keys):
+        positions = np.minimum(np.searchsorted(old_keys, new_keys), len(old_keys) - 1)
+        found = old_keys[positions] == new_keys
+    else:
+        positions = np.zeros(len(new_keys), dtype=np.intp)
+        found = np.zeros(len(new_keys), dtype=bool)
+
+    inserted = new_keys[~found]
+    updated = new_keys[found][old_hashes[positions[found]] != new_hashes[found]]
+    deleted = old_keys[~np.isin(old_keys, new_keys, assume_unique=True)]
+    return inserted, updated, deleted
+
+
+def _last_positions(dataset, key_columns, keys):
+    """
+    Posições (na ordem de leitura) da última ocorrência de cada chave em
+    `keys`, como em hash_table; lê só as colunas da chave.
+    """
+    positions, selected = [], []
+    offset = 0
+    for batch in dataset.to_batches(columns=key_columns):
+        if batch.num_rows:
+            batch_keys = _hash_columns(batch, key_columns)
+            mask = np.isin(batch_keys, keys)
+            positions.append(np.flatnonzero(mask) + offset)
+            selected.append(batch_keys[mask])
+        offset += batch.num_rows
+    if not positions:
+        return np.empty(0, dtype=np.int64)
+    positions = np.concatenate(positions)
+    selected = np.concatenate(selected)
+    order = np.argsort(selected, kind='stable')
+    last = np.append(selected[order][1:] != selected[order][:-1], True)
+    return np.sort(positions[order][last])
+
+
+def write_rows(path, table_name, keys, output_path):
+    """
+    Copia para `output_path` as linhas da tabela cujas chaves estão em
+    `keys`; chaves repetidas copiam só a última ocorrência, a mesma que
+    hash_table compara. Retorna o total.
+    """
+    dataset = open_dataset(path)
+    if not len(keys):
+        # Delta vazio: grava um arquivo sem linhas para manter o layout previsível
+        pq.write_table(dataset.schema.empty_table(), output_path)
+        return 0
+
+    positions = _last_positions(dataset, DELTA_KEYS[table_name], keys)
+    writer = None
+    total_rows = 0
+    offset = 0
+    try:
+        for batch in dataset.to_batches():
+            start = offset
+            offset += batch.num_rows
+            if not batch.num_rows:
+                continue
+            mask = np.isin(np.arange(start, offset), positions)
+            if not mask.any():
+                continue
+            selected = batch.filter(pa.array(mask))
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, dataset.schema, compression='snappy')
+            writer.write(pa.Table.from_batches([selected], schema=dataset.schema))
+            total_rows += selected.num_rows
+        if writer is None:
+            pq.write_table(dataset.schema.empty_table(), output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+    return total_rows
+
+
+def compute_delta(old_dir, new_dir, output_dir, tables=None):
+    """
+    Calcula o delta de cada tabela entre `old_dir` e `new_dir` (diretórios
+    de saída do import_to_parquet) e grava em `output_dir`. Retorna um
+    resumo {tabela: {'inserted': n, 'updated': n, 'deleted': n}}, também
+    gravado em `output_dir/_summary.json`.
+    """
+    summary = {}
+    for table_name in tables or LAYOUTS.keys():
+        old_path = table_path(old_dir, table_name)
+        new_path = table_path(new_dir, table_name)
+        if new_path is None:
+            logger.warning(f"Tabela '{table_name}' não encontrada em {new_dir}. Pulando.")
+            continue
+
+        logger.info(f"--- Calculando delta da tabela: {table_name} ---")
+        if old_path is not None:
+            check_schemas(schema_signature(open_dataset(old_path).schema, table_name),
+                          schema_signature(open_dataset(new_path).schema, table_name), table_name)
+        new = hash_table(new_path, table_name)
+        if old_path is None:
+            logger.warning(f"Tabela '{table_name}' não existe em {old_dir}: todas as linhas são inserções.")
+            old = (np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64))
+        else:
+            old = hash_table(old_path, table_name)
+        inserted, updated, deleted = compare(old, new)
+
+        table_dir = os.path.join(output_dir, table_name)
+        os.makedirs(table_dir, exist_ok=True)
+        counts = {
+            'inserted': write_rows(new_path, table_name, inserted, os.path.join(table_dir, 'inserted.parquet')),
+            'updated': write_rows(new_path, table_name, updated, os.path.join(table_dir, 'updated.parquet')),
+        }
+        if old_path is not None:
+            counts['deleted'] = write_rows(old_path, table_name, deleted, os.path.join(table_dir, 'deleted.parquet'))
+        else:
+            counts['deleted'] = 0
+            pq.write_table(open_dataset(new_path).schema.empty_table(), os.path.join(table_dir, 'deleted.parquet'))
+
+        summary[table_name] = counts
+        logger.info(f"'{table_name}': {counts['inserted']} inseridas, {counts['updated']} alteradas, "
+                    f"{counts['deleted']} removidas (de {len(new[0])} linhas).")
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, '_summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="Calcula o delta entre duas versões Parquet dos dados do CNPJ.")
+    parser.add_argument('anterior', help="diretório Parquet da versão anterior")
+    parser.add_argument('novo', help="diretório Parquet da versão nova")
+    parser.add_argument('--output', default='delta', help="diretório de saída (padrão: delta)")
+    parser.add_argument('--tables', nargs='+', choices=sorted(LAYOUTS), help="tabelas a comparar (padrão: todas)")
+    args = parser.parse_args()
+    compute_delta(args.anterior, args.novo, args.output, args.tables)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Cache em disco de metadados HTTP (ETag, Last-Modified e Content-Length) por URL.
+
+Permite fazer requisições condicionais (If-None-Match / If-Modified-Since)
+às listagens de diretório e comparar arquivos remotos com o que já foi
+baixado usando apenas um HEAD, sem baixar nada quando não houve mudança.
+"""
+import os
+import json
+import threading
+
+
+class HTTPMetadataCache:
+    """Dicionário {url: metadados} persistido em um arquivo JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, url):
+        """Retorna os metadados gravados para a URL (ou um dicionário vazio)"""
+        with self._lock:
+            return dict(self._entries.get(url, {}))
+
+    def set(self, url, entry):
+        """Substitui os metadados da URL e grava o cache"""
+        with self._lock:
+            self._entries[url] = dict(entry)
+            self._save()
+
+    def update(self, url, **fields):
+        """Atualiza campos dos metadados da URL e grava o cache"""
+        with self._lock:
+            self._entries.setdefault(url, {}).update(fields)
+            self._save()
+
+    def remove(self, url):
+        """Remove a URL do cache"""
+        with self._lock:
+            if self._entries.pop(url, None) is not None:
+                self._save()
+
+    def conditional_headers(self, url):
+        """Cabeçalhos de requisição condicional a partir dos validadores gravados"""
+        entry = self.get(url)
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def matches(self, url, validators):
+        """Indica se os validadores remotos correspondem aos gravados para a URL"""
+        entry = self.get(url)
+        if not entry:
+            return False
+        if entry.get('etag') and validators.get('etag'):
+            return entry['etag'] == validators['etag']
+        if not entry.get('last_modified') and not entry.get('content_length'):
+            return False
+        return (entry.get('last_modified') == validators.get('last_modified')
+                and entry.get('content_length') == validators.get('content_length'))
+
+    def _save(self):
+        """Grava o cache de forma atômica (temporário + rename)"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def response_validators(response):
+    """Extrai ETag, Last-Modified e Content-Length de uma resposta requests"""
+    content_length = response.headers.get('content-length')
+    return {
+        'etag': response.headers.get('etag'),
+        'last_modified': response.headers.get('last-modified'),
+        'content_length': int(content_length) if content_length and content_length.isdigit() else None,
+    }
@@ -7,138 +7,1002 @@ em lotes (chunks) para otimizar o uso de memória e os salva em formato Parquet
 com compressão, ideal para análise de dados.
 """
 import os
+import time
 import glob
+import hashlib
+import sqlite3
+import argparse
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
+import pyarrow.csv as pacsv
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import logging
 from datetime import datetime
-import pytz  # Adicionado para timezone
 
 # Importa os metadados
-from metadata import LAYOUTS, TABLE_NAMES
+from metadata import LAYOUTS, TABLE_NAMES, COLUMN_TYPES, DATE_NULL_VALUES
+from parquet_dataset import (table_path, parquet_files, partition_columns, partition_values, open_dataset,
+                             months as months_in)
+from aggregates import build_aggregates
+from cnpj_index import build_index, index_dir
+from cnpj_search import build_search_index, search_dir
+from instrumentation import setup_logger, stage, configure as configure_metrics
+from pipeline_state import (PipelineState, state_path, month_of, zip_table_name,
+                            DOWNLOAD, EXTRACT, CONVERT, TABLE, DONE, FAILED)
+
+# Partição padrão de cada tabela no modo particionado. 'cnpj_prefixo' é
+# derivada dos dois primeiros dígitos do cnpj_basico (100 partições).
+PARTITIONING = {
+    'empresas': 'cnpj_prefixo',
+    'estabelecimentos': 'cnpj_prefixo',
+    'socios': 'cnpj_prefixo',
+    'simples': 'cnpj_prefixo',
+}
+
+# Tabela derivada com um CNAE secundário por linha (ver explode_cnaes_secundarios)
+CNAES_SECUNDARIOS_TABLE = 'cnaes_secundarios'
 
 # --- Configurações ---
 EXTRACTED_DIR = 'extracted'
+DOWNLOAD_DIR = 'downloads'
 PARQUET_DIR = 'parquet'
 CHUNKSIZE = 100000  # Processa 100.000 linhas por vez (ajuste conforme a RAM)
+ENGINE = 'pyarrow'  # Leitor CSV: 'pyarrow' (em fluxo, multithread) ou 'pandas'
+BLOCK_SIZE = 32 * 1024 * 1024  # Tamanho dos blocos lidos pelo PyArrow (~ um lote)
+TYPED = True  # Grava datas, decimais, inteiros e códigos com os tipos de COLUMN_TYPES
+ROW_GROUP_SIZE = 100000  # Linhas por row group nos datasets particionados e ordenados
+SORT_ROWS = 2000000  # Máximo de linhas de uma partição ordenadas em memória de uma vez
+MAX_PARTITIONS = 10000  # Valores distintos aceitos na coluna de partição (municípios: ~5.570)
+MEMORY_PER_WORKER = 1024 * 1024 * 1024  # Memória estimada por processo na conversão paralela
 LOG_DIR = 'logs'
 
 # --- Configuração do Logging ---
-os.makedirs(LOG_DIR, exist_ok=True)
-log_file = os.path.join(LOG_DIR, f"parquet_import_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-# Remove handlers antigos para evitar logs duplicados
-if logger.hasHandlers():
-    logger.handlers.clear()
-
-class SaoPauloFormatter(logging.Formatter):
-    def converter(self, timestamp):
-        dt = datetime.fromtimestamp(timestamp, pytz.timezone('America/Sao_Paulo'))
-        return dt
-
-    def formatTime(self, record, datefmt=None):
-        dt = self.converter(record.created)
-        if datefmt:
-            s = dt.strftime(datefmt)
-        else:
-            s = dt.isoformat()
-        return s
+# Só o terminal ao importar o módulo; o arquivo em LOG_DIR é aberto por log_to_file
+LOG_FORMAT = '%(asctime)s [%(levelname)s] - %(message)s'
+logger = setup_logger(__name__, None, LOG_FORMAT)
+
+def log_to_file():
+    """Grava também o log da conversão em LOG_DIR/parquet_import_<data>.log (linha de comando)"""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_file = os.path.join(LOG_DIR, f"parquet_import_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+    setup_logger(__name__, log_file, LOG_FORMAT)
+
+def get_table_name(file_name):
+    """Identifica a tabela de um arquivo (ou membro de ZIP) pelo seu nome"""
+    base_name = os.path.basename(file_name).upper()
+    for type_key, table_name in TABLE_NAMES.items():
+        if type_key in base_name:
+            return table_name
+    return None
+
+def _stage_paths(stage, directory, pattern):
+    """
+    Arquivos de uma etapa do pipeline em `directory`/<mês>. Os meses
+    registrados no manifesto (pipeline_state) vêm dele, sem percorrer os
+    diretórios; os demais (ex: arquivos copiados à mão) e os meses com
+    arquivos registrados que não existem mais em disco são localizados com glob.
+    """
+    root = os.path.abspath(directory)
+    registered, missing = {}, set()
+    for row in PipelineState(state_path(DOWNLOAD_DIR)).files(stage=stage, status=DONE):
+        if row['caminho'] and os.path.dirname(os.path.abspath(row['caminho'])) == os.path.join(root, row['mes']):
+            if os.path.exists(row['caminho']):
+                registered.setdefault(row['mes'], []).append(row['caminho'])
+            else:
+                missing.add(row['mes'])
+    for month in sorted(missing):
+        logger.warning(f"Arquivos de {month} no manifesto não existem mais em '{directory}'; localizando com glob.")
+        registered.pop(month, None)
+    if not registered:
+        return sorted(glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+    paths = [path for month_paths in registered.values() for path in month_paths]
+    for month in sorted(os.listdir(directory)):
+        if month not in registered and os.path.isdir(os.path.join(directory, month)):
+            paths += glob.glob(os.path.join(directory, month, '**', pattern), recursive=True)
+    return sorted(paths)
+
+def find_sources(from_zip=False):
+    """
+    Localiza os arquivos de entrada de cada tabela.
+
+    Retorna {tabela: [(caminho, membro), ...]}. Com `from_zip`, os arquivos
+    são os membros dos ZIPs em 'downloads' (membro = nome dentro do ZIP);
+    caso contrário, os arquivos já extraídos em 'extracted' (membro = None).
+    """
+    sources = {}
+    if from_zip:
+        for zip_path in _stage_paths(DOWNLOAD, DOWNLOAD_DIR, '*.zip'):
+            for table_name, member in _zip_members(zip_path):
+                sources.setdefault(table_name, []).append((zip_path, member))
+    else:
+        for file_path in _stage_paths(EXTRACT, EXTRACTED_DIR, '*'):
+            table_name = get_table_name(file_path)
+            if table_name in LAYOUTS:
+                sources.setdefault(table_name, []).append((file_path, None))
+    return sources
+
+def _zip_members(zip_path):
+    """Lista (tabela, membro) dos arquivos de dados contidos em um ZIP"""
+    try:
+        with zipfile.ZipFile(zip_path) as zip_ref:
+            names = [info.filename for info in zip_ref.infolist() if not info.is_dir()]
+    except zipfile.BadZipFile as e:
+        logger.error(f"ZIP inválido, ignorando {zip_path}: {e}")
+        return []
+    return [(get_table_name(name), name) for name in names if get_table_name(name) in LAYOUTS]
+
+def source_name(source):
+    """Nome legível de uma fonte (arquivo ou arquivo.zip:membro)"""
+    path, member = source
+    return f"{os.path.basename(path)}:{member}" if member else os.path.basename(path)
+
+@contextmanager
+def open_source(source):
+    """Abre uma fonte em modo binário; membros de ZIP são descompactados em fluxo"""
+    path, member = source
+    if member is None:
+        with open(path, 'rb') as f:
+            yield f
+    else:
+        with zipfile.ZipFile(path) as zip_ref:
+            with zip_ref.open(member) as f:
+                yield f
+
+def read_batches(f, table_name, engine=ENGINE):
+    """
+    Lê um arquivo aberto em modo binário e gera lotes (pa.Table ou
+    pa.RecordBatch) com todas as colunas do leiaute como string.
+
+    engine='pyarrow' usa o leitor CSV em fluxo do PyArrow (multithread, em
+    blocos de BLOCK_SIZE bytes, sem passar por objetos Python);
+    engine='pandas' usa pd.read_csv em chunks de CHUNKSIZE linhas.
+    """
+    columns = LAYOUTS[table_name]
+    if engine == 'pyarrow':
+        reader = pacsv.open_csv(
+            f,
+            read_options=pacsv.ReadOptions(column_names=columns, encoding='latin-1',
+                                           block_size=BLOCK_SIZE, use_threads=True),
+            parse_options=pacsv.ParseOptions(delimiter=';', quote_char='"',
+                                             invalid_row_handler=_skip_invalid_row),
+            convert_options=pacsv.ConvertOptions(column_types={col: pa.string() for col in columns},
+                                                 strings_can_be_null=True, null_values=['']),
+        )
+        for batch in reader:
+            yield batch
+    elif engine == 'pandas':
+        reader = pd.read_csv(
+            f,
+            sep=';',
+            header=None,
+            names=columns,
+            dtype=str,
+            encoding='latin-1',
+            chunksize=CHUNKSIZE,
+            keep_default_na=False,
+            na_values=['']
+        )
+        pa_schema = pa.schema([(col, pa.string()) for col in columns])
+        for chunk in reader:
+            # Converte o chunk do pandas para uma Tabela do Arrow
+            yield pa.Table.from_pandas(chunk, schema=pa_schema, preserve_index=False)
+    else:
+        raise ValueError(f"Engine de leitura desconhecida: {engine}")
+
+def _skip_invalid_row(row):
+    """Registra e descarta linhas com número de colunas diferente do leiaute"""
+    logger.warning(f"Linha inválida ignorada ({row.actual_columns} colunas, esperadas "
+                   f"{row.expected_columns}): {row.text[:200]!r}")
+    return 'skip'
+
+def _timed(iterable, timings, key):
+    """Itera somando em timings[key] o tempo gasto para obter cada item"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings[key] += time.perf_counter() - start
+            return
+        timings[key] += time.perf_counter() - start
+        yield item
+
+def _record_conversion(source, table_name, rows=None, error=None):
+    """Registra a conversão de uma fonte no manifesto do pipeline, sem interromper a conversão"""
+    path, _ = source
+    try:
+        PipelineState(state_path(DOWNLOAD_DIR)).record(
+            month_of(path), CONVERT, source_name(source), path, table=table_name, rows=rows,
+            status=FAILED if error else DONE, error=error)
+    except sqlite3.Error as e:
+        logger.warning(f"Não foi possível registrar a conversão de {source_name(source)}: {e}")
+
+def write_source(source, table_name, parquet_writer, engine=ENGINE, typed=TYPED):
+    """
+    Lê uma fonte em lotes e grava no ParquetWriter da tabela; retorna o número
+    de linhas. O tempo de leitura do CSV, conversão de tipos e gravação do
+    Parquet é registrado separadamente na etapa 'conversao'.
+    """
+    logger.info(f"Lendo arquivo: {source_name(source)}")
+    total_rows = 0
+    timings = {'segundos_leitura': 0.0, 'segundos_tipos': 0.0, 'segundos_gravacao': 0.0}
+    try:
+        with stage('conversao', tabela=table_name, arquivo=source_name(source)) as record, open_source(source) as f:
+            for i, batch in enumerate(_timed(read_batches(f, table_name, engine), timings, 'segundos_leitura')):
+                logger.info(f"- {table_name} - Processando lote {i+1} ({batch.num_rows} linhas)")
+                total_rows += batch.num_rows
+                start = time.perf_counter()
+                if typed:
+                    batch = apply_column_types(batch, table_name)
+                typed_at = time.perf_counter()
+                parquet_writer.write(batch)
+                timings['segundos_tipos'] += typed_at - start
+                timings['segundos_gravacao'] += time.perf_counter() - typed_at
+                record.add(rows=batch.num_rows)
+            record.add(bytes=source_size(source))
+            record.labels.update({key: round(value, 4) for key, value in timings.items()})
+    except Exception as e:
+        _record_conversion(source, table_name, error=str(e))
+        raise
+    _record_conversion(source, table_name, total_rows)
+    return total_rows
+
+def arrow_type(type_name):
+    """Converte um tipo de COLUMN_TYPES (ex: 'decimal(15,2)') no tipo PyArrow correspondente"""
+    if type_name == 'string':
+        return pa.string()
+    if type_name == 'date':
+        return pa.date32()
+    if type_name == 'dictionary':
+        return pa.dictionary(pa.int32(), pa.string())
+    if type_name in ('int8', 'int16', 'int32', 'int64'):
+        return getattr(pa, type_name)()
+    if type_name.startswith('decimal(') and type_name.endswith(')'):
+        precision, scale = (int(value) for value in type_name[len('decimal('):-1].split(','))
+        return pa.decimal128(precision, scale)
+    raise ValueError(f"Tipo de coluna desconhecido: {type_name}")
+
+def table_schema(table_name, typed=TYPED):
+    """Schema PyArrow da tabela; sem `typed`, todas as colunas como string"""
+    column_types = COLUMN_TYPES.get(table_name, {}) if typed else {}
+    return pa.schema([(col, arrow_type(column_types.get(col, 'string'))) for col in LAYOUTS[table_name]])
+
+def _null_unless(array, valid):
+    """Substitui por nulo os valores em que `valid` é falso"""
+    return pc.if_else(valid, array, pa.scalar(None, array.type))
+
+def cast_column(array, type_name, date_null_values=DATE_NULL_VALUES):
+    """
+    Converte uma coluna string para o tipo de COLUMN_TYPES. Valores vazios,
+    sentinelas de data (`date_null_values`) e valores inválidos viram nulo,
+    inclusive números que não cabem no tipo (inteiros fora do intervalo,
+    decimais com dígitos ou casas decimais demais): a conversão nunca falha
+    por causa de um valor.
+    """
+    if type_name == 'string':
+        return array
+    if type_name == 'dictionary':
+        return pc.dictionary_encode(array)
+    if type_name == 'date':
+        if date_null_values:
+            array = _null_unless(array, pc.invert(pc.is_in(array, value_set=pa.array(date_null_values))))
+        timestamps = pc.strptime(array, format='%Y%m%d', unit='s', error_is_null=True)
+        # strptime aceita dias fora do mês (20230231 -> 2023-03-03): confere a volta
+        valid = pc.equal(pc.strftime(timestamps, format='%Y%m%d'), array)
+        return _null_unless(timestamps, pc.fill_null(valid, False)).cast(pa.date32())
+    if type_name.startswith('decimal('):
+        decimal_type = arrow_type(type_name)
+        integer_digits = decimal_type.precision - decimal_type.scale
+        pattern = rf'^-?0*\d{{1,{integer_digits}}}(\.\d{{1,{decimal_type.scale}}})?$'
+        array = pc.replace_substring(array, ',', '.')
+        array = _null_unless(array, pc.fill_null(pc.match_substring_regex(array, pattern), False))
+        return array.cast(decimal_type)
+    bits = arrow_type(type_name).bit_width
+    array = _null_unless(array, pc.fill_null(pc.match_substring_regex(array, r'^-?0*\d{1,18}$'), False))
+    numbers = array.cast(pa.int64())
+    in_range = pc.and_(pc.greater_equal(numbers, -2 ** (bits - 1)), pc.less_equal(numbers, 2 ** (bits - 1) - 1))
+    return _null_unless(numbers, pc.fill_null(in_range, False)).cast(arrow_type(type_name))
+
+def apply_column_types(batch, table_name, date_null_values=DATE_NULL_VALUES):
+    """Converte um lote só de strings para o schema tipado da tabela"""
+    column_types = COLUMN_TYPES.get(table_name, {})
+    if not column_types:
+        return batch
+    arrays = [
+        cast_column(batch.column(i), column_types.get(name, 'string'), date_null_values)
+        for i, name in enumerate(batch.schema.names)
+    ]
+    return type(batch).from_arrays(arrays, schema=table_schema(table_name, typed=True))
+
+def month_dir(month):
+    """Pasta das tabelas Parquet de um mês ('' = raiz, para fontes fora de pastas de mês)"""
+    return os.path.join(PARQUET_DIR, month) if month else PARQUET_DIR
+
+def sources_by_month(sources):
+    """Agrupa {tabela: fontes} por mês da pasta de origem: {mês: {tabela: fontes}}"""
+    months = {}
+    for table_name, table_sources in sources.items():
+        for source in table_sources:
+            months.setdefault(month_of(source[0]), {}).setdefault(table_name, []).append(source)
+    return months
+
+def sources_fingerprint(sources, typed=TYPED):
+    """Impressão digital das fontes de uma tabela: nome, membro, tamanho e mtime de cada uma"""
+    digest = hashlib.sha1(f'typed={typed};'.encode())
+    for path, member in sorted(sources, key=lambda source: (source[0], source[1] or '')):
+        stat = os.stat(path)
+        digest.update(f'{os.path.basename(path)}:{member}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return f'fontes:{digest.hexdigest()[:16]}'
+
+def _is_converted(state, month, table_name, fingerprint):
+    """Indica se a tabela do mês já foi gravada a partir das mesmas fontes e não mudou em disco"""
+    path = table_path(month_dir(month), table_name)
+    return path is not None and state.is_done(month, TABLE, table_name, path, fingerprint)
+
+def _link_or_copy(source_path, target_path):
+    """Hard link de um arquivo (sem duplicar dados); cópia se o sistema não permitir"""
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path)
+
+def publish_table(month, table_name):
+    """
+    Publica a tabela de um mês como a versão atual na raiz de 'parquet' (lida
+    pelo índice, consultas, carga etc.), com hard links para os arquivos do
+    mês, e substitui a versão anterior ao final.
+    """
+    source_path = table_path(month_dir(month), table_name)
+    dataset_dir = os.path.join(PARQUET_DIR, table_name)
+    legacy_path = os.path.join(PARQUET_DIR, f'{table_name}.parquet')
+    if os.path.isfile(source_path):
+        tmp_path = legacy_path + '.publish'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        _link_or_copy(source_path, tmp_path)
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+        os.replace(tmp_path, legacy_path)
+    else:
+        staging_dir = dataset_dir + '.publish'
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        for file_path in parquet_files(source_path):
+            target_path = os.path.join(staging_dir, os.path.relpath(file_path, source_path))
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            _link_or_copy(file_path, target_path)
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        os.replace(staging_dir, dataset_dir)
+    logger.info(f"Tabela '{table_name}' de {month} publicada em '{PARQUET_DIR}'.")
+
+def _publish_table_safely(month, table_name):
+    """
+    Publica a tabela de um mês registrando erros sem interromper a conversão.
+    Retorna False se falhou: a tabela então não é registrada como convertida,
+    e a próxima execução a converte e publica de novo.
+    """
+    try:
+        publish_table(month, table_name)
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao publicar a tabela '{table_name}': {e}", exc_info=True)
+        return False
 
-formatter = SaoPauloFormatter('%(asctime)s [%(levelname)s] - %(message)s')
-file_handler = logging.FileHandler(log_file, encoding='utf-8')
-file_handler.setFormatter(formatter)
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+def convert_table(table_name, sources, output_dir, engine=ENGINE, typed=TYPED):
+    """
+    Converte as fontes de uma tabela em `<output_dir>/<tabela>.parquet`,
+    gravando em um temporário renomeado ao final: uma falha mantém a saída
+    anterior intacta. Retorna o número de linhas.
+    """
+    parquet_path = os.path.join(output_dir, f'{table_name}.parquet')
+    tmp_path = parquet_path + '.tmp'
+    total_rows = 0
+    try:
+        with pq.ParquetWriter(tmp_path, table_schema(table_name, typed), compression='snappy') as parquet_writer:
+            for source in sources:
+                total_rows += write_source(source, table_name, parquet_writer, engine, typed)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, parquet_path)
+    # Remove o dataset de uma conversão paralela anterior, agora substituído
+    shutil.rmtree(os.path.join(output_dir, table_name), ignore_errors=True)
+    logger.info(f"Arquivo Parquet '{parquet_path}' criado com sucesso.")
+    logger.info(f"Total de {total_rows} linhas processadas para a tabela '{table_name}'.")
+    return total_rows
 
-def process_files_to_parquet():
+@stage('importacao')
+def process_files_to_parquet(from_zip=False, engine=ENGINE, workers=1, typed=TYPED,
+                             partition=False, partition_by=None, row_group_size=ROW_GROUP_SIZE,
+                             month=None, force=False):
     """
     Lê os arquivos de texto da pasta 'extracted', converte em DataFrames
     e salva em formato Parquet, um arquivo por tipo de tabela.
+
+    Cada mês de origem (`extracted/<AAAA-MM>/`) é gravado em sua própria
+    pasta, `parquet/<AAAA-MM>/`, e as tabelas do mês mais recente são
+    publicadas na raiz de 'parquet' (ver publish_table). Tabelas cujas
+    fontes não mudaram desde a última conversão completa (manifesto do
+    pipeline) são puladas, a menos que `force`; assim, após uma falha, só a
+    tabela que falhou é refeita. `month` limita a conversão a um mês.
+
+    Com `from_zip=True`, lê os membros dos ZIPs em 'downloads' diretamente,
+    sem precisar da pasta 'extracted'. `engine` escolhe o leitor CSV
+    ('pyarrow' ou 'pandas'). Com `workers` diferente de 1 (0 = todos os
+    núcleos), a conversão é feita em paralelo por arquivo (ver
+    process_files_in_parallel). Com `typed`, as colunas recebem os tipos de
+    metadata.COLUMN_TYPES; caso contrário, ficam todas como string.
+    Com `partition`, cada tabela de PARTITIONING é regravada como dataset
+    particionado e ordenado (ver partition_table).
+
+    Retorna {mês: [tabelas]} das tabelas que falharam na conversão ou na
+    publicação (vazio se todas as pendentes foram gravadas).
     """
     logger.info("Iniciando processo de conversão para Parquet.")
     os.makedirs(PARQUET_DIR, exist_ok=True)
 
-    if not os.path.exists(EXTRACTED_DIR):
-        logger.error(f"Diretório de extração não encontrado: {EXTRACTED_DIR}")
-        return
+    source_dir = DOWNLOAD_DIR if from_zip else EXTRACTED_DIR
+    if not os.path.exists(source_dir):
+        logger.error(f"Diretório de origem não encontrado: {source_dir}")
+        return {}
 
-    # Itera sobre cada tipo de tabela definido nos metadados
-    for table_name in LAYOUTS.keys():
-        logger.info(f"--- Processando tabela: {table_name} ---")
+    months = sources_by_month(find_sources(from_zip))
+    if month is not None:
+        months = {month: months.get(month, {})}
+    latest = max([name for name in months if name] + months_in(PARQUET_DIR), default=None)
+    state = PipelineState(state_path(DOWNLOAD_DIR))
 
-        type_key = next((k for k, v in TABLE_NAMES.items() if v == table_name), None)
-        if not type_key:
-            logger.warning(f"Nenhuma chave de tipo de arquivo encontrada para a tabela {table_name}. Pulando.")
+    updated = []  # Tabelas atualizadas na raiz de 'parquet'
+    failures = {}  # {mês: [tabelas que falharam]}
+    for month_name, sources in sorted(months.items()):
+        output_dir = month_dir(month_name)
+        os.makedirs(output_dir, exist_ok=True)
+        fingerprints = {table_name: sources_fingerprint(table_sources, typed)
+                        for table_name, table_sources in sources.items()}
+        pending = {}
+        for table_name in LAYOUTS:
+            if table_name not in sources:
+                logger.warning(f"Nenhum arquivo encontrado para a tabela '{table_name}' em {month_name or output_dir}. Pulando.")
+            elif not force and _is_converted(state, month_name, table_name, fingerprints[table_name]):
+                logger.info(f"Tabela '{table_name}' de {month_name or output_dir} inalterada, pulando.")
+            else:
+                pending[table_name] = sources[table_name]
+        if not pending:
             continue
 
-        search_pattern = os.path.join(EXTRACTED_DIR, '**', f'*{type_key}*')
-        files_to_process = glob.glob(search_pattern, recursive=True)
+        if workers != 1:
+            converted = process_files_in_parallel(pending, engine, workers, typed, output_dir)
+        else:
+            converted = {}
+            # Itera sobre cada tipo de tabela definido nos metadados
+            for table_name, table_sources in pending.items():
+                logger.info(f"--- Processando tabela: {table_name} ({month_name or output_dir}) ---")
+                logger.info(f"Encontrados {len(table_sources)} arquivo(s) para '{table_name}'.")
+                try:
+                    converted[table_name] = convert_table(table_name, table_sources, output_dir, engine, typed)
+                except Exception as e:
+                    logger.error(f"Erro ao processar a tabela '{table_name}': {e}", exc_info=True)
 
-        if not files_to_process:
-            logger.warning(f"Nenhum arquivo encontrado para a tabela '{table_name}'. Pulando.")
-            continue
+        failed = [table_name for table_name in pending if table_name not in converted]
+        for table_name, total_rows in converted.items():
+            if month_name and month_name == latest and not _publish_table_safely(month_name, table_name):
+                failed.append(table_name)
+                continue
+            state.record(month_name, TABLE, table_name, table_path(output_dir, table_name),
+                         table=table_name, rows=total_rows, checksum=fingerprints[table_name])
+            if not month_name or month_name == latest:
+                updated.append(table_name)
+        if failed:
+            failures[month_name] = sorted(failed)
 
-        logger.info(f"Encontrados {len(files_to_process)} arquivo(s) para '{table_name}'.")
+    if partition:
+        # Tabelas atuais ainda não particionadas pela coluna pedida (ex: trocou --partition-by)
+        current = months.get('', {}).keys() | months.get(latest, {}).keys()
+        for table_name in sorted(current - set(updated)):
+            path = table_path(PARQUET_DIR, table_name)
+            column = partition_by if partition_by in LAYOUTS[table_name] + ['cnpj_prefixo'] else PARTITIONING.get(table_name)
+            if path is not None and column is not None and partition_columns(path) != [column]:
+                updated.append(table_name)
+        for table_name in updated:
+            try:
+                with stage('particionamento', tabela=table_name) as record:
+                    record.add(rows=partition_table(table_name, partition_by, row_group_size, workers) or 0)
+            except Exception as e:
+                logger.error(f"Erro ao particionar a tabela '{table_name}': {e}", exc_info=True)
 
-        parquet_path = os.path.join(PARQUET_DIR, f'{table_name}.parquet')
-        
-        # Define o schema do PyArrow com todas as colunas como string
-        try:
-            pa_schema = pa.schema([(col, pa.string()) for col in LAYOUTS[table_name]])
-        except KeyError:
-            logger.warning(f"Layout para a tabela '{table_name}' não encontrado. Pulando.")
+    for month_name, tables in failures.items():
+        logger.error(f"Tabelas não atualizadas em {month_name or PARQUET_DIR}: {', '.join(tables)}")
+    if not updated:
+        logger.info("--- Nenhuma tabela atualizada; conversão para Parquet concluída. ---")
+        return failures
+
+    _explode_cnaes_secundarios_safely()
+    _build_aggregates_safely()
+    _rebuild_indexes_safely()
+    logger.info("--- Processo de conversão para Parquet concluído. ---")
+    return failures
+
+def source_size(source):
+    """Tamanho descompactado de uma fonte, usado para ordenar o trabalho"""
+    path, member = source
+    if member is None:
+        return os.path.getsize(path)
+    with zipfile.ZipFile(path) as zip_ref:
+        return zip_ref.getinfo(member).file_size
+
+def available_memory():
+    """Memória disponível em bytes (MemAvailable do Linux), ou None se desconhecida"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def parallel_workers(workers):
+    """Número de processos: o pedido (0 = núcleos), limitado pela memória disponível"""
+    workers = workers or os.cpu_count() or 1
+    memory = available_memory()
+    if memory:
+        workers = min(workers, max(1, memory // MEMORY_PER_WORKER))
+    return max(1, workers)
+
+def _limit_arrow_threads(threads):
+    """Limita o pool de CPU do Arrow de um processo do pool (leitura CSV, ordenação)"""
+    pa.set_cpu_count(threads)
+
+def process_pool(workers):
+    """
+    Pool de `workers` processos em que o Arrow usa no máximo núcleos/workers
+    threads cada, para que os processos juntos não disputem mais núcleos do
+    que a máquina tem.
+    """
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    return ProcessPoolExecutor(max_workers=workers, initializer=_limit_arrow_threads, initargs=(threads,))
+
+def convert_source_to_part(source, table_name, part_path, engine=ENGINE, typed=TYPED):
+    """Converte uma única fonte em um arquivo Parquet próprio (executado nos processos do pool)"""
+    parquet_writer = pq.ParquetWriter(part_path, table_schema(table_name, typed), compression='snappy')
+    try:
+        return write_source(source, table_name, parquet_writer, engine, typed)
+    finally:
+        parquet_writer.close()
+
+def process_files_in_parallel(sources, engine=ENGINE, workers=0, typed=TYPED, output_dir=None):
+    """
+    Converte cada fonte de cada tabela em uma parte Parquet própria usando
+    um pool de processos e monta as partes em um dataset por tabela
+    (`<output_dir>/<tabela>/part-NNNNN.parquet`, por padrão em 'parquet').
+
+    As maiores fontes são agendadas primeiro para equilibrar a carga, e o
+    número de processos é limitado pela memória disponível (MEMORY_PER_WORKER
+    por processo). Uma tabela só substitui a saída anterior se todas as
+    suas partes forem convertidas. Retorna {tabela: linhas} das tabelas gravadas.
+    """
+    output_dir = output_dir or PARQUET_DIR
+    workers = parallel_workers(workers)
+    tasks = []
+    for table_name, table_sources in sources.items():
+        staging_dir = os.path.join(output_dir, f'{table_name}.tmp')
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        for index, source in enumerate(sorted(table_sources)):
+            part_path = os.path.join(staging_dir, f'part-{index:05d}.parquet')
+            tasks.append((source_size(source), table_name, source, part_path))
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    logger.info(f"Convertendo {len(tasks)} arquivo(s) de {len(sources)} tabela(s) com {workers} processo(s).")
+
+    total_rows = {table_name: 0 for table_name in sources}
+    failed = set()
+    with process_pool(workers) as executor:
+        futures = {
+            executor.submit(convert_source_to_part, source, table_name, part_path, engine, typed): (table_name, source)
+            for _, table_name, source, part_path in tasks
+        }
+        for future in as_completed(futures):
+            table_name, source = futures[future]
+            try:
+                total_rows[table_name] += future.result()
+            except Exception as e:
+                logger.error(f"Erro ao converter {source_name(source)} para '{table_name}': {e}", exc_info=True)
+                failed.add(table_name)
+
+    # Monta o dataset de cada tabela a partir das partes
+    converted = {}
+    for table_name in sources:
+        staging_dir = os.path.join(output_dir, f'{table_name}.tmp')
+        if table_name in failed:
+            logger.error(f"Tabela '{table_name}' não foi atualizada por falha na conversão.")
+            shutil.rmtree(staging_dir, ignore_errors=True)
             continue
-            
-        parquet_writer = None
-        total_rows = 0
+        dataset_dir = os.path.join(output_dir, table_name)
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+        legacy_path = os.path.join(output_dir, f'{table_name}.parquet')
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        os.replace(staging_dir, dataset_dir)
+        logger.info(f"Dataset Parquet '{dataset_dir}' criado com {len(sources[table_name])} parte(s).")
+        logger.info(f"Total de {total_rows[table_name]} linhas processadas para a tabela '{table_name}'.")
+        converted[table_name] = total_rows[table_name]
+    return converted
 
-        try:
-            # Abre o ParquetWriter uma vez por tabela
-            parquet_writer = pq.ParquetWriter(parquet_path, pa_schema, compression='snappy')
-
-            for file_path in files_to_process:
-                logger.info(f"Lendo arquivo: {os.path.basename(file_path)}")
-                
-                reader = pd.read_csv(
-                    file_path,
-                    sep=';',
-                    header=None,
-                    names=LAYOUTS[table_name],
-                    dtype=str,
-                    encoding='latin-1',
-                    chunksize=CHUNKSIZE,
-                    keep_default_na=False,
-                    na_values=['']
-                )
-
-                for i, chunk in enumerate(reader):
-                    logger.info(f"- {table_name} - Processando lote {i+1} ({len(chunk)} linhas)")
-                    total_rows += len(chunk)
-                    
-                    # Converte o chunk do pandas para uma Tabela do Arrow e escreve no arquivo
-                    table = pa.Table.from_pandas(chunk, schema=pa_schema, preserve_index=False)
-                    parquet_writer.write_table(table)
-            
-            if total_rows > 0:
-                logger.info(f"Arquivo Parquet '{parquet_path}' criado com sucesso.")
-                logger.info(f"Total de {total_rows} linhas processadas para a tabela '{table_name}'.")
+def sort_keys(table_name):
+    """Colunas de ordenação das linhas de uma tabela"""
+    columns = LAYOUTS[table_name]
+    if table_name == 'estabelecimentos':
+        return ['cnpj_basico', 'cnpj_ordem', 'cnpj_dv']
+    return ['cnpj_basico'] if 'cnpj_basico' in columns else [columns[0]]
+
+def _key_ranges(dataset, key, max_rows):
+    """
+    Faixas [início, fim) de valores de `key` com até ~`max_rows` linhas cada
+    (uma chave repetida nunca é dividida); None marca a faixa aberta. Só a
+    coluna da chave é lida para escolher os limites.
+    """
+    if dataset.count_rows() <= max_rows:
+        return [(None, None)]
+    column = dataset.to_table(columns=[key]).column(key).drop_null()
+    if len(column) <= max_rows:
+        return [(None, None)]
+    values = column.take(pc.sort_indices(column))
+    bounds = []
+    for position in range(max_rows, len(values), max_rows):
+        value = values[position].as_py()
+        if not bounds or value > bounds[-1]:
+            bounds.append(value)
+    return list(zip([None] + bounds, bounds + [None]))
+
+def _write_sorted_partition(input_dir, output_path, keys, row_group_size, max_rows=SORT_ROWS, column=None):
+    """
+    Ordena uma partição e grava em um único arquivo com row groups de
+    `row_group_size` linhas. Partições com mais de `max_rows` linhas são
+    lidas e ordenadas por faixas da primeira chave (ver _key_ranges), em
+    ordem, para limitar a memória; as linhas sem chave vão para o fim.
+
+    `column` = (nome, valor, posição) repõe nos arquivos, como texto, a
+    coluna da tabela usada como partição (o write_dataset a deixa só no
+    nome do diretório).
+    """
+    dataset = open_dataset(input_dir)
+    schema = dataset.schema
+    if column is not None:
+        name, value, position = column
+        schema = schema.insert(position, pa.field(name, pa.string()))
+    ranges = _key_ranges(dataset, keys[0], max_rows)
+    key = ds.field(keys[0])
+    filters = []
+    for low, high in ranges:
+        expression = None if low is None else key >= low
+        if high is not None:
+            expression = key < high if expression is None else expression & (key < high)
+        filters.append(expression)
+    if len(ranges) > 1:
+        filters.append(key.is_null())
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    order = [(name, 'ascending') for name in keys]
+    total_rows = 0
+    with pq.ParquetWriter(output_path, schema, compression='snappy', write_statistics=True) as writer:
+        for expression in filters:
+            table = dataset.to_table(filter=expression).sort_by(order)
+            if column is not None:
+                table = table.add_column(position, name, pa.array([value] * table.num_rows, pa.string()))
+            writer.write_table(table, row_group_size=row_group_size)
+            total_rows += table.num_rows
+    return total_rows
+
+def partition_table(table_name, partition_by=None, row_group_size=ROW_GROUP_SIZE, workers=1):
+    """
+    Reescreve a tabela já convertida como dataset particionado no estilo Hive
+    (`parquet/<tabela>/<coluna>=<valor>/part-0.parquet`), com as linhas de cada
+    partição ordenadas por `sort_keys` e row groups de `row_group_size`
+    linhas com estatísticas min/max, para que leitores possam descartar
+    partições e row groups em buscas por CNPJ.
+
+    `partition_by` é uma coluna da tabela ou 'cnpj_prefixo' (dois primeiros
+    dígitos do cnpj_basico); por padrão usa PARTITIONING. Uma coluna da
+    tabela continua também dentro dos arquivos (como texto), para quem os lê
+    sem o nome da partição; 'cnpj_prefixo' fica só no diretório. Colunas com mais de
+    MAX_PARTITIONS valores distintos são recusadas (ValueError). Retorna o
+    número de linhas gravadas (None se a tabela não é particionada).
+    """
+    partition_by = partition_by or PARTITIONING.get(table_name)
+    if partition_by is None:
+        return
+    if partition_by != 'cnpj_prefixo' and partition_by not in LAYOUTS[table_name]:
+        logger.warning(f"Tabela '{table_name}' não tem a coluna '{partition_by}', usando {PARTITIONING.get(table_name)}.")
+        partition_by = PARTITIONING.get(table_name)
+        if partition_by is None:
+            return
+
+    source_path = table_path(PARQUET_DIR, table_name)
+    if source_path is None:
+        return
+    logger.info(f"Particionando '{table_name}' por '{partition_by}'.")
+
+    dataset = open_dataset(source_path)
+    # Colunas do leiaute (sem a 'cnpj_prefixo' de um particionamento anterior)
+    names = [name for name in dataset.schema.names if name in LAYOUTS[table_name]]
+    columns = {name: ds.field(name) for name in names}
+    if partition_by == 'cnpj_prefixo':
+        columns['cnpj_prefixo'] = pc.utf8_slice_codeunits(ds.field('cnpj_basico'), 0, 2)
+    elif pa.types.is_dictionary(dataset.schema.field(partition_by).type):
+        columns[partition_by] = ds.field(partition_by).cast(pa.string())
+
+    distinct = pc.count_distinct(dataset.scanner(columns={partition_by: columns[partition_by]})
+                                 .to_table().column(partition_by), mode='all').as_py()
+    if distinct > MAX_PARTITIONS:
+        raise ValueError(f"'{partition_by}' tem {distinct} valores distintos em '{table_name}' "
+                         f"(máximo {MAX_PARTITIONS} partições).")
+
+    # 1. Distribui as linhas pelas partições
+    staging_dir = os.path.join(PARQUET_DIR, f'{table_name}.partitioning')
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    ds.write_dataset(
+        dataset.scanner(columns=columns),
+        staging_dir,
+        format='parquet',
+        partitioning=ds.partitioning(pa.schema([(partition_by, pa.string())]), flavor='hive'),
+        max_partitions=MAX_PARTITIONS,
+    )
+
+    # 2. Ordena cada partição e grava com row groups de tamanho fixo
+    output_dir = os.path.join(PARQUET_DIR, f'{table_name}.tmp')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    partitions = sorted(name for name in os.listdir(staging_dir) if '=' in name)
+    keys = sort_keys(table_name)
+    position = names.index(partition_by) if partition_by in names else None
+
+    def kept_column(name):
+        if position is None:
+            return None
+        value = partition_values(staging_dir, os.path.join(staging_dir, name, 'part-0.parquet'))[partition_by]
+        return partition_by, value, position
+
+    total_rows = 0
+    with process_pool(parallel_workers(workers)) as executor:
+        futures = [
+            executor.submit(_write_sorted_partition, os.path.join(staging_dir, name),
+                            os.path.join(output_dir, name, 'part-0.parquet'), keys, row_group_size,
+                            SORT_ROWS, kept_column(name))
+            for name in partitions
+        ]
+        for future in as_completed(futures):
+            total_rows += future.result()
+    shutil.rmtree(staging_dir)
 
+    # 3. Substitui a saída não particionada
+    shutil.rmtree(os.path.join(PARQUET_DIR, table_name), ignore_errors=True)
+    legacy_path = os.path.join(PARQUET_DIR, f'{table_name}.parquet')
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+    os.replace(output_dir, os.path.join(PARQUET_DIR, table_name))
+    logger.info(f"Tabela '{table_name}' particionada em {len(partitions)} partição(ões), {total_rows} linhas.")
+    return total_rows
+
+def _cnae_descriptions():
+    """(códigos, descrições) da tabela 'cnaes' já convertida, ou None se ela não existir"""
+    path = table_path(PARQUET_DIR, 'cnaes')
+    if path is None:
+        return None
+    table = open_dataset(path).to_table(columns=['codigo', 'descricao'])
+    return (table.column('codigo').cast(pa.string()).combine_chunks(),
+            table.column('descricao').cast(pa.string()).combine_chunks())
+
+def _explode_cnaes_secundarios_safely():
+    """Gera 'cnaes_secundarios' ao fim da conversão, registrando erros sem interrompê-la"""
+    try:
+        with stage(CNAES_SECUNDARIOS_TABLE) as record:
+            record.add(rows=explode_cnaes_secundarios())
+    except Exception as e:
+        logger.error(f"Erro ao gerar a tabela '{CNAES_SECUNDARIOS_TABLE}': {e}", exc_info=True)
+
+def _build_aggregates_safely():
+    """Recalcula os agregados do dashboard ao fim da conversão, registrando erros sem interrompê-la"""
+    try:
+        with stage('agregados'):
+            build_aggregates(PARQUET_DIR)
+    except Exception as e:
+        logger.error(f"Erro ao calcular os agregados: {e}", exc_info=True)
+
+def _rebuild_indexes_safely():
+    """
+    Reconstrói os índices de CNPJ e de nomes já existentes em 'parquet' após
+    publicar novas tabelas, para que a API (cnpj_api) troque de versão sem
+    ler os arquivos novos com as posições antigas. Erros são registrados sem
+    interromper a conversão.
+    """
+    builders = [(build_index, os.path.join(index_dir(PARQUET_DIR), 'index.json')),
+                (build_search_index, os.path.join(search_dir(PARQUET_DIR), 'search.json'))]
+    for build, manifest_path in builders:
+        if not os.path.exists(manifest_path):
+            continue
+        try:
+            with stage('indices', indice=build.__name__):
+                build(PARQUET_DIR)
         except Exception as e:
-            logger.error(f"Erro ao processar a tabela '{table_name}': {e}", exc_info=True)
-        finally:
-            # Garante que o writer seja fechado
-            if parquet_writer:
-                parquet_writer.close()
+            logger.error(f"Erro ao reconstruir o índice ({build.__name__}): {e}", exc_info=True)
 
-    logger.info("--- Processo de conversão para Parquet concluído. ---")
+def explode_cnaes_secundarios():
+    """
+    Gera a tabela 'cnaes_secundarios' a partir da coluna cnae_fiscal_secundaria
+    de 'estabelecimentos' (códigos separados por vírgula), com uma linha por
+    estabelecimento e CNAE secundário. A separação é vetorizada no Arrow
+    (split_pattern + list_flatten + list_parent_indices), lote a lote.
+    Quando a tabela 'cnaes' existe, inclui a descrição de cada código.
+    """
+    source_path = table_path(PARQUET_DIR, 'estabelecimentos')
+    if source_path is None:
+        return 0
+    logger.info(f"--- Gerando tabela: {CNAES_SECUNDARIOS_TABLE} ---")
+
+    keys = ['cnpj_basico', 'cnpj_ordem', 'cnpj_dv']
+    descriptions = _cnae_descriptions()
+    fields = [(key, pa.string()) for key in keys] + [('cnae_secundario', pa.string())]
+    if descriptions is not None:
+        fields.append(('cnae_secundario_descricao', pa.string()))
+    schema = pa.schema(fields)
+
+    output_path = os.path.join(PARQUET_DIR, f'{CNAES_SECUNDARIOS_TABLE}.parquet')
+    tmp_path = output_path + '.tmp'
+    total_rows = 0
+    with pq.ParquetWriter(tmp_path, schema, compression='snappy') as writer:
+        for batch in open_dataset(source_path).to_batches(columns=keys + ['cnae_fiscal_secundaria']):
+            codes = pc.split_pattern(batch.column('cnae_fiscal_secundaria').cast(pa.string()), ',')
+            flat = pc.utf8_trim_whitespace(pc.list_flatten(codes))
+            parents = pc.list_parent_indices(codes)
+            valid = pc.fill_null(pc.not_equal(flat, ''), False)
+            flat, parents = flat.filter(valid), parents.filter(valid)
+            if not len(flat):
+                continue
+            arrays = [batch.column(key).cast(pa.string()).take(parents) for key in keys] + [flat]
+            if descriptions is not None:
+                arrays.append(descriptions[1].take(pc.index_in(flat, value_set=descriptions[0])))
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            total_rows += len(flat)
+    os.replace(tmp_path, output_path)
+    shutil.rmtree(os.path.join(PARQUET_DIR, CNAES_SECUNDARIOS_TABLE), ignore_errors=True)
+    logger.info(f"Total de {total_rows} linhas geradas para a tabela '{CNAES_SECUNDARIOS_TABLE}'.")
+    return total_rows
+
+def convert_while_downloading(year_month=None, downloader=None, engine=ENGINE, typed=TYPED):
+    """
+    Baixa um mês (o mais recente por padrão) e converte cada ZIP para Parquet
+    assim que seu download termina, lendo os membros direto do ZIP enquanto
+    os demais arquivos continuam baixando. Nada é gravado em 'extracted'.
+    ZIPs com CRC inválido vão para a quarentena em vez de serem convertidos
+    e, como os que falharam no download, são baixados uma segunda vez; se
+    ainda faltarem, a tabela do ZIP (pelo prefixo do nome) conta como falha.
+    As tabelas vão para `parquet/<AAAA-MM>/` (temporários renomeados ao
+    final, só as que não tiveram erro nem ZIP faltando) e são publicadas na
+    raiz se o mês é o mais recente já convertido.
+    """
+    from cnpj_downloader import CNPJDownloader, verify_zip
+
+    logger.info("Iniciando download com conversão simultânea para Parquet.")
+
+    downloader = downloader or CNPJDownloader()
+    directory = f"{year_month}/" if year_month else downloader.get_latest_directory()
+    month = directory.rstrip('/')
+    output_dir = month_dir(month)
+    os.makedirs(output_dir, exist_ok=True)
+    files = downloader.get_files_from_directory(directory)
+
+    writers = {}
+    total_rows = {}
+    sources = {}
+    failed = set()
+    received = set()  # ZIPs íntegros entregues à conversão
+
+    def tmp_path(table_name):
+        return os.path.join(output_dir, f'{table_name}.parquet.tmp')
+
+    def convert(file_info, file_path):
+        error = verify_zip(file_path)
+        if error:
+            downloader.quarantine_file(file_path, directory, error)
+            return
+        received.add(file_info['name'])
+        for table_name, member in _zip_members(file_path):
+            try:
+                if table_name not in writers:
+                    writers[table_name] = pq.ParquetWriter(tmp_path(table_name), table_schema(table_name, typed), compression='snappy')
+                    total_rows[table_name] = 0
+                sources.setdefault(table_name, []).append((file_path, member))
+                total_rows[table_name] += write_source((file_path, member), table_name,
+                                                       writers[table_name], engine, typed)
+            except Exception as e:
+                logger.error(f"Erro ao converter {file_info['name']}:{member}: {e}", exc_info=True)
+                failed.add(table_name)
+
+    try:
+        downloader.download_files(files, directory, on_complete=convert)
+        retry = [file_info for file_info in files if file_info['name'] not in received]
+        if retry:
+            logger.warning(f"Baixando novamente {len(retry)} arquivo(s) ausente(s) ou corrompido(s)")
+            downloader.download_files(retry, directory, on_complete=convert)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # Uma tabela com ZIP faltando ficaria truncada: não é gravada nem publicada
+    for file_info in files:
+        table_name = zip_table_name(file_info['name'])
+        if file_info['name'] not in received and table_name is not None:
+            logger.error(f"{file_info['name']} não foi baixado íntegro; tabela '{table_name}' incompleta.")
+            failed.add(table_name)
+
+    state = PipelineState(state_path(DOWNLOAD_DIR))
+    latest = max(months_in(PARQUET_DIR))
+    for table_name in writers:
+        if table_name in failed:
+            logger.error(f"Tabela '{table_name}' não foi atualizada por falha na conversão.")
+            os.remove(tmp_path(table_name))
+            continue
+        os.replace(tmp_path(table_name), os.path.join(output_dir, f'{table_name}.parquet'))
+        shutil.rmtree(os.path.join(output_dir, table_name), ignore_errors=True)
+        logger.info(f"Total de {total_rows[table_name]} linhas processadas para a tabela '{table_name}'.")
+        if month == latest and not _publish_table_safely(month, table_name):
+            continue
+        state.record(month, TABLE, table_name, table_path(output_dir, table_name), table=table_name,
+                     rows=total_rows[table_name], checksum=sources_fingerprint(sources[table_name], typed))
+
+    _explode_cnaes_secundarios_safely()
+    _build_aggregates_safely()
+    _rebuild_indexes_safely()
+    logger.info("--- Download e conversão para Parquet concluídos. ---")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converte os dados abertos do CNPJ para Parquet.")
+    parser.add_argument('--from-zip', action='store_true',
+                        help="lê os ZIPs de 'downloads' diretamente, sem usar a pasta 'extracted'")
+    parser.add_argument('--while-downloading', nargs='?', const='', metavar='YYYY-MM',
+                        help="baixa o mês (o mais recente se omitido) e converte cada ZIP assim que chega")
+    parser.add_argument('--engine', choices=['pyarrow', 'pandas'], default=ENGINE,
+                        help=f"leitor CSV (padrão: {ENGINE})")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processos para converter arquivos em paralelo (0 = todos os núcleos; padrão: 1)")
+    parser.add_argument('--untyped', action='store_true',
+                        help="grava todas as colunas como string, sem os tipos de metadata.COLUMN_TYPES")
+    parser.add_argument('--partition', action='store_true',
+                        help="grava empresas/estabelecimentos/socios/simples como datasets particionados e ordenados")
+    parser.add_argument('--partition-by', metavar='COLUNA',
+                        help="coluna de partição (padrão: cnpj_prefixo, os 2 primeiros dígitos do cnpj_basico)")
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE,
+                        help=f"linhas por row group no modo particionado (padrão: {ROW_GROUP_SIZE})")
+    parser.add_argument('--month', metavar='YYYY-MM',
+                        help="converte só as fontes deste mês (padrão: todos os meses encontrados)")
+    parser.add_argument('--force', action='store_true',
+                        help="converte de novo mesmo as tabelas cujas fontes não mudaram")
+    parser.add_argument('--metrics', metavar='ARQUIVO',
+                        help="grava um evento JSON por etapa neste arquivo (padrão: $CNPJ_METRICS_FILE)")
+    parser.add_argument('--prometheus', metavar='ARQUIVO',
+                        help="grava os totais por etapa no formato textfile do Prometheus (padrão: $CNPJ_PROMETHEUS_FILE)")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="grava um perfil cProfile (.prof) por etapa neste diretório (padrão: $CNPJ_PROFILE_DIR)")
+    args = parser.parse_args()
+    log_to_file()
+    configure_metrics(args.metrics, args.prometheus, args.profile)
     try:
-        process_files_to_parquet()
+        if args.while_downloading is not None:
+            convert_while_downloading(args.while_downloading or None, engine=args.engine, typed=not args.untyped)
+        else:
+            process_files_to_parquet(from_zip=args.from_zip, engine=args.engine, workers=args.workers,
+                                     typed=not args.untyped, partition=args.partition,
+                                     partition_by=args.partition_by, row_group_size=args.row_group_size,
+                                     month=args.month, force=args.force)
     except Exception as e:
-        logger.critical(f"Ocorreu um erro fatal no script: {e}", exc_info=True) 
\ No newline at end of file
+        logger.critical(f"Ocorreu um erro fatal no script: {e}", exc_info=True)
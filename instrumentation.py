@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentação do pipeline: logs com o horário de São Paulo e métricas por
+etapa (download, extração, leitura, conversão etc.).
+
+Cada etapa é medida com `stage`, que registra tempo, linhas, bytes,
+tentativas, erros e pico de memória do processo desde o início da etapa
+(ou, em etapas aninhadas ou simultâneas, desde o início da mais externa
+em andamento, já que o pico é um só por processo):
+
+    from instrumentation import stage
+
+    with stage('download', arquivo='Empresas0.zip') as etapa:
+        ...
+        etapa.add(bytes=tamanho)
+        etapa.retry()  # a cada nova tentativa
+
+Ao fim de cada etapa é emitido um evento JSON (uma linha por evento em
+CNPJ_METRICS_FILE) e os totais por etapa são regravados no formato textfile
+do Prometheus (CNPJ_PROMETHEUS_FILE, para o node_exporter). Com
+CNPJ_PROFILE_DIR, cada etapa é perfilada com cProfile e gravada em
+`<dir>/<etapa>-<pid>-<n>.prof` (CNPJ_PROFILE_STAGES limita a algumas etapas).
+Funções registradas com `add_hook` são chamadas no início e no fim de cada
+etapa, para integrar outros perfiladores.
+"""
+import os
+import sys
+import json
+import time
+import cProfile
+import logging
+import threading
+import itertools
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+EVENTS_FILE = os.environ.get('CNPJ_METRICS_FILE') or None
+PROMETHEUS_FILE = os.environ.get('CNPJ_PROMETHEUS_FILE') or None
+PROFILE_DIR = os.environ.get('CNPJ_PROFILE_DIR') or None
+PROFILE_STAGES = os.environ.get('CNPJ_PROFILE_STAGES') or None  # Etapas separadas por vírgula
+
+TIMEZONE = pytz.timezone('America/Sao_Paulo')
+
+
+class SaoPauloFormatter(logging.Formatter):
+    def converter(self, timestamp):
+        dt = datetime.fromtimestamp(timestamp, TIMEZONE)
+        return dt
+
+    def formatTime(self, record, datefmt=None):
+        dt = self.converter(record.created)
+        if datefmt:
+            s = dt.strftime(datefmt)
+        else:
+            s = dt.isoformat()
+        return s
+
+
+def setup_logger(name, log_file, fmt):
+    """
+    Logger com saída no terminal e, se `log_file` for informado, também no
+    arquivo, com o horário de São Paulo. Chamado de novo, substitui os
+    handlers anteriores.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    # Remove handlers antigos para evitar logs duplicados
+    if logger.hasHandlers():
+        logger.handlers.clear()
+    formatter = SaoPauloFormatter(fmt)
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        logger.addHandler(file_handler)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+    logger.addHandler(stream_handler)
+    return logger
+
+
+def reset_peak_rss():
+    """Zera o pico de memória do processo (Linux); nos demais sistemas o pico é acumulado"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """Pico de memória residente do processo, em bytes"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Stage:
+    """Contadores de uma execução de etapa"""
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.rows = 0
+        self.bytes = 0
+        self.retries = 0
+
+    def add(self, rows=0, bytes=0):
+        """Soma linhas e bytes processados"""
+        self.rows += rows
+        self.bytes += bytes
+
+    def retry(self):
+        """Registra uma nova tentativa"""
+        self.retries += 1
+
+    def event(self, seconds, error=None):
+        """Evento JSON da etapa concluída"""
+        return {
+            'evento': 'etapa',
+            'data': datetime.now(TIMEZONE).isoformat(),
+            'pid': os.getpid(),
+            'etapa': self.name,
+            **self.labels,
+            'segundos': round(seconds, 4),
+            'linhas': self.rows,
+            'bytes': self.bytes,
+            'linhas_por_segundo': round(self.rows / seconds, 1) if seconds and self.rows else None,
+            'mb_por_segundo': round(self.bytes / seconds / 1024 ** 2, 3) if seconds and self.bytes else None,
+            'tentativas': self.retries,
+            'pico_rss_mb': round(peak_rss() / 1024 ** 2, 1),
+            'erro': error,
+        }
+
+
+class Metrics:
+    """Registro das etapas do processo: eventos JSON, totais Prometheus e perfis"""
+
+    COUNTERS = ('execucoes', 'segundos', 'linhas', 'bytes', 'tentativas', 'erros')
+
+    def __init__(self, events_file=EVENTS_FILE, prometheus_file=PROMETHEUS_FILE,
+                 profile_dir=PROFILE_DIR, profile_stages=PROFILE_STAGES):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profile_ids = itertools.count(1)
+        self._active = 0  # Etapas em andamento no processo
+        self._peak = 0  # Maior pico de memória do processo, apesar dos resets por etapa
+        self.hooks = []
+        self.totals = {}
+        self.configure(events_file, prometheus_file, profile_dir, profile_stages)
+        if hasattr(os, 'register_at_fork'):
+            # Processos filhos (conversão paralela) medem o próprio pico
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._active = 0
+
+    def configure(self, events_file=None, prometheus_file=None, profile_dir=None, profile_stages=None):
+        """
+        Define os destinos das métricas (None mantém o atual). Os totais
+        Prometheus só são gravados pelo processo que chamou configure, e não
+        pelos processos filhos da conversão paralela.
+        """
+        self.events_file = events_file or getattr(self, 'events_file', None)
+        self.prometheus_file = prometheus_file or getattr(self, 'prometheus_file', None)
+        self.profile_dir = profile_dir or getattr(self, 'profile_dir', None)
+        if isinstance(profile_stages, str):
+            profile_stages = [name.strip() for name in profile_stages.split(',') if name.strip()]
+        self.profile_stages = set(profile_stages) if profile_stages else getattr(self, 'profile_stages', None)
+        self._owner = os.getpid()
+
+    def add_hook(self, hook):
+        """Registra `hook(fase, etapa)`, chamado com fase 'inicio' e 'fim' de cada etapa"""
+        self.hooks.append(hook)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """Mede uma etapa; fornece o Stage para somar linhas, bytes e tentativas"""
+        record = Stage(name, labels)
+        with self._lock:
+            if not self._active:
+                # Nenhuma outra etapa medindo: o pico passa a contar desta
+                self._peak = max(self._peak, peak_rss())
+                reset_peak_rss()
+            self._active += 1
+        for hook in self.hooks:
+            hook('inicio', record)
+        profiler = self._start_profile(name)
+        error = None
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                self._stop_profile(profiler, name)
+            self._record(record, seconds, error)
+            with self._lock:
+                self._active -= 1
+            for hook in self.hooks:
+                hook('fim', record)
+
+    def _start_profile(self, name):
+        """Inicia o cProfile da etapa, exceto dentro de outra etapa já perfilada nesta thread"""
+        if not self.profile_dir or getattr(self._local, 'profiling', False):
+            return None
+        if self.profile_stages and name not in self.profile_stages:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+: um único perfilador por processo (outra thread já perfila)
+            return None
+        self._local.profiling = True
+        return profiler
+
+    def _stop_profile(self, profiler, name):
+        profiler.disable()
+        self._local.profiling = False
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.profile_dir, f'{name}-{os.getpid()}-{next(self._profile_ids)}.prof'))
+
+    def _record(self, record, seconds, error):
+        event = record.event(seconds, error)
+        logger.debug(json.dumps(event, ensure_ascii=False))
+        with self._lock:
+            totals = self.totals.setdefault(record.name, dict.fromkeys(self.COUNTERS, 0))
+            totals['execucoes'] += 1
+            totals['segundos'] += seconds
+            totals['linhas'] += record.rows
+            totals['bytes'] += record.bytes
+            totals['tentativas'] += record.retries
+            totals['erros'] += error is not None
+            if self.events_file:
+                directory = os.path.dirname(self.events_file)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # Uma única escrita por linha em modo append: segura entre processos
+                with open(self.events_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+            if self.prometheus_file and os.getpid() == self._owner:
+                self._write_prometheus()
+
+    def _write_prometheus(self):
+        """Grava os totais por etapa no formato textfile do Prometheus (de forma atômica)"""
+        lines = []
+        for counter in self.COUNTERS:
+            metric = f'cnpj_etapa_{counter}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for name, totals in sorted(self.totals.items()):
+                value = totals[counter]
+                value = int(value) if float(value).is_integer() else round(value, 6)
+                lines.append(f'{metric}{{etapa="{name}"}} {value}')
+        lines.append('# TYPE cnpj_pico_rss_bytes gauge')
+        self._peak = max(self._peak, peak_rss())
+        lines.append(f'cnpj_pico_rss_bytes {self._peak}')
+        directory = os.path.dirname(self.prometheus_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.prometheus_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.prometheus_file)
+
+
+metrics = Metrics()
+stage = metrics.stage
+configure = metrics.configure
@@ -14,7 +14,7 @@ TABLE_NAMES = {
     'ESTABELE': 'estabelecimentos',
     'SOCIOCSV': 'socios',
     'SIMPLES': 'simples',
-    'CNAES': 'cnaes',
+    'CNAECSV': 'cnaes',
     'MUNIC': 'municipios',
     'NATJU': 'naturezas_juridicas',
     'PAIS': 'paises',
@@ -22,6 +22,20 @@ TABLE_NAMES = {
     'MOTI': 'motivos',
 }
 
+# Prefixo do nome dos ZIPs publicados pela Receita (ex: 'Estabelecimentos3.zip') -> tabela
+ZIP_PREFIXES = {
+    'empresas': 'empresas',
+    'estabelecimentos': 'estabelecimentos',
+    'socios': 'socios',
+    'simples': 'simples',
+    'cnaes': 'cnaes',
+    'municipios': 'municipios',
+    'naturezas': 'naturezas_juridicas',
+    'paises': 'paises',
+    'qualificacoes': 'qualificacoes_socios',
+    'motivos': 'motivos',
+}
+
 # Definição das colunas para cada tipo de arquivo/tabela
 # Baseado no arquivo 'NOVOLAYOUTDOSDADOSABERTOSDOCNPJ.pdf' e scripts da comunidade.
 LAYOUTS = {
@@ -111,4 +125,55 @@ LAYOUTS = {
         'codigo',
         'descricao'
     ]
-} 
\ No newline at end of file
+} 
+
+# Tipos das colunas no Parquet. Colunas não listadas são gravadas como string.
+# - 'date': datas AAAAMMDD convertidas para date32 (valores em DATE_NULL_VALUES viram nulo)
+# - 'decimal(p,s)': números com vírgula decimal (ex: '1000,00'); valores com mais
+#   dígitos que a precisão ou mais casas decimais que a escala viram nulo
+# - 'int8', 'int16': códigos numéricos pequenos sem zeros à esquerda significativos
+#   (valores fora do intervalo do tipo viram nulo)
+# - 'dictionary': códigos de baixa cardinalidade, mantidos como texto (ex: '02')
+#   e codificados em dicionário
+COLUMN_TYPES = {
+    'empresas': {
+        'natureza_juridica': 'dictionary',
+        'qualificacao_responsavel': 'dictionary',
+        'capital_social': 'decimal(15,2)',  # Mesmo tipo de empresas.capital_social no database_schema.sql
+        'porte_empresa': 'dictionary',
+        'ente_federativo_responsavel': 'dictionary',
+    },
+    'estabelecimentos': {
+        'identificador_matriz_filial': 'int8',
+        'situacao_cadastral': 'dictionary',
+        'data_situacao_cadastral': 'date',
+        'motivo_situacao_cadastral': 'dictionary',
+        'pais': 'dictionary',
+        'data_inicio_atividade': 'date',
+        'cnae_fiscal_principal': 'dictionary',
+        'tipo_logradouro': 'dictionary',
+        'uf': 'dictionary',
+        'municipio': 'dictionary',
+        'situacao_especial': 'dictionary',
+        'data_situacao_especial': 'date',
+    },
+    'socios': {
+        'identificador_socio': 'int8',
+        'qualificacao_socio': 'dictionary',
+        'data_entrada_sociedade': 'date',
+        'pais': 'dictionary',
+        'qualificacao_representante_legal': 'dictionary',
+        'faixa_etaria': 'int8',
+    },
+    'simples': {
+        'opcao_pelo_simples': 'dictionary',
+        'data_opcao_simples': 'date',
+        'data_exclusao_simples': 'date',
+        'opcao_pelo_mei': 'dictionary',
+        'data_opcao_mei': 'date',
+        'data_exclusao_mei': 'date',
+    },
+}
+
+# Valores usados pela Receita para "sem data" nos campos AAAAMMDD
+DATE_NULL_VALUES = ['00000000', '0']
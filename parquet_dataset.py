@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Localização e abertura das tabelas Parquet geradas pelo import_to_parquet.
+
+Uma tabela pode estar em um arquivo único (`<tabela>.parquet`), em um
+dataset com várias partes (`<tabela>/part-NNNNN.parquet`) ou em um dataset
+particionado no estilo Hive (`<tabela>/<coluna>=<valor>/...`). As funções
+abaixo escondem essa diferença de quem apenas quer ler os dados.
+
+Cada mês convertido tem suas próprias tabelas em `<AAAA-MM>/`, no mesmo
+formato; as tabelas na raiz são as do mês mais recente.
+"""
+import os
+import re
+import glob
+from urllib.parse import unquote
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Pastas com as tabelas de um mês (`<parquet>/<AAAA-MM>/<tabela>...`)
+MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+
+# Valor gravado pelo pyarrow no nome da partição Hive de valores nulos
+HIVE_NULL = '__HIVE_DEFAULT_PARTITION__'
+
+
+def table_path(parquet_dir, table_name):
+    """Caminho da tabela (diretório do dataset ou arquivo único), ou None se não existir"""
+    dataset_dir = os.path.join(parquet_dir, table_name)
+    if os.path.isdir(dataset_dir) and parquet_files(dataset_dir):
+        return dataset_dir
+    file_path = os.path.join(parquet_dir, f'{table_name}.parquet')
+    if os.path.isfile(file_path):
+        return file_path
+    return None
+
+
+def months(parquet_dir):
+    """Meses com tabelas próprias em `parquet_dir/<AAAA-MM>/`, em ordem"""
+    if not os.path.isdir(parquet_dir):
+        return []
+    return sorted(name for name in os.listdir(parquet_dir)
+                  if MONTH_PATTERN.match(name) and os.path.isdir(os.path.join(parquet_dir, name)))
+
+
+def parquet_files(path):
+    """Arquivos Parquet de uma tabela, em ordem"""
+    if os.path.isfile(path):
+        return [path]
+    return sorted(glob.glob(os.path.join(path, '**', '*.parquet'), recursive=True))
+
+
+def partition_columns(path):
+    """Colunas de partição Hive (`coluna=valor`) usadas em um diretório de dataset"""
+    columns = []
+    if os.path.isdir(path):
+        for file_path in parquet_files(path)[:1]:
+            relative = os.path.relpath(os.path.dirname(file_path), path)
+            columns = [part.split('=', 1)[0] for part in relative.split(os.sep) if '=' in part]
+    return columns
+
+
+def partition_values(path, file_path):
+    """
+    Valores das colunas de partição Hive de um arquivo do dataset `path`,
+    lidos do caminho (`<coluna>=<valor>/`): {coluna: valor}. Quem lê os
+    arquivos um a um (pq.ParquetFile) os usa para repor as colunas que só
+    existem no nome da partição.
+    """
+    if not os.path.isdir(path):
+        return {}
+    values = {}
+    for part in os.path.relpath(os.path.dirname(file_path), path).split(os.sep):
+        if '=' in part:
+            column, value = part.split('=', 1)
+            value = unquote(value)
+            values[column] = None if value == HIVE_NULL else value
+    return values
+
+
+def open_dataset(path):
+    """
+    Abre uma tabela como pyarrow.dataset. Colunas de partição são lidas como
+    string, preservando zeros à esquerda (ex: cnpj_prefixo=01).
+    """
+    columns = partition_columns(path)
+    if not columns:
+        return ds.dataset(path, format='parquet')
+    partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in columns]), flavor='hive')
+    return ds.dataset(path, format='parquet', partitioning=partitioning)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Manifesto do estado do pipeline, em SQLite (`downloads/.pipeline.sqlite`).
+
+Cada etapa registra, por mês, os arquivos que processou: ZIPs baixados e
+verificados, arquivos extraídos, fontes convertidas e tabelas Parquet, com
+tamanho, mtime, checksum, status e horário. `cnpj_manager.py status` e
+`list` e o conversor consultam o manifesto em vez de percorrer os
+diretórios, e as etapas pulam o que já foi concluído e não mudou em disco.
+
+O arquivo fica junto dos downloads (como o cache HTTP) e é oculto para os
+globs do conversor. Para registrar arquivos baixados antes do manifesto
+existir, use `PipelineState.scan` (`cnpj_manager.py scan`).
+"""
+import os
+import re
+import sqlite3
+import zipfile
+import hashlib
+from contextlib import closing
+from datetime import datetime
+
+from metadata import TABLE_NAMES, ZIP_PREFIXES
+
+STATE_FILENAME = '.pipeline.sqlite'
+
+# Etapas
+DOWNLOAD = 'download'
+VERIFY = 'verificacao'
+EXTRACT = 'extracao'
+CONVERT = 'conversao'
+TABLE = 'tabela'  # Tabela Parquet de um mês gravada por completo (checksum = impressão digital das fontes)
+
+# Status
+DONE = 'concluido'
+FAILED = 'erro'
+QUARANTINED = 'quarentena'
+
+MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS arquivos (
+    mes TEXT NOT NULL,
+    etapa TEXT NOT NULL,
+    arquivo TEXT NOT NULL,
+    caminho TEXT,
+    tabela TEXT,
+    tamanho INTEGER,
+    mtime_ns INTEGER,
+    checksum TEXT,
+    linhas INTEGER,
+    origem TEXT,
+    status TEXT NOT NULL,
+    erro TEXT,
+    atualizado_em TEXT NOT NULL,
+    PRIMARY KEY (mes, etapa, arquivo)
+)
+"""
+
+
+def state_path(download_dir):
+    """Caminho do manifesto de uma pasta de downloads"""
+    return os.path.join(download_dir, STATE_FILENAME)
+
+
+def month_of(path):
+    """Mês (AAAA-MM) da pasta que contém o arquivo, ou '' se não houver"""
+    month = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return month if MONTH_PATTERN.match(month) else ''
+
+
+def zip_table_name(zip_name):
+    """Tabela de um ZIP da Receita pelo prefixo do nome (ex: 'Estabelecimentos3.zip'), ou None"""
+    match = re.match(r'^([a-z]+)\d*\.zip$', os.path.basename(zip_name).lower())
+    return ZIP_PREFIXES.get(match.group(1)) if match else None
+
+
+def table_of(file_name):
+    """
+    Tabela de um arquivo pelo tipo no nome (ex: 'EMPRECSV' -> 'empresas') ou,
+    nos ZIPs, pelo prefixo (ex: 'Socios3.zip' -> 'socios'); None se não houver
+    """
+    upper = file_name.upper()
+    table = next((table for key, table in TABLE_NAMES.items() if key in upper), None)
+    return table or zip_table_name(file_name)
+
+
+def zip_fingerprint(path):
+    """
+    Checksum de um ZIP a partir do diretório central (nome, CRC32 e tamanho
+    de cada membro), sem ler o conteúdo.
+    """
+    digest = hashlib.sha1()
+    with zipfile.ZipFile(path) as zip_ref:
+        for info in zip_ref.infolist():
+            digest.update(f'{info.filename}:{info.CRC:08x}:{info.file_size};'.encode())
+    return f'zip:{digest.hexdigest()[:16]}'
+
+
+class PipelineState:
+    """Leitura e atualização do manifesto; cada operação usa sua própria conexão"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(SCHEMA)
+        return conn
+
+    def record(self, month, stage, name, path=None, status=DONE, table=None, rows=None,
+               checksum=None, source=None, error=None):
+        """Registra (ou atualiza) o estado de um arquivo em uma etapa"""
+        size = mtime_ns = None
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO arquivos (mes, etapa, arquivo, caminho, tabela, tamanho, mtime_ns, checksum, "
+                "linhas, origem, status, erro, atualizado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (mes, etapa, arquivo) DO UPDATE SET caminho = excluded.caminho, "
+                "tabela = excluded.tabela, tamanho = excluded.tamanho, mtime_ns = excluded.mtime_ns, "
+                "checksum = excluded.checksum, linhas = excluded.linhas, origem = excluded.origem, "
+                "status = excluded.status, erro = excluded.erro, atualizado_em = excluded.atualizado_em",
+                (month, stage, name, path, table or table_of(name), size, mtime_ns, checksum, rows, source,
+                 status, error, datetime.now().isoformat(timespec='seconds')),
+            )
+
+    def get(self, month, stage, name):
+        """Registro de um arquivo em uma etapa, ou None"""
+        if not self.exists():
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM arquivos WHERE mes = ? AND etapa = ? AND arquivo = ?",
+                               (month, stage, name)).fetchone()
+        return dict(row) if row else None
+
+    def is_done(self, month, stage, name, path=None, checksum=None):
+        """
+        Indica se a etapa já foi concluída para o arquivo e ele não mudou:
+        mesmo tamanho e mtime em `path` e, se informado, mesmo checksum.
+        """
+        row = self.get(month, stage, name)
+        if row is None or row['status'] != DONE:
+            return False
+        if checksum is not None and row['checksum'] != checksum:
+            return False
+        if path is not None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            return (row['tamanho'], row['mtime_ns']) == (stat.st_size, stat.st_mtime_ns)
+        return True
+
+    def files(self, month=None, stage=None, status=None, table=None):
+        """Registros filtrados por mês, etapa, status e tabela"""
+        if not self.exists():
+            return []
+        filters = {'mes': month, 'etapa': stage, 'status': status, 'tabela': table}
+        conditions = [f"{column} = ?" for column, value in filters.items() if value is not None]
+        sql = "SELECT * FROM arquivos"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql + " ORDER BY mes, etapa, arquivo",
+                                [value for value in filters.values() if value is not None]).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(self):
+        """
+        Totais por mês e etapa: {mês: {etapa: {'arquivos', 'concluidos',
+        'bytes', 'linhas', 'erros', 'atualizado_em'}}}
+        """
+        if not self.exists():
+            return {}
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT mes, etapa, COUNT(*) AS arquivos, SUM(status = ?) AS concluidos, "
+                "COALESCE(SUM(CASE WHEN status = ? THEN tamanho END), 0) AS bytes, "
+                "COALESCE(SUM(CASE WHEN status = ? THEN linhas END), 0) AS linhas, "
+                "SUM(status != ?) AS erros, MAX(atualizado_em) AS atualizado_em "
+                "FROM arquivos GROUP BY mes, etapa ORDER BY mes, etapa",
+                (DONE, DONE, DONE, DONE),
+            ).fetchall()
+        summary = {}
+        for row in rows:
+            row = dict(row)
+            summary.setdefault(row.pop('mes'), {})[row.pop('etapa')] = row
+        return summary
+
+    def forget(self, stage=None, month=None):
+        """Remove os registros de uma etapa e/ou mês (ex: após apagar os arquivos)"""
+        if not self.exists():
+            return
+        filters = {'etapa': stage, 'mes': month}
+        conditions = [f"{column} = ?" for column, value in filters.items() if value is not None]
+        sql = "DELETE FROM arquivos" + (" WHERE " + " AND ".join(conditions) if conditions else "")
+        with closing(self._connect()) as conn, conn:
+            conn.execute(sql, [value for value in filters.values() if value is not None])
+
+    def scan(self, download_dir, extract_dir):
+        """
+        Registra os ZIPs de `download_dir/<mês>/` e os arquivos de
+        `extract_dir/<mês>/` já existentes em disco (uma única varredura);
+        retorna o número de arquivos registrados.
+        """
+        count = 0
+        for stage, directory in ((DOWNLOAD, download_dir), (EXTRACT, extract_dir)):
+            if not os.path.isdir(directory):
+                continue
+            for month in sorted(os.listdir(directory)):
+                month_dir = os.path.join(directory, month)
+                if not MONTH_PATTERN.match(month) or not os.path.isdir(month_dir):
+                    continue
+                for name in sorted(os.listdir(month_dir)):
+                    path = os.path.join(month_dir, name)
+                    if name.startswith('.') or not os.path.isfile(path):
+                        continue
+                    if stage == DOWNLOAD and not name.lower().endswith('.zip'):
+                        continue
+                    self.record(month, stage, name, path)
+                    count += 1
+        return count
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da API HTTP de consulta
+Constrói os índices de dados pequenos e consulta as rotas do cnpj_api
+"""
+
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import cnpj_api
+import cnpj_index
+import cnpj_search
+import import_to_parquet
+from test_index import _convert
+from test_parquet import EMPRESAS, converter_dirs, write_month
+
+def _build(tmp):
+    """Converte os dados de exemplo e constrói os índices"""
+    parquet_dir = _convert(tmp, partition=True)
+    cnpj_index.build_index(parquet_dir)
+    cnpj_search.build_search_index(parquet_dir)
+    return parquet_dir
+
+async def _requests(parquet_dir):
+    service = cnpj_api.CNPJService(parquet_dir)
+    async with TestClient(TestServer(cnpj_api.create_app(service=service, reload_interval=0))) as client:
+        response = await client.get('/cnpj/41273593000150')
+        assert response.status == 200
+        data = await response.json()
+        assert data['empresa']['capital_social'] == '1000.00'
+        assert data['estabelecimentos'][0]['data_inicio_atividade'] == '2021-03-01'
+
+        assert (await client.get('/cnpj/99999999')).status == 404
+        assert (await client.get('/cnpj/123')).status == 404
+        assert (await client.get('/cnpj/1234567890')).status == 400
+
+        response = await client.get('/search', params={'q': 'padaria'})
+        assert await response.json() == [{'cnpj_basico': '41273593', 'razao_social': 'PADARIA SÃO JOÃO LTDA',
+                                          'score': (await response.json())[0]['score']}]
+        assert (await client.get('/search')).status == 400
+
+        response = await client.get('/socios/11222333000181')
+        assert [row['cnpj_basico'] for row in await response.json()] == ['41273593']
+
+        # Requisições simultâneas iguais fazem uma única consulta
+        calls = []
+        lookup = service.release.lookup
+        service.release.lookup = lambda cnpj: calls.append(cnpj) or lookup(cnpj)
+        responses = await asyncio.gather(*[client.get('/cnpj/11222333') for _ in range(5)])
+        assert [response.status for response in responses] == [200] * 5
+        assert calls == ['11222333']
+        await client.get('/cnpj/11222333')
+        assert calls == ['11222333']
+
+        # Um cliente que desconecta não cancela a consulta dos outros que esperam por ela
+        started, release = threading.Event(), threading.Event()
+        def slow_lookup(cnpj):
+            started.set()
+            release.wait(5)
+            return lookup(cnpj)
+        service.release.lookup = slow_lookup
+        first = asyncio.ensure_future(service.call('lookup', '41273593'))
+        second = asyncio.ensure_future(service.call('lookup', '41273593'))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert (await second)['empresa']['razao_social'] == 'PADARIA SÃO JOÃO LTDA'
+        assert first.cancelled()
+        assert service.executor._max_workers == cnpj_api.QUERY_WORKERS
+
+def test_api_routes():
+    """Testa as rotas da API, o cache e o agrupamento de requisições iguais"""
+    print("🌐 Testando API HTTP...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(_requests(_build(tmp)))
+    print("✅ Rotas /cnpj, /search e /socios respondendo com cache")
+
+def test_hot_reload():
+    """Testa a troca para uma nova versão dos dados e o cache por versão"""
+    print("\n♻️  Testando recarga de nova versão...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _build(tmp)
+        service = cnpj_api.CNPJService(parquet_dir)
+        first = service.release.id
+        assert not service.reload_if_changed()
+
+        # Nova conversão: os índices existentes são reconstruídos e a API troca de versão
+        _convert(tmp, partition=True)
+        assert service.reload_if_changed()
+        assert service.release.id != first
+        assert service.release.lookup('41273593')['empresa']['razao_social'] == 'PADARIA SÃO JOÃO LTDA'
+
+        cache = cnpj_api.ResponseCache(maxsize=2, ttl=10, clock=lambda: now)
+        now = 0
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None and cache.get('a') == 1
+        now = 11
+        assert cache.get('a') is None
+    print("✅ Nova versão carregada sem reiniciar a API")
+
+async def _stale_requests(service):
+    async with TestClient(TestServer(cnpj_api.create_app(service=service, reload_interval=0))) as client:
+        assert (await client.get('/cnpj/41273593')).status == 503
+        assert (await client.get('/socios/11222333000181')).status == 503
+        assert (await client.get('/health')).status == 503
+
+def test_published_month_before_reindex():
+    """Testa que arquivos publicados antes da reconstrução dos índices não trocam a empresa devolvida"""
+    print("\n🔀 Testando novo mês publicado antes dos índices...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp)
+        cnpj_index.build_index(parquet_dir)
+        cnpj_search.build_search_index(parquet_dir)
+        service = cnpj_api.CNPJService(parquet_dir)
+
+        # Novo mês com as linhas em outra ordem, publicado sem reconstruir os índices
+        rebuild = import_to_parquet._rebuild_indexes_safely
+        import_to_parquet._rebuild_indexes_safely = lambda: None
+        try:
+            with converter_dirs(tmp):
+                write_month(tmp, '2024-02', empresas=EMPRESAS[::-1])
+                import_to_parquet.process_files_to_parquet()
+        finally:
+            import_to_parquet._rebuild_indexes_safely = rebuild
+
+        try:
+            service.release.lookup('41273593')
+            assert False, "linha de outra empresa devolvida"
+        except cnpj_index.StaleIndexError:
+            pass
+        assert not service.reload_if_changed() and service.stale
+        asyncio.run(_stale_requests(service))
+
+        with converter_dirs(tmp):
+            import_to_parquet._rebuild_indexes_safely()
+        assert service.reload_if_changed() and service.stale is None
+        assert service.release.lookup('41273593')['empresa']['razao_social'] == 'PADARIA SÃO JOÃO LTDA'
+    print("✅ Consultas recusadas até os índices do novo mês ficarem prontos")
+
+def main():
+    """Executa todos os testes"""
+    print("🧪 INICIANDO TESTES DA API\n")
+
+    tests = [
+        ("Rotas da API", test_api_routes),
+        ("Recarga de Versão", test_hot_reload),
+        ("Mês Publicado Antes dos Índices", test_published_month_before_reindex),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"--- Teste: {test_name} ---")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
+        print()
+
+    print("📊 RESULTADO DOS TESTES")
+    print(f"✅ Testes aprovados: {passed}/{len(tests)}")
+    print(f"❌ Testes falharam: {len(tests) - passed}/{len(tests)}")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
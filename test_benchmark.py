@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste do benchmark do pipeline
+Gera poucos dados sintéticos e executa todas as etapas
+"""
+
+import os
+import sys
+import zipfile
+import tempfile
+
+import benchmark
+from metadata import LAYOUTS
+
+def test_synthetic_data():
+    """Testa o formato dos arquivos sintéticos: latin-1, ';', aspas e colunas do leiaute"""
+    print("🧬 Testando geração de dados sintéticos...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rows, size = benchmark.generate_month(tmp, rows=300, seed=1)
+        assert rows == 300 + 360 + 150
+
+        month_dir = os.path.join(tmp, benchmark.MONTH)
+        assert sorted(os.listdir(month_dir)) == ['Empresas0.zip', 'Estabelecimentos0.zip', 'Socios0.zip']
+        total = 0
+        for table_name, (type_key, zip_prefix, _) in benchmark.TABLES.items():
+            with zipfile.ZipFile(os.path.join(month_dir, f'{zip_prefix}0.zip')) as zip_ref:
+                (member,) = zip_ref.namelist()
+                assert member.endswith(type_key)
+                content = zip_ref.read(member)
+            total += len(content)
+            lines = content.decode('latin-1').splitlines()
+            for line in lines:
+                assert line.startswith('"') and line.endswith('"')
+                assert len(line[1:-1].split('";"')) == len(LAYOUTS[table_name])
+        assert total == size
+
+        # Mesma semente, mesmos dados
+        with tempfile.TemporaryDirectory() as other:
+            benchmark.generate_month(other, rows=300, seed=1)
+            with zipfile.ZipFile(os.path.join(other, benchmark.MONTH, 'Socios0.zip')) as a, \
+                    zipfile.ZipFile(os.path.join(month_dir, 'Socios0.zip')) as b:
+                assert a.read(a.namelist()[0]) == b.read(b.namelist()[0])
+    print("✅ Arquivos sintéticos no formato da Receita")
+
+def test_run_benchmark():
+    """Testa a execução de todas as etapas e a comparação com um relatório anterior"""
+    print("\n⏱️  Testando execução do benchmark...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = benchmark.run_benchmark(tmp, rows=200, lookups=20)
+    stages = {stage['etapa']: stage for stage in report['etapas']}
+    assert list(stages) == ['gerar', 'download', 'extracao', 'leitura_csv', 'parquet',
+                            'carga_sqlite', 'indice', 'busca_cnpj']
+    assert stages['leitura_csv']['linhas'] == stages['parquet']['linhas'] == 200 + 240 + 100
+    assert stages['busca_cnpj']['linhas'] == 20
+    assert all(stage['pico_rss_mb'] > 0 for stage in stages.values())
+
+    slower = {'etapas': [dict(stage, segundos=stage['segundos'] * 2 + 1) for stage in report['etapas']]}
+    assert [stage for stage, _, _ in benchmark.compare(report, slower)] == list(stages)
+    assert benchmark.compare(slower, report) == []
+    print("✅ Etapas medidas e regressões detectadas")
+
+def main():
+    """Executa todos os testes"""
+    print("🧪 INICIANDO TESTES DO BENCHMARK\n")
+
+    tests = [
+        ("Dados Sintéticos", test_synthetic_data),
+        ("Execução do Benchmark", test_run_benchmark),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"--- Teste: {test_name} ---")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
+        print()
+
+    print("📊 RESULTADO DOS TESTES")
+    print(f"✅ Testes aprovados: {passed}/{len(tests)}")
+    print(f"❌ Testes falharam: {len(tests) - passed}/{len(tests)}")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
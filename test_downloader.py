@@ -7,7 +7,73 @@ Script para testar a funcionalidade básica
 
 import sys
 import os
-from cnpj_downloader import CNPJDownloader
+import tempfile
+import threading
+import time
+import io
+import json
+import zipfile
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from cnpj_downloader import CNPJDownloader, RateLimiter, verify_zip, QUARANTINE_DIR
+
+class _LocalHandler(BaseHTTPRequestHandler):
+    """Servidor HTTP local que simula o site da Receita a partir de um dicionário {caminho: bytes}"""
+    files = {}
+    requests_log = []
+    accept_ranges = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = self.files.get(self.path)
+        self.requests_log.append((self.command, self.path, dict(self.headers)))
+        if body is None:
+            self.send_error(404)
+            return
+        
+        etag = f'"{zlib.crc32(body):08x}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        start, end = 0, len(body) - 1
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and self.accept_ranges and (if_range is None or if_range == etag):
+            first, last = range_header.split('=', 1)[1].split('-', 1)
+            start = int(first)
+            end = int(last) if last else len(body) - 1
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+        else:
+            self.send_response(200)
+        if self.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        
+        for offset in range(start, end + 1, 64 * 1024):
+            self.wfile.write(body[offset:min(offset + 64 * 1024, end + 1)])
+
+    do_HEAD = do_GET
+
+def start_local_server(files, **options):
+    """Inicia o servidor local em uma porta livre e retorna (servidor, url_base)"""
+    handler = type('Handler', (_LocalHandler,), {'files': files, 'requests_log': [], **options})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
 
 def test_connection():
     """Testa a conexão com o servidor"""
@@ -83,6 +149,265 @@ def test_directories_creation():
         print(f"❌ Erro na criação de diretórios: {e}")
         return False
 
+def test_parallel_download():
+    """Testa o download paralelo a partir de um servidor HTTP local"""
+    print("\n⚡ Testando download paralelo...")
+    
+    files = {f'/2024-01/Arquivo{i}.zip': os.urandom(50_000 + i) for i in range(6)}
+    server, base_url = start_local_server(files)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            downloader = CNPJDownloader(base_url=base_url, max_workers=3, max_requests_per_second=None,
+                                        download_dir=os.path.join(tmp, 'downloads'),
+                                        extract_dir=os.path.join(tmp, 'extracted'))
+            file_list = [{'name': path.rsplit('/', 1)[1], 'url': base_url + path.lstrip('/')} for path in files]
+            paths = downloader.download_files(file_list, '2024-01/')
+            
+            assert len(paths) == len(files)
+            for path, expected in zip(paths, files.values()):
+                with open(path, 'rb') as f:
+                    assert f.read() == expected
+        print("✅ Download paralelo concluído com conteúdo íntegro")
+    finally:
+        server.shutdown()
+
+def test_rate_limiter():
+    """Testa o limitador global de requisições por segundo"""
+    print("\n⏱️  Testando limitador de taxa...")
+    
+    limiter = RateLimiter(requests_per_second=20)
+    start = time.monotonic()
+    for _ in range(40):
+        limiter.acquire_request()
+    elapsed = time.monotonic() - start
+    
+    # 40 requisições a 20/s com rajada de 1s: ao menos ~1s de espera
+    assert elapsed >= 0.9, elapsed
+    print(f"✅ 40 requisições em {elapsed:.2f}s")
+
+def _make_zip(member_name, content):
+    """Gera os bytes de um ZIP com um único membro"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(member_name, content)
+    return buffer.getvalue()
+
+def test_resume_download():
+    """Testa a retomada de downloads parciais com requisições Range"""
+    print("\n🔁 Testando retomada de download...")
+    
+    body = _make_zip('K3241.EMPRECSV', os.urandom(200_000))
+    files = {'/2024-01/Empresas0.zip': body, '/2024-01/Socios0.zip': body, '/2024-01/Simples.zip': body}
+    server, base_url = start_local_server(files)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            downloader = CNPJDownloader(base_url=base_url, max_requests_per_second=None,
+                                        download_dir=os.path.join(tmp, 'downloads'),
+                                        extract_dir=os.path.join(tmp, 'extracted'))
+            month_dir = os.path.join(tmp, 'downloads', '2024-01')
+            os.makedirs(month_dir)
+            
+            # .part com diário de uma execução interrompida
+            part_path = os.path.join(month_dir, 'Empresas0.zip.part')
+            with open(part_path, 'wb') as f:
+                f.write(body[:70_000])
+            with open(part_path + '.json', 'w') as f:
+                json.dump({'url': base_url + '2024-01/Empresas0.zip', 'etag': f'"{zlib.crc32(body):08x}"',
+                           'total_size': len(body)}, f)
+            
+            # Arquivo final truncado deixado pela versão antiga do downloader: sem
+            # validador, é baixado de novo
+            with open(os.path.join(month_dir, 'Socios0.zip'), 'wb') as f:
+                f.write(body[:120_000])
+            
+            # .part maior que o arquivo remoto: o servidor recusa a faixa (416)
+            stale_path = os.path.join(month_dir, 'Simples.zip.part')
+            with open(stale_path, 'wb') as f:
+                f.write(os.urandom(250_000))
+            with open(stale_path + '.json', 'w') as f:
+                json.dump({'url': base_url + '2024-01/Simples.zip', 'etag': f'"{zlib.crc32(body):08x}"',
+                           'total_size': 250_000 + len(body)}, f)
+            
+            file_list = [{'name': path.rsplit('/', 1)[1], 'url': base_url + path.lstrip('/')} for path in files]
+            paths = downloader.download_files(file_list, '2024-01/')
+            
+            for path in paths:
+                with open(path, 'rb') as f:
+                    assert f.read() == body
+                assert not os.path.exists(path + '.part')
+                assert not os.path.exists(path + '.part.json')
+            
+            gets = {}
+            for method, path, headers in server.RequestHandlerClass.requests_log:
+                if method == 'GET':
+                    gets.setdefault(path.rsplit('/', 1)[1], []).append(headers.get('Range'))
+            assert gets == {'Empresas0.zip': ['bytes=70000-'], 'Socios0.zip': [None],
+                            'Simples.zip': ['bytes=250000-', None]}, gets
+        print("✅ Downloads retomados a partir do último byte gravado")
+    finally:
+        server.shutdown()
+
+def _timed_download(base_url, file_list, tmp, **options):
+    """Baixa `file_list` em um diretório novo e retorna (caminhos, segundos)"""
+    downloader = CNPJDownloader(base_url=base_url, max_requests_per_second=None,
+                                download_dir=os.path.join(tmp, 'downloads'),
+                                extract_dir=os.path.join(tmp, 'extracted'), **options)
+    start = time.monotonic()
+    paths = downloader.download_files(file_list, '2024-01/')
+    return paths, time.monotonic() - start
+
+def test_segmented_download():
+    """Testa o download segmentado: faixas disjuntas que cobrem o arquivo, uma por conexão"""
+    print("\n🧩 Testando download segmentado...")
+    
+    body = _make_zip('K3241.ESTABELE', os.urandom(2_000_000))
+    files = {'/2024-01/Estabelecimentos0.zip': body}
+    server, base_url = start_local_server(files)
+    requests_log = server.RequestHandlerClass.requests_log
+    try:
+        file_list = [{'name': 'Estabelecimentos0.zip', 'url': base_url + '2024-01/Estabelecimentos0.zip'}]
+        with tempfile.TemporaryDirectory() as tmp:
+            (path,), single = _timed_download(base_url, file_list, os.path.join(tmp, 'single'), segments=1)
+            with open(path, 'rb') as f:
+                assert f.read() == body
+        gets = [headers for method, _, headers in requests_log if method == 'GET']
+        assert len(gets) == 1 and 'Range' not in gets[0]
+        del requests_log[:]
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            (path,), segmented = _timed_download(base_url, file_list, tmp, segments=4,
+                                                 segment_threshold=1024, chunk_size=256 * 1024)
+            with open(path, 'rb') as f:
+                assert f.read() == body
+        
+        # Uma requisição por faixa; as faixas são disjuntas e cobrem o arquivo inteiro
+        gets = [headers for method, _, headers in requests_log if method == 'GET']
+        assert len(gets) == 4 and all('Range' in headers for headers in gets), gets
+        ranges = sorted(tuple(int(value) for value in headers['Range'].split('=', 1)[1].split('-'))
+                        for headers in gets)
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(body) - 1, ranges
+        assert all(previous[1] + 1 == current[0] for previous, current in zip(ranges, ranges[1:])), ranges
+        print(f"✅ 4 faixas em paralelo cobrindo {len(body)} bytes "
+              f"(conexão única: {single:.2f}s, segmentado: {segmented:.2f}s)")
+    finally:
+        server.shutdown()
+
+def test_segmented_fallback():
+    """Testa o retorno à conexão única quando o servidor não aceita Range"""
+    print("\n↩️  Testando fallback sem Accept-Ranges...")
+    
+    body = _make_zip('K3241.SOCIOCSV', os.urandom(300_000))
+    server, base_url = start_local_server({'/2024-01/Socios0.zip': body}, accept_ranges=False)
+    try:
+        file_list = [{'name': 'Socios0.zip', 'url': base_url + '2024-01/Socios0.zip'}]
+        with tempfile.TemporaryDirectory() as tmp:
+            (path,), _ = _timed_download(base_url, file_list, tmp, segments=4, segment_threshold=1024)
+            with open(path, 'rb') as f:
+                assert f.read() == body
+        
+        gets = [headers for method, _, headers in server.RequestHandlerClass.requests_log if method == 'GET']
+        assert len(gets) == 1 and 'Range' not in gets[0]
+        print("✅ Download em conexão única sem Accept-Ranges")
+    finally:
+        server.shutdown()
+
+def test_zip_verification():
+    """Testa a conferência de CRC, a quarentena de ZIPs corrompidos e a extração atômica"""
+    print("\n🛡️  Testando verificação de integridade dos ZIPs...")
+    
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_ref:
+        zip_ref.writestr('K3241.EMPRECSV', b'"41273593";"PADARIA"\n' * 5000)
+    body = buffer.getvalue()
+    # Mesmo diretório central (o ZIP abre normalmente), mas um byte do membro alterado
+    corrupt = bytearray(body)
+    corrupt[len(body) // 2] ^= 0xFF
+    corrupt = bytes(corrupt)
+    
+    files = {'/2024-01/Empresas0.zip': corrupt}
+    server, base_url = start_local_server(files)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            downloader = CNPJDownloader(base_url=base_url, max_requests_per_second=None,
+                                        download_dir=os.path.join(tmp, 'downloads'),
+                                        extract_dir=os.path.join(tmp, 'extracted'))
+            file_list = [{'name': 'Empresas0.zip', 'url': base_url + '2024-01/Empresas0.zip'}]
+            month_dir = os.path.join(tmp, 'downloads', '2024-01')
+            extract_dir = os.path.join(tmp, 'extracted', '2024-01')
+            
+            # A extração de um ZIP corrompido não deixa CSV truncado
+            os.makedirs(month_dir)
+            corrupt_path = os.path.join(month_dir, 'corrompido.zip')
+            with open(corrupt_path, 'wb') as f:
+                f.write(corrupt)
+            assert verify_zip(corrupt_path) is not None
+            try:
+                downloader.extract_file(corrupt_path, '2024-01/')
+                assert False, "ZIP corrompido extraído"
+            except zipfile.BadZipFile:
+                pass
+            assert os.listdir(extract_dir) == []
+            os.remove(corrupt_path)
+            
+            # Baixado duas vezes corrompido: fica na quarentena e não é retornado
+            assert downloader.download_verified(file_list, '2024-01/') == []
+            assert not os.path.exists(os.path.join(month_dir, 'Empresas0.zip'))
+            assert os.path.exists(os.path.join(tmp, 'downloads', QUARANTINE_DIR, '2024-01', 'Empresas0.zip'))
+            
+            # Corrigido no servidor: o próximo download traz o arquivo íntegro
+            files['/2024-01/Empresas0.zip'] = body
+            (path,) = downloader.download_verified(file_list, '2024-01/')
+            assert verify_zip(path) is None
+            downloader.extract_file(path, '2024-01/')
+            assert os.listdir(extract_dir) == ['K3241.EMPRECSV']
+        print("✅ ZIP corrompido em quarentena e extração sem arquivos parciais")
+    finally:
+        server.shutdown()
+
+def _listing(names):
+    """Gera uma listagem HTML no formato do índice do servidor"""
+    return ''.join(f'<a href="{name}">{name}</a>' for name in names).encode()
+
+def test_conditional_cache():
+    """Testa o cache de metadados HTTP: segunda execução sem mudanças não baixa nada"""
+    print("\n🗂️  Testando cache de requisições condicionais...")
+    
+    empresas = _make_zip('K3241.EMPRECSV', b'"00000000";"EMPRESA"\n')
+    socios = _make_zip('K3241.SOCIOCSV', b'"00000000";"2"\n')
+    files = {
+        '/': _listing(['2023-12/', '2024-01/']),
+        '/2024-01/': _listing(['Empresas0.zip', 'Socios0.zip']),
+        '/2024-01/Empresas0.zip': empresas,
+        '/2024-01/Socios0.zip': socios,
+    }
+    server, base_url = start_local_server(files)
+    log = server.RequestHandlerClass.requests_log
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            def new_downloader():
+                return CNPJDownloader(base_url=base_url, max_requests_per_second=None,
+                                      download_dir=os.path.join(tmp, 'downloads'),
+                                      extract_dir=os.path.join(tmp, 'extracted'))
+            
+            new_downloader().run()
+            assert os.path.exists(os.path.join(tmp, 'extracted', '2024-01', 'K3241.SOCIOCSV'))
+            
+            # Nada mudou: uma requisição condicional por listagem, nenhum arquivo
+            log.clear()
+            new_downloader().run()
+            assert [(method, path) for method, path, _ in log] == [('GET', '/'), ('GET', '/2024-01/')], log
+            
+            # Novo arquivo publicado: HEAD nos existentes, GET apenas no que mudou
+            files['/2024-01/Socios0.zip'] = _make_zip('K3241.SOCIOCSV', b'"11111111";"2"\n')
+            files['/2024-01/'] = _listing(['Empresas0.zip', 'Socios0.zip', ''])
+            log.clear()
+            new_downloader().run()
+            gets = [path for method, path, _ in log if method == 'GET' and path.endswith('.zip')]
+            assert gets == ['/2024-01/Socios0.zip'], log
+        print("✅ Execução sem mudanças resolvida com requisições condicionais")
+    finally:
+        server.shutdown()
+
 def main():
     """Executa todos os testes"""
     print("🧪 INICIANDO TESTES DO CNPJ DOWNLOADER\n")
@@ -92,6 +417,13 @@ def main():
         ("Criação de Diretórios", test_directories_creation),
         ("Detecção de Diretórios", test_directory_detection),
         ("Listagem de Arquivos", test_file_listing),
+        ("Download Paralelo", test_parallel_download),
+        ("Limitador de Taxa", test_rate_limiter),
+        ("Retomada de Download", test_resume_download),
+        ("Download Segmentado", test_segmented_download),
+        ("Fallback sem Range", test_segmented_fallback),
+        ("Cache Condicional", test_conditional_cache),
+        ("Verificação de ZIPs", test_zip_verification),
     ]
     
     passed = 0
@@ -99,8 +431,11 @@ def main():
     
     for test_name, test_func in tests:
         print(f"--- Teste: {test_name} ---")
-        if test_func():
-            passed += 1
+        try:
+            if test_func() is not False:
+                passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
         print()
     
     print("📊 RESULTADO DOS TESTES")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste do histórico de vários meses
+Ingere meses convertidos, consulta "como era em" e remonta retratos mensais
+"""
+
+import os
+import sys
+import tempfile
+from decimal import Decimal
+
+import pyarrow.parquet as pq
+
+import import_to_parquet
+from cnpj_downloader import CNPJDownloader
+from cnpj_history import HistoryStore, ingest_month, ingest_months, parse_months, history_dir
+from test_downloader import start_local_server, _listing, _make_zip
+from test_parquet import EMPRESAS, ESTABELECIMENTOS, _csv, converter_dirs, write_month
+
+# Fevereiro: capital alterado, uma empresa removida e uma nova; março: a removida volta
+MONTHS = {
+    '2024-01': EMPRESAS,
+    '2024-02': [['41273593', 'PADARIA SÃO JOÃO LTDA', '2062', '49', '5000,00', '01', ''],
+                ['99888777', 'NOVA EMPRESA SA', '2046', '10', '100,00', '05', '']],
+    '2024-03': [['41273593', 'PADARIA SÃO JOÃO LTDA', '2062', '49', '5000,00', '01', ''],
+                ['99888777', 'NOVA EMPRESA SA', '2046', '10', '100,00', '05', ''],
+                EMPRESAS[1]],
+}
+
+def test_history_store():
+    """Testa a ingestão em ordem, as versões com validade e as consultas por mês"""
+    print("🕰️  Testando histórico de vários meses...")
+
+    assert parse_months('2023-11..2024-02') == ['2023-11', '2023-12', '2024-01', '2024-02']
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        parquet_dir = os.path.join(tmp, 'parquet')
+        summaries = {}
+        for month, empresas in MONTHS.items():
+            write_month(tmp, month, empresas=empresas)
+            import_to_parquet.process_files_to_parquet(month=month)
+            summaries[month] = ingest_month(month, parquet_dir)
+
+        assert summaries['2024-02']['empresas'] == {'inseridas': 1, 'alteradas': 1, 'removidas': 1, 'versoes': 4}
+        assert summaries['2024-03']['empresas'] == {'inseridas': 1, 'alteradas': 0, 'removidas': 0, 'versoes': 5}
+        assert summaries['2024-03']['estabelecimentos']['versoes'] == 2
+        # Só as mudanças são gravadas a cada mês
+        assert pq.read_metadata(os.path.join(history_dir(parquet_dir), 'empresas', '2024-03.parquet')).num_rows == 1
+        assert pq.read_metadata(os.path.join(history_dir(parquet_dir), 'estabelecimentos', '2024-02.parquet')).num_rows == 0
+
+        store = HistoryStore(parquet_dir)
+        assert store.months() == list(MONTHS)
+
+        def capital(cnpj, month):
+            return [row['capital_social'] for row in store.as_of(cnpj, month)['empresas']]
+        assert capital('41273593', '2023-12') == []
+        assert capital('41273593', '2024-01') == [Decimal('1000.00')]
+        assert capital('41.273.593/0001-50', '2024-02-15') == [Decimal('5000.00')]
+        assert capital('11222333', '2024-02') == [] and capital('11222333', '2024-03') == [Decimal('0.00')]
+        assert [row['nome_fantasia'] for row in store.as_of('41273593000150', '2024-03')['estabelecimentos']] == ['PADARIA']
+        assert store.as_of('41273593000231', '2024-03')['estabelecimentos'] == []
+
+        history = store.history('41273593')
+        assert [(row['valido_de'], row['valido_ate']) for row in history] == [('2024-01', '2024-02'), ('2024-02', None)]
+
+        # Retrato de um mês remontado a partir das versões
+        for month in MONTHS:
+            snapshot = store.snapshot('empresas', month).drop_columns(['valido_de']).sort_by('cnpj_basico')
+            expected = pq.read_table(os.path.join(parquet_dir, month, 'empresas.parquet')).sort_by('cnpj_basico')
+            assert snapshot.to_pylist() == expected.to_pylist(), month
+
+        # Mês já ingerido é pulado; mês anterior ao último é recusado
+        assert ingest_month('2024-03', parquet_dir) == {}
+        write_month(tmp, '2023-12')
+        import_to_parquet.process_files_to_parquet(month='2023-12')
+        try:
+            ingest_month('2023-12', parquet_dir)
+            assert False, "mês fora de ordem ingerido"
+        except ValueError:
+            pass
+        assert sorted(os.listdir(os.path.join(history_dir(parquet_dir), 'empresas'))) == [
+            '2024-01.parquet', '2024-02.parquet', '2024-03.parquet', 'versions-2024-03.npy']
+
+        # Mês convertido com outros tipos (--untyped) é recusado em vez de alterar todas as linhas
+        write_month(tmp, '2024-04', empresas=MONTHS['2024-03'])
+        import_to_parquet.process_files_to_parquet(month='2024-04', typed=False)
+        try:
+            ingest_month('2024-04', parquet_dir, tables=['empresas'])
+            assert False, "mês com outros tipos ingerido"
+        except ValueError as e:
+            assert 'capital_social' in str(e)
+        assert HistoryStore(parquet_dir).months() == list(MONTHS)
+    print("✅ Versões com validade e consultas por mês")
+
+def test_ingest_months():
+    """Testa o download de um intervalo de meses com conversão e ingestão em ordem"""
+    print("\n📥 Testando ingestão de um intervalo de meses...")
+
+    files = {}
+    for month, empresas in MONTHS.items():
+        files[f'/{month}/'] = _listing(['Empresas0.zip', 'Estabelecimentos0.zip'])
+        files[f'/{month}/Empresas0.zip'] = _make_zip('K3241.K03200Y0.D40113.EMPRECSV', _csv(empresas))
+        files[f'/{month}/Estabelecimentos0.zip'] = _make_zip('K3241.K03200Y0.D40113.ESTABELE', _csv(ESTABELECIMENTOS))
+    server, base_url = start_local_server(files)
+    try:
+        with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+            downloader = CNPJDownloader(base_url=base_url, max_requests_per_second=None,
+                                        download_dir=os.path.join(tmp, 'downloads'),
+                                        extract_dir=os.path.join(tmp, 'extracted'))
+            parquet_dir = os.path.join(tmp, 'parquet')
+
+            # Registra quantos meses já estavam ingeridos quando cada download começou
+            started = []
+            download_verified = downloader.download_verified
+            def tracked(file_list, directory):
+                started.append((directory.rstrip('/'), _ingested(parquet_dir)))
+                return download_verified(file_list, directory)
+            downloader.download_verified = tracked
+
+            summary = ingest_months(parse_months('2024-01..2024-04'), downloader, workers=2, prune=True)
+
+            # Abril não existe no servidor: é pulado
+            assert list(summary) == list(MONTHS)
+            assert summary['2024-02']['empresas']['alteradas'] == 1
+            # No máximo 2 meses baixados à frente da ingestão
+            started.sort()
+            assert [month for month, _ in started] == list(MONTHS)
+            assert all(ingested >= index - 1 for index, (_, ingested) in enumerate(started)), started
+            assert not os.path.exists(os.path.join(parquet_dir, '2024-01'))
+            assert os.path.exists(os.path.join(parquet_dir, '2024-03'))
+            assert sorted(name for name in os.listdir(os.path.join(tmp, 'downloads')) if not name.startswith('.')) == ['2024-03']
+            assert downloader.state.files(month='2024-01') == []
+
+            store = HistoryStore(parquet_dir)
+            assert store.months('estabelecimentos') == list(MONTHS)
+            assert [row['capital_social'] for row in store.as_of('41273593', '2024-01')['empresas']] == [Decimal('1000.00')]
+            assert store.snapshot('empresas', '2024-02').num_rows == 2
+        print("✅ Intervalo baixado, convertido e ingerido em ordem")
+    finally:
+        server.shutdown()
+
+def test_ingest_months_failure():
+    """Testa que uma tabela que não converteu interrompe a ingestão do mês e dos seguintes"""
+    print("\n🛑 Testando falha de conversão no intervalo de meses...")
+
+    files = {}
+    for month, empresas in MONTHS.items():
+        files[f'/{month}/'] = _listing(['Empresas0.zip', 'Estabelecimentos0.zip'])
+        files[f'/{month}/Empresas0.zip'] = _make_zip('K3241.K03200Y0.D40113.EMPRECSV', _csv(empresas))
+        files[f'/{month}/Estabelecimentos0.zip'] = _make_zip('K3241.K03200Y0.D40113.ESTABELE', _csv(ESTABELECIMENTOS))
+    server, base_url = start_local_server(files)
+    convert_table = import_to_parquet.convert_table
+    def failing(table_name, sources, output_dir, *args, **kwargs):
+        if table_name == 'estabelecimentos' and output_dir.endswith('2024-02'):
+            raise OSError("disco cheio")
+        return convert_table(table_name, sources, output_dir, *args, **kwargs)
+    import_to_parquet.convert_table = failing
+    try:
+        with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+            downloader = CNPJDownloader(base_url=base_url, max_requests_per_second=None,
+                                        download_dir=os.path.join(tmp, 'downloads'),
+                                        extract_dir=os.path.join(tmp, 'extracted'))
+            summary = ingest_months(parse_months('2024-01..2024-03'), downloader, workers=2)
+
+            # O mês com a tabela faltando não é ingerido, e março espera
+            assert list(summary) == ['2024-01', '2024-02'] and 'estabelecimentos' in summary['2024-02']['erro']
+            parquet_dir = os.path.join(tmp, 'parquet')
+            store = HistoryStore(parquet_dir)
+            assert store.months('empresas') == store.months('estabelecimentos') == ['2024-01']
+
+            # Tabela do histórico ausente no mês: recusado antes de gravar
+            try:
+                ingest_month('2024-02', parquet_dir)
+                assert False, "mês incompleto ingerido"
+            except FileNotFoundError as e:
+                assert 'estabelecimentos' in str(e)
+            assert HistoryStore(parquet_dir).months('empresas') == ['2024-01']
+        print("✅ Falha de conversão interrompe a ingestão")
+    finally:
+        import_to_parquet.convert_table = convert_table
+        server.shutdown()
+
+def _ingested(parquet_dir):
+    """Meses já ingeridos no histórico (0 se ainda não existe)"""
+    try:
+        return len(HistoryStore(parquet_dir).months())
+    except FileNotFoundError:
+        return 0
+
+def main():
+    """Executa todos os testes"""
+    print("🧪 INICIANDO TESTES DO HISTÓRICO\n")
+
+    tests = [
+        ("Histórico", test_history_store),
+        ("Intervalo de Meses", test_ingest_months),
+        ("Falha no Intervalo", test_ingest_months_failure),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"--- Teste: {test_name} ---")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
+        print()
+
+    print("📊 RESULTADO DOS TESTES")
+    print(f"✅ Testes aprovados: {passed}/{len(tests)}")
+    print(f"❌ Testes falharam: {len(tests) - passed}/{len(tests)}")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
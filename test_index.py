@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste dos índices sobre os arquivos Parquet
+Converte arquivos pequenos para Parquet, constrói os índices e consulta
+"""
+
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow.parquet as pq
+
+import cnpj_graph
+import cnpj_index
+import cnpj_search
+import import_to_parquet
+from test_parquet import _csv, converter_dirs, write_month
+
+SOCIOS = [
+    ['41273593', '2', 'JOAO DA SILVA', '***123456**', '49', '20210301', '', '***000000**', '', '00', '5'],
+    ['41273593', '1', 'AÇAÍ & CIA', '11222333000181', '22', '20220110', '', '***000000**', '', '00', '0'],
+]
+
+def _convert(tmp, socios=SOCIOS, **options):
+    """Converte os dados de exemplo (com a tabela de sócios) e retorna o diretório Parquet"""
+    with converter_dirs(tmp):
+        write_month(tmp)
+        with open(os.path.join(tmp, 'extracted', '2024-01', 'K3241.K03200Y0.D40113.SOCIOCSV'), 'wb') as f:
+            f.write(_csv(socios))
+        import_to_parquet.process_files_to_parquet(**options)
+    return os.path.join(tmp, 'parquet')
+
+def test_cnpj_lookup():
+    """Testa o índice de busca pontual por CNPJ básico e completo"""
+    print("🔎 Testando busca pontual por CNPJ...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp, partition=True, row_group_size=1)
+        totals = cnpj_index.build_index(parquet_dir)
+        assert totals == {'empresas': 2, 'estabelecimentos': 2, 'estabelecimentos_cnpj': 2,
+                          'socios': 2, 'socios_cpf_cnpj': 2}
+
+        index = cnpj_index.CNPJIndex(parquet_dir)
+        result = index.lookup('41.273.593/0001-50')
+        assert result['empresa']['razao_social'] == 'PADARIA SÃO JOÃO LTDA'
+        assert [est['nome_fantasia'] for est in result['estabelecimentos']] == ['PADARIA']
+        assert sorted(socio['nome_socio_razao_social'] for socio in result['socios']) == ['AÇAÍ & CIA', 'JOAO DA SILVA']
+        assert result['simples'] is None
+
+        assert index.lookup('11222333')['estabelecimentos'][0]['uf'] == 'RJ'
+        assert index.lookup('41273593000231')['estabelecimentos'] == []
+        assert index.lookup('99999999') is None
+
+        # Consultas simultâneas em várias threads, com o cache trocando de row group a cada leitura
+        shared = cnpj_index.CNPJIndex(parquet_dir, cache_size=1)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            names = list(executor.map(lambda cnpj: shared.lookup(cnpj)['empresa']['razao_social'],
+                                      ['41273593', '11222333'] * 50))
+        assert names == ['PADARIA SÃO JOÃO LTDA', 'AÇAÍ & CIA'] * 50
+
+        # Participações por CPF (mascarado pela Receita) ou CNPJ do sócio
+        assert [row['cnpj_basico'] for row in index.partner('11.222.333/0001-81')] == ['41273593']
+        assert [row['nome_socio_razao_social'] for row in index.partner('12312345678')] == ['JOAO DA SILVA']
+        assert index.partner('***123456**') == index.partner('123.123.456-78')
+
+        # Uma nova conversão reconstrói o índice existente
+        _convert(tmp, partition=True)
+        assert cnpj_index.CNPJIndex(parquet_dir).lookup('11222333')['empresa'] is not None
+
+        # Colunas de partição, mesmo as que ficam só no nome do diretório (uf=RJ/part-0.parquet)
+        _convert(tmp, partition=True, partition_by='uf')
+        table_dir = os.path.join(parquet_dir, 'estabelecimentos')
+        for part in os.listdir(table_dir):
+            file_path = os.path.join(table_dir, part, 'part-0.parquet')
+            pq.write_table(pq.read_table(file_path).drop_columns(['uf']), file_path)
+        cnpj_index.build_index(parquet_dir)
+        index = cnpj_index.CNPJIndex(parquet_dir)
+        assert [est['uf'] for est in index.lookup('11222333')['estabelecimentos']] == ['RJ']
+        assert index.lookup('41273593')['empresa']['cnpj_prefixo'] == '41'
+
+        # Arquivos alterados sem reconstruir o índice são detectados
+        path = os.path.join(parquet_dir, 'empresas', 'cnpj_prefixo=41', 'part-0.parquet')
+        os.utime(path, ns=(0, 0))
+        try:
+            cnpj_index.CNPJIndex(parquet_dir)
+            assert False, "índice desatualizado não detectado"
+        except cnpj_index.StaleIndexError:
+            pass
+    print("✅ CNPJ encontrado pelo índice, lendo só os row groups necessários")
+
+def test_name_search():
+    """Testa a busca por nome com acentos, prefixos e ordenação por campo"""
+    print("🔤 Testando busca por nome...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp, partition=True)
+        documents = cnpj_search.build_search_index(parquet_dir)
+        assert documents == {'razao_social': 2, 'nome_fantasia': 1, 'nome_socio': 1}
+
+        index = cnpj_search.NameIndex(parquet_dir)
+        assert [cnpj for cnpj, _ in index.search('Padaria São João')] == ['41273593']
+        assert [cnpj for cnpj, _ in index.search('sao jo')] == []
+        assert [cnpj for cnpj, _ in index.search('sao joa')] == ['41273593']
+        assert index.search('joa', prefix=False) == []
+
+        # 'AÇAÍ & CIA' é a razão social de 11222333 e sócia de 41273593
+        ranked = index.search('acai')
+        assert [cnpj for cnpj, _ in ranked] == ['11222333', '41273593']
+        assert ranked[0][1] > ranked[1][1]
+        assert [cnpj for cnpj, _ in index.search('acai', fields=['nome_socio'])] == ['41273593']
+    print("✅ Nomes encontrados sem acentos, por prefixo e ordenados")
+
+def test_socios_graph():
+    """Testa o grafo de sócios: participações, cadeias e grupos"""
+    print("🕸️ Testando grafo de sócios...")
+
+    socios = SOCIOS + [
+        ['11222333', '2', 'MARIA SOUZA', '***654321**', '49', '20200101', '', '***000000**', '', '00', '4'],
+        ['55666777', '2', 'JOAO DA SILVA', '***999999**', '49', '20200101', '', '***000000**', '', '00', '4'],
+        ['55666777', '3', 'ACME: HOLDINGS LTD', '', '37', '20200101', '', '***000000**', '', '00', '0'],
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp, socios=socios)
+        assert cnpj_graph.build_graph(parquet_dir) == {'nos': 7, 'arestas': 5}
+
+        graph = cnpj_graph.SociosGraph(parquet_dir)
+        assert [node['chave'] for node in graph.companies_of('123.123.456-78')] == ['41273593']
+        assert [node['nome'] for node in graph.companies_of('11222333000181')] == ['PADARIA SÃO JOÃO LTDA']
+        assert graph.companies_of('***123456**', nome='Maria Souza') == []
+        assert sorted(node['nome'] for node in graph.partners_of('41273593')) == ['AÇAÍ & CIA', 'JOAO DA SILVA']
+
+        # 41273593 <- 11222333 (PJ) <- MARIA SOUZA
+        chain = graph.ownership_chain('41.273.593/0001-50', direction='up', depth=2)
+        assert sorted((edge['nivel'], edge['socio']['nome']) for edge in chain) == [
+            (1, 'AÇAÍ & CIA'), (1, 'JOAO DA SILVA'), (2, 'MARIA SOUZA')]
+        assert len(graph.ownership_chain('41273593', direction='up', depth=1)) == 2
+        chain = graph.ownership_chain('11222333', direction='down')
+        assert [(edge['nivel'], edge['empresa']['chave']) for edge in chain] == [(1, '41273593')]
+
+        # Homônimo com outro CPF é outro nó: 55666777 fica em um grupo separado
+        group = sorted(node['chave'] for node in graph.component('41273593') if node['tipo'] == cnpj_graph.EMPRESA)
+        assert group == ['11222333', '41273593']
+        assert [node['chave'] for node in graph.component('55666777') if node['tipo'] == cnpj_graph.EMPRESA] == ['55666777']
+        assert graph.component('99999999') == []
+
+        # Sócio estrangeiro identificado pelo nome, mesmo com ':' no nome
+        assert [node['chave'] for node in graph.companies_of('ACME: HOLDINGS LTD')] == ['55666777']
+        assert sorted(node['chave'] for node in graph.partners_of('55666777')) == ['***999999**', 'ACME: HOLDINGS LTD']
+    print("✅ Participações, cadeias e grupos encontrados no grafo")
+
+def main():
+    """Executa todos os testes"""
+    print("🧪 INICIANDO TESTES DOS ÍNDICES\n")
+
+    tests = [
+        ("Busca por CNPJ", test_cnpj_lookup),
+        ("Busca por Nome", test_name_search),
+        ("Grafo de Sócios", test_socios_graph),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"--- Teste: {test_name} ---")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
+        print()
+
+    print("📊 RESULTADO DOS TESTES")
+    print(f"✅ Testes aprovados: {passed}/{len(tests)}")
+    print(f"❌ Testes falharam: {len(tests) - passed}/{len(tests)}")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
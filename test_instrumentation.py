@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da instrumentação do pipeline
+Mede etapas, grava eventos JSON, totais Prometheus e perfis
+"""
+
+import os
+import sys
+import json
+import logging
+import tempfile
+from contextlib import contextmanager
+
+import import_to_parquet
+import instrumentation
+from test_parquet import converter_dirs, write_month
+
+def _events(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+@contextmanager
+def _metrics_file(path):
+    """Grava os eventos das etapas do pipeline em `path` durante o bloco"""
+    saved = instrumentation.metrics.events_file
+    instrumentation.metrics.events_file = path
+    try:
+        yield
+    finally:
+        instrumentation.metrics.events_file = saved
+
+def test_stage_metrics():
+    """Testa a medição de etapas, os eventos, o textfile do Prometheus e os perfis"""
+    print("📏 Testando métricas por etapa...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        events_file = os.path.join(tmp, 'eventos.jsonl')
+        prometheus_file = os.path.join(tmp, 'prom', 'cnpj.prom')
+        profile_dir = os.path.join(tmp, 'perfis')
+        metrics = instrumentation.Metrics(events_file, prometheus_file, profile_dir, 'download')
+        phases = []
+        metrics.add_hook(lambda phase, record: phases.append((phase, record.name)))
+
+        with metrics.stage('download', arquivo='Empresas0.zip') as record:
+            record.add(rows=10, bytes=2 * 1024 * 1024)
+            record.retry()
+        try:
+            with metrics.stage('extracao', arquivo='Empresas0.zip'):
+                raise OSError("disco cheio")
+        except OSError:
+            pass
+        with metrics.stage('download', arquivo='Socios0.zip') as record:
+            record.add(bytes=1024)
+
+        events = _events(events_file)
+        assert [(event['etapa'], event['arquivo']) for event in events] == [
+            ('download', 'Empresas0.zip'), ('extracao', 'Empresas0.zip'), ('download', 'Socios0.zip')]
+        assert events[0]['linhas'] == 10 and events[0]['tentativas'] == 1 and events[0]['erro'] is None
+        assert events[0]['mb_por_segundo'] > 0 and events[0]['pico_rss_mb'] > 0
+        assert events[1]['erro'] == 'OSError: disco cheio'
+        assert phases == [('inicio', 'download'), ('fim', 'download'), ('inicio', 'extracao'),
+                          ('fim', 'extracao'), ('inicio', 'download'), ('fim', 'download')]
+
+        assert metrics.totals['download']['execucoes'] == 2
+        assert metrics.totals['download']['bytes'] == 2 * 1024 * 1024 + 1024
+        with open(prometheus_file, encoding='utf-8') as f:
+            prometheus = f.read().splitlines()
+        assert 'cnpj_etapa_bytes_total{etapa="download"} 2098176' in prometheus
+        assert 'cnpj_etapa_erros_total{etapa="extracao"} 1' in prometheus
+        assert 'cnpj_etapa_tentativas_total{etapa="download"} 1' in prometheus
+
+        # O pico de cada etapa conta a partir do seu início, e o do Prometheus é o do processo
+        with metrics.stage('conversao', arquivo='grande'):
+            buffer = b'x' * (200 * 1024 ** 2)
+            del buffer
+        with metrics.stage('conversao', arquivo='pequeno'):
+            with metrics.stage('leitura', arquivo='pequeno'):
+                pass
+        large, nested, small = _events(events_file)[-3:]
+        assert nested['etapa'] == 'leitura' and small['arquivo'] == 'pequeno'
+        assert small['pico_rss_mb'] < large['pico_rss_mb'] - 100, (small, large)
+        with open(prometheus_file, encoding='utf-8') as f:
+            gauge = [line for line in f if line.startswith('cnpj_pico_rss_bytes ')]
+        assert int(gauge[0].split()[1]) / 1024 ** 2 >= large['pico_rss_mb'] - 1
+
+        # Importar os módulos do pipeline não abre arquivos de log
+        import cnpj_downloader
+        for module in (import_to_parquet, cnpj_downloader):
+            assert not any(isinstance(handler, logging.FileHandler) for handler in module.logger.handlers)
+
+        # Só as etapas de CNPJ_PROFILE_STAGES são perfiladas
+        profiles = sorted(os.listdir(profile_dir))
+        assert len(profiles) == 2 and all(name.startswith('download-') for name in profiles)
+    print("✅ Etapas medidas e exportadas")
+
+def test_pipeline_events():
+    """Testa os eventos emitidos pela conversão para Parquet"""
+    print("\n🛰️  Testando eventos da conversão...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        events_file = os.path.join(tmp, 'eventos.jsonl')
+        with converter_dirs(tmp), _metrics_file(events_file):
+            write_month(tmp)
+            import_to_parquet.process_files_to_parquet()
+
+        events = _events(events_file)
+        conversions = {event['tabela']: event for event in events if event['etapa'] == 'conversao'}
+        assert sorted(conversions) == ['empresas', 'estabelecimentos']
+        assert conversions['empresas']['linhas'] == 2 and conversions['empresas']['bytes'] > 0
+        assert all(conversions['empresas'][key] >= 0
+                   for key in ('segundos_leitura', 'segundos_tipos', 'segundos_gravacao'))
+        assert [event['linhas'] for event in events if event['etapa'] == 'cnaes_secundarios'] == [2]
+        assert events[-1]['etapa'] == 'importacao'
+    print("✅ Eventos por arquivo e por etapa da conversão")
+
+def main():
+    """Executa todos os testes"""
+    print("🧪 INICIANDO TESTES DA INSTRUMENTAÇÃO\n")
+
+    tests = [
+        ("Métricas por Etapa", test_stage_metrics),
+        ("Eventos da Conversão", test_pipeline_events),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"--- Teste: {test_name} ---")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
+        print()
+
+    print("📊 RESULTADO DOS TESTES")
+    print(f"✅ Testes aprovados: {passed}/{len(tests)}")
+    print(f"❌ Testes falharam: {len(tests) - passed}/{len(tests)}")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
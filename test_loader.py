@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da carga no banco de dados
+Converte arquivos pequenos para Parquet e carrega no backend SQLite do db_loader
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+
+import pyarrow.parquet as pq
+
+import db_loader
+import import_to_parquet
+from test_parquet import EMPRESAS, ESTABELECIMENTOS, converter_dirs, write_month
+
+# Registros de arquivos em importacoes (`tabela@versão:arquivo`), sem os de limpeza das tabelas
+FILES = "arquivo LIKE '%:%'"
+
+def _convert(tmp, **options):
+    """Converte os dados de exemplo e retorna o diretório Parquet"""
+    with converter_dirs(tmp):
+        write_month(tmp)
+        import_to_parquet.process_files_to_parquet(**options)
+    return os.path.join(tmp, 'parquet')
+
+def test_load_sqlite():
+    """Testa a carga das tabelas e o registro em importacoes"""
+    print("🗄️  Testando carga no SQLite...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp, partition=True)
+        database = os.path.join(tmp, 'cnpj.sqlite')
+        totals = db_loader.load_database(db_loader.SQLiteBackend(database), parquet_dir)
+        assert totals == {'empresas': 2, 'estabelecimentos': 2, 'cnaes_secundarios': 2}
+
+        conn = sqlite3.connect(database)
+        rows = conn.execute("SELECT cnpj, razao_social, capital_social FROM empresas ORDER BY cnpj").fetchall()
+        assert rows == [('11222333', 'AÇAÍ & CIA', 0), ('41273593', 'PADARIA SÃO JOÃO LTDA', 1000)]
+        rows = conn.execute("SELECT cnpj, cnae_fiscal, email, data_inicio_atividade FROM estabelecimentos "
+                            "ORDER BY cnpj").fetchall()
+        assert rows[1] == ('41273593', '1091102', 'CONTATO@PADARIA.COM', '2021-03-01')
+
+        rows = conn.execute("SELECT cnpj, cnpj_ordem, cnpj_dv FROM cnaes_secundarios "
+                            "WHERE cnae_secundario = '5611203'").fetchall()
+        assert rows == [('41273593', '0001', '50')]
+
+        # Um registro por arquivo Parquet (uma partição por prefixo de CNPJ)
+        imports = conn.execute("SELECT status, registros_importados FROM importacoes WHERE " + FILES +
+                               " AND arquivo NOT LIKE '%cnaes_secundarios%' ORDER BY id").fetchall()
+        assert imports == [('concluida', 1)] * 4
+
+        # Índices e trigger recriados; o trigger ficou desligado durante a carga
+        indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {'idx_empresas_razao_social', 'idx_estabelecimentos_cnpj'} <= indexes
+        triggers = conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall()
+        assert triggers == [('tr_empresas_audit_insert',)]
+        assert conn.execute("SELECT COUNT(*) FROM empresas_audit").fetchone() == (0,)
+        pending = conn.execute("SELECT COUNT(*) FROM logs_importacao WHERE tipo_registro = ?",
+                               (db_loader.DDL_PENDING,)).fetchone()
+        assert pending == (0,)
+        conn.close()
+    print("✅ Tabelas carregadas, índices e triggers recriados")
+
+def test_load_partitioned_by_uf():
+    """Testa a carga de uma tabela particionada por uma coluna dela mesma"""
+    print("\n🗺️  Testando carga particionada por UF...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp, partition=True, partition_by='uf')
+        database = os.path.join(tmp, 'cnpj.sqlite')
+        db_loader.load_database(db_loader.SQLiteBackend(database), parquet_dir, tables=['estabelecimentos'])
+
+        conn = sqlite3.connect(database)
+        rows = conn.execute("SELECT cnpj, uf FROM estabelecimentos ORDER BY cnpj").fetchall()
+        conn.close()
+        assert rows == [('11222333', 'RJ'), ('41273593', 'SP')]
+
+        # Dataset em que a UF está só no nome do diretório (uf=SP/part-0.parquet)
+        table_dir = os.path.join(parquet_dir, 'estabelecimentos')
+        for part in os.listdir(table_dir):
+            file_path = os.path.join(table_dir, part, 'part-0.parquet')
+            pq.write_table(pq.read_table(file_path).drop_columns(['uf']), file_path)
+        db_loader.load_database(db_loader.SQLiteBackend(database), parquet_dir, tables=['estabelecimentos'])
+
+        conn = sqlite3.connect(database)
+        rows = conn.execute("SELECT cnpj, uf FROM estabelecimentos ORDER BY cnpj").fetchall()
+        conn.close()
+        assert rows == [('11222333', 'RJ'), ('41273593', 'SP')]
+    print("✅ UF carregada a partir do dataset particionado")
+
+def test_failed_load_restores_ddl():
+    """Testa que uma carga com erro registra a falha e restaura índices e triggers"""
+    print("\n🧯 Testando falha durante a carga...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp)
+        database = os.path.join(tmp, 'cnpj.sqlite')
+        backend = db_loader.SQLiteBackend(database)
+
+        # Erro do banco no meio da carga (ex: violação de uma restrição)
+        def failing_insert(conn, table, columns, rows):
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: empresas.cnpj")
+        backend.insert_rows = failing_insert
+        assert db_loader.load_database(backend, parquet_dir, tables=['empresas']) == {}
+
+        conn = sqlite3.connect(database)
+        assert conn.execute("SELECT status FROM importacoes WHERE " + FILES).fetchall() == [('erro',)]
+        indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert 'idx_empresas_razao_social' in indexes
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").fetchone() == (1,)
+        conn.close()
+
+        # DDL pendente de uma carga interrompida é restaurada na execução seguinte
+        conn = backend.connect()
+        importacao_id, _, _ = db_loader.start_import(conn, backend, 'interrompida')
+        db_loader.disable_indexes_and_triggers(conn, backend, 'empresas', importacao_id)
+        assert not backend.triggers(conn, 'empresas')
+        db_loader.restore_pending_ddl(conn, backend)
+        assert backend.triggers(conn, 'empresas')
+        assert len(backend.secondary_indexes(conn, 'empresas')) == 2
+        conn.close()
+    print("✅ Falha registrada em importacoes e DDL restaurada")
+
+def test_resume_from_checkpoint():
+    """Testa a retomada de uma carga interrompida a partir do último lote confirmado"""
+    print("\n⏯️  Testando retomada da carga...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp)
+        database = os.path.join(tmp, 'cnpj.sqlite')
+        backend = db_loader.SQLiteBackend(database)
+
+        # Derruba a carga no segundo lote de uma linha
+        insert_rows = backend.insert_rows
+        calls = []
+        def failing_insert(conn, table, columns, rows):
+            calls.append(table)
+            if len(calls) == 2:
+                raise MemoryError("simulação de queda")
+            insert_rows(conn, table, columns, rows)
+        backend.insert_rows = failing_insert
+        assert db_loader.load_database(backend, parquet_dir, tables=['empresas'], batch_size=1) == {}
+
+        conn = sqlite3.connect(database)
+        assert conn.execute("SELECT status, registros_importados FROM importacoes WHERE " + FILES).fetchall() == [('erro', 1)]
+        assert conn.execute("SELECT COUNT(*) FROM empresas").fetchone() == (1,)
+        conn.close()
+
+        # A nova execução grava só a linha que faltava; a seguinte não grava nada
+        backend.insert_rows = insert_rows
+        assert db_loader.load_database(backend, parquet_dir, tables=['empresas'], batch_size=1) == {'empresas': 1}
+        assert db_loader.load_database(backend, parquet_dir, tables=['empresas']) == {'empresas': 0}
+
+        conn = sqlite3.connect(database)
+        assert conn.execute("SELECT status, registros_importados FROM importacoes WHERE " + FILES).fetchall() == [('concluida', 2)]
+        assert conn.execute("SELECT cnpj FROM empresas ORDER BY cnpj").fetchall() == [('11222333',), ('41273593',)]
+        conn.close()
+    print("✅ Carga retomada do checkpoint sem duplicar linhas")
+
+def test_parallel_load():
+    """Testa a carga de várias tabelas em paralelo com pool de conexões"""
+    print("\n🔀 Testando carga paralela...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp, partition=True)
+        database = os.path.join(tmp, 'cnpj.sqlite')
+        totals = db_loader.load_database(db_loader.SQLiteBackend(database), parquet_dir, batch_size=1, workers=2)
+        assert totals == {'empresas': 2, 'estabelecimentos': 2, 'cnaes_secundarios': 2}
+
+        conn = sqlite3.connect(database)
+        # Uma entrada em importacoes por arquivo Parquet
+        assert conn.execute("SELECT COUNT(*), SUM(registros_importados) FROM importacoes "
+                            "WHERE status = 'concluida' AND " + FILES).fetchone() == (5, 6)
+        assert conn.execute("SELECT COUNT(*) FROM estabelecimentos").fetchone() == (2,)
+        conn.close()
+    print("✅ Tabelas carregadas em paralelo, um checkpoint por arquivo")
+
+def test_reload_replaces_rows():
+    """Testa a recarga de um banco já carregado depois de uma nova conversão"""
+    print("\n🔁 Testando recarga com dados alterados...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp)
+        database = os.path.join(tmp, 'cnpj.sqlite')
+        backend = db_loader.SQLiteBackend(database)
+        assert db_loader.load_database(backend, parquet_dir) == {
+            'empresas': 2, 'estabelecimentos': 2, 'cnaes_secundarios': 2}
+
+        # Os mesmos dados gravados de novo não são carregados outra vez
+        with converter_dirs(tmp):
+            import_to_parquet.process_files_to_parquet(force=True)
+        assert db_loader.load_database(backend, parquet_dir) == {
+            'empresas': 0, 'estabelecimentos': 0, 'cnaes_secundarios': 0}
+
+        # Novo mês: capital alterado, uma empresa removida e outra nova
+        empresas = [['41273593', 'PADARIA SÃO JOÃO LTDA', '2062', '49', '5000,00', '01', ''],
+                    ['99888777', 'NOVA EMPRESA SA', '2046', '10', '100,00', '05', '']]
+        estabelecimentos = [ESTABELECIMENTOS[0], ['99888777'] + ESTABELECIMENTOS[1][1:]]
+        with converter_dirs(tmp):
+            write_month(tmp, empresas=empresas, estabelecimentos=estabelecimentos)
+            import_to_parquet.process_files_to_parquet()
+        # cnaes_secundarios não mudou (a nova filial não tem CNAE secundário)
+        assert db_loader.load_database(backend, parquet_dir) == {
+            'empresas': 2, 'estabelecimentos': 2, 'cnaes_secundarios': 0}
+
+        conn = sqlite3.connect(database)
+        rows = conn.execute("SELECT cnpj, capital_social FROM empresas ORDER BY cnpj").fetchall()
+        assert rows == [('41273593', 5000), ('99888777', 100)]
+        rows = conn.execute("SELECT cnpj, cnpj_ordem, cnpj_dv FROM estabelecimentos ORDER BY cnpj").fetchall()
+        assert rows == [('41273593', '0001', '50'), ('99888777', '0001', '81')]
+        assert conn.execute("SELECT COUNT(*) FROM cnaes_secundarios").fetchone() == (2,)
+        conn.close()
+
+        # Volta a uma versão já carregada antes (tipada -> texto -> tipada): carregada de novo
+        for typed in (False, True):
+            with converter_dirs(tmp):
+                import_to_parquet.process_files_to_parquet(typed=typed)
+            assert db_loader.load_database(backend, parquet_dir, tables=['empresas']) == {'empresas': 2}, typed
+            conn = sqlite3.connect(database)
+            assert conn.execute("SELECT COUNT(*) FROM empresas").fetchone() == (2,), typed
+            conn.close()
+    print("✅ Recarga substitui o conteúdo das tabelas")
+
+def test_tsv_escaping():
+    """Testa a formatação dos lotes para o LOAD DATA do MySQL"""
+    print("\n🔤 Testando formatação para LOAD DATA...")
+
+    import io
+    from datetime import date
+    from decimal import Decimal
+    import pyarrow as pa
+    batch = pa.record_batch({
+        'texto': [None, 'A\tB', 'linha\nnova', 'C:\\dir', 'ASPAS "X"'],
+        'data': [None, date(2024, 1, 31), None, None, None],
+        'capital': pa.array([None, Decimal('1000.00'), None, None, None], pa.decimal128(15, 2)),
+        'uf': pa.array([None, 'SP', 'R\tJ', None, None]).dictionary_encode(),
+    })
+    f = io.BytesIO()
+    db_loader.write_tsv(batch, f)
+    assert f.getvalue().decode('utf-8').split('\n') == [
+        '\\N\t\\N\t\\N\t\\N',
+        '"A\\tB"\t2024-01-31\t1000.00\t"SP"',
+        '"linha\\nnova"\t\\N\t\\N\t"R\\tJ"',
+        '"C:\\\\dir"\t\\N\t\\N\t\\N',
+        '"ASPAS ""X"""\t\\N\t\\N\t\\N',
+        '',
+    ]
+    print("✅ Nulos e caracteres especiais escapados")
+
+def test_mysql_index_ddl():
+    """Testa a recriação dos índices do MySQL, inclusive os de prefixo (SUB_PART)"""
+    print("\n🔑 Testando instruções de índices do MySQL...")
+
+    rows = [('idx_nome', 'BTREE', 'razao_social', 20), ('idx_nome', 'BTREE', 'cnpj', None),
+            ('idx_uf', 'BTREE', 'uf', None), ('ft_nome', 'FULLTEXT', 'razao_social', None)]
+    assert db_loader.mysql_index_ddl('empresas', rows) == [
+        ('idx_nome', 'ALTER TABLE `empresas` ADD INDEX `idx_nome` (`razao_social`(20), `cnpj`)'),
+        ('idx_uf', 'ALTER TABLE `empresas` ADD INDEX `idx_uf` (`uf`)'),
+        ('ft_nome', 'ALTER TABLE `empresas` ADD FULLTEXT INDEX `ft_nome` (`razao_social`)'),
+    ]
+    print("✅ Índices de prefixo recriados com o tamanho do prefixo")
+
+def main():
+    """Executa todos os testes"""
+    print("🧪 INICIANDO TESTES DA CARGA NO BANCO\n")
+
+    tests = [
+        ("Carga no SQLite", test_load_sqlite),
+        ("Carga Particionada por UF", test_load_partitioned_by_uf),
+        ("Falha na Carga", test_failed_load_restores_ddl),
+        ("Retomada da Carga", test_resume_from_checkpoint),
+        ("Carga Paralela", test_parallel_load),
+        ("Recarga", test_reload_replaces_rows),
+        ("Formato do LOAD DATA", test_tsv_escaping),
+        ("Índices do MySQL", test_mysql_index_ddl),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"--- Teste: {test_name} ---")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
+        print()
+
+    print("📊 RESULTADO DOS TESTES")
+    print(f"✅ Testes aprovados: {passed}/{len(tests)}")
+    print(f"❌ Testes falharam: {len(tests) - passed}/{len(tests)}")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da conversão para Parquet
+Gera arquivos pequenos no formato da Receita e valida o import_to_parquet
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import aggregates
+import delta
+import import_to_parquet
+from metadata import LAYOUTS
+from parquet_dataset import open_dataset
+from pipeline_state import PipelineState, state_path, TABLE
+
+EMPRESAS = [
+    ['41273593', 'PADARIA SÃO JOÃO LTDA', '2062', '49', '1000,00', '01', ''],
+    ['11222333', 'AÇAÍ & CIA', '2135', '50', '0,00', '05', ''],
+]
+ESTABELECIMENTOS = [
+    ['41273593', '0001', '50', '1', 'PADARIA', '02', '20210301', '00', '', '', '20210301', '1091102',
+     '4721102,5611203', 'RUA', 'DAS FLORES', '10', '', 'CENTRO', '01001000', 'SP', '7107',
+     '11', '30000000', '', '', '', 'CONTATO@PADARIA.COM', '', ''],
+    ['11222333', '0001', '81', '1', '', '08', '20230115', '01', '', '', '20190520', '5611203',
+     '', 'AVENIDA', 'BRASIL', 'S/N', 'LOJA 1', 'JARDIM', '20000000', 'RJ', '6001',
+     '', '', '', '', '', '', '', ''],
+]
+
+def _csv(rows):
+    """Gera o conteúdo latin-1, separado por ';' e com aspas, como nos arquivos da Receita"""
+    lines = [';'.join(f'"{value}"' for value in row) for row in rows]
+    return ('\n'.join(lines) + '\n').encode('latin-1')
+
+@contextmanager
+def converter_dirs(tmp):
+    """Aponta os diretórios do import_to_parquet para uma pasta temporária"""
+    saved = {name: getattr(import_to_parquet, name) for name in ('DOWNLOAD_DIR', 'EXTRACTED_DIR', 'PARQUET_DIR')}
+    import_to_parquet.DOWNLOAD_DIR = os.path.join(tmp, 'downloads')
+    import_to_parquet.EXTRACTED_DIR = os.path.join(tmp, 'extracted')
+    import_to_parquet.PARQUET_DIR = os.path.join(tmp, 'parquet')
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(import_to_parquet, name, value)
+
+def write_month(tmp, month='2024-01', empresas=EMPRESAS, estabelecimentos=ESTABELECIMENTOS):
+    """Grava os ZIPs de um mês em downloads/ e os mesmos dados extraídos em extracted/"""
+    members = {
+        'Empresas0.zip': ('K3241.K03200Y0.D40113.EMPRECSV', _csv(empresas)),
+        'Estabelecimentos0.zip': ('K3241.K03200Y0.D40113.ESTABELE', _csv(estabelecimentos)),
+    }
+    for zip_name, (member, content) in members.items():
+        for directory in ('downloads', 'extracted'):
+            os.makedirs(os.path.join(tmp, directory, month), exist_ok=True)
+        with zipfile.ZipFile(os.path.join(tmp, 'downloads', month, zip_name), 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            zip_ref.writestr(member, content)
+        with open(os.path.join(tmp, 'extracted', month, member), 'wb') as f:
+            f.write(content)
+
+def test_convert_extracted():
+    """Testa a conversão a partir dos arquivos extraídos"""
+    print("📦 Testando conversão de arquivos extraídos...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        write_month(tmp)
+        import_to_parquet.process_files_to_parquet()
+
+        table = pq.read_table(os.path.join(tmp, 'parquet', 'empresas.parquet'))
+        assert table.column_names == LAYOUTS['empresas']
+        assert table.column('razao_social').to_pylist() == ['PADARIA SÃO JOÃO LTDA', 'AÇAÍ & CIA']
+        assert table.column('ente_federativo_responsavel').null_count == 2
+        assert pq.read_metadata(os.path.join(tmp, 'parquet', 'estabelecimentos.parquet')).num_rows == 2
+    print("✅ Conversão de arquivos extraídos concluída")
+
+def test_convert_from_zip():
+    """Testa a conversão lendo os membros dos ZIPs, sem a pasta extracted"""
+    print("\n🗜️  Testando conversão direto dos ZIPs...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        write_month(tmp)
+        import_to_parquet.process_files_to_parquet()
+        expected = pq.read_table(os.path.join(tmp, 'parquet', 'estabelecimentos.parquet'))
+
+        shutil.rmtree(os.path.join(tmp, 'extracted'))
+        shutil.rmtree(os.path.join(tmp, 'parquet'))
+        import_to_parquet.process_files_to_parquet(from_zip=True)
+
+        table = pq.read_table(os.path.join(tmp, 'parquet', 'estabelecimentos.parquet'))
+        assert table.equals(expected)
+    print("✅ Conversão direto dos ZIPs idêntica à dos arquivos extraídos")
+
+class FakeDownloader:
+    """
+    Downloader de teste para convert_while_downloading: entrega os ZIPs já
+    gravados em downloads/<mês>, chamando on_complete como o CNPJDownloader
+    """
+
+    def __init__(self, tmp, month, failures=()):
+        self.tmp = tmp
+        self.month = month
+        self.failures = set(failures)  # ZIPs cujo download sempre falha
+        self.downloads = []
+
+    def get_latest_directory(self):
+        return f'{self.month}/'
+
+    def get_files_from_directory(self, directory):
+        names = sorted(os.listdir(os.path.join(self.tmp, 'downloads', directory)))
+        return [{'name': name, 'url': f'http://teste/{directory}{name}'} for name in names if name.endswith('.zip')]
+
+    def download_files(self, files, directory_name, max_workers=None, on_complete=None):
+        paths = []
+        for file_info in files:
+            self.downloads.append(file_info['name'])
+            path = os.path.join(self.tmp, 'downloads', directory_name, file_info['name'])
+            if file_info['name'] in self.failures or not os.path.exists(path):
+                continue
+            paths.append(path)
+            if on_complete is not None:
+                on_complete(file_info, path)
+        return paths
+
+    def quarantine_file(self, file_path, directory_name, reason):
+        target = os.path.join(self.tmp, 'downloads', '.quarantine', directory_name, os.path.basename(file_path))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(file_path, target)
+        return target
+
+def test_convert_while_downloading():
+    """Testa a conversão de cada ZIP assim que seu download termina, por mês"""
+    print("\n📡 Testando conversão durante o download...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        parquet_dir = os.path.join(tmp, 'parquet')
+        empresas = [['99888777', 'NOVA EMPRESA SA', '2046', '10', '100,00', '05', '']]
+        write_month(tmp, month='2024-02', empresas=empresas)
+        import_to_parquet.convert_while_downloading(downloader=FakeDownloader(tmp, '2024-02'))
+
+        assert sorted(os.listdir(os.path.join(parquet_dir, '2024-02'))) == ['empresas.parquet', 'estabelecimentos.parquet']
+        assert pq.read_table(os.path.join(parquet_dir, 'empresas.parquet')).column('cnpj_basico').to_pylist() == ['99888777']
+        assert pq.read_metadata(os.path.join(parquet_dir, 'cnaes_secundarios.parquet')).num_rows == 2
+        state = PipelineState(state_path(os.path.join(tmp, 'downloads')))
+        assert state.get('2024-02', TABLE, 'empresas')['linhas'] == 1
+
+        # Mês anterior: gravado na sua pasta, sem trocar as tabelas publicadas
+        write_month(tmp, month='2024-01')
+        import_to_parquet.convert_while_downloading('2024-01', downloader=FakeDownloader(tmp, '2024-01'))
+        assert pq.read_metadata(os.path.join(parquet_dir, '2024-01', 'empresas.parquet')).num_rows == 2
+        assert pq.read_table(os.path.join(parquet_dir, 'empresas.parquet')).column('cnpj_basico').to_pylist() == ['99888777']
+        assert not [name for name in os.listdir(os.path.join(parquet_dir, '2024-01')) if name.endswith('.tmp')]
+    print("✅ ZIPs convertidos assim que baixados, na pasta do mês")
+
+def test_convert_while_downloading_failures():
+    """Testa que um ZIP corrompido ou não baixado impede a gravação da sua tabela"""
+    print("\n🧨 Testando ZIP corrompido na conversão durante o download...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        parquet_dir = os.path.join(tmp, 'parquet')
+        write_month(tmp, month='2024-02')
+        import_to_parquet.convert_while_downloading(downloader=FakeDownloader(tmp, '2024-02'))
+
+        # Estabelecimentos de março com CRC inválido
+        empresas = [['99888777', 'NOVA EMPRESA SA', '2046', '10', '100,00', '05', '']]
+        write_month(tmp, month='2024-03', empresas=empresas)
+        zip_path = os.path.join(tmp, 'downloads', '2024-03', 'Estabelecimentos0.zip')
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zip_ref:
+            zip_ref.writestr('K3241.K03200Y0.D40113.ESTABELE', _csv(ESTABELECIMENTOS))
+        with open(zip_path, 'rb') as f:
+            content = f.read()
+        with open(zip_path, 'wb') as f:
+            f.write(content.replace(b'PADARIA', b'PADARIX'))
+        downloader = FakeDownloader(tmp, '2024-03')
+        import_to_parquet.convert_while_downloading(downloader=downloader)
+
+        # Quarentena e nova tentativa; empresas publicada, estabelecimentos mantém fevereiro
+        assert downloader.downloads.count('Estabelecimentos0.zip') == 2
+        assert os.path.exists(os.path.join(tmp, 'downloads', '.quarantine', '2024-03', 'Estabelecimentos0.zip'))
+        assert os.listdir(os.path.join(parquet_dir, '2024-03')) == ['empresas.parquet']
+        assert pq.read_table(os.path.join(parquet_dir, 'empresas.parquet')).column('cnpj_basico').to_pylist() == ['99888777']
+        assert os.stat(os.path.join(parquet_dir, 'estabelecimentos.parquet')).st_ino == \
+            os.stat(os.path.join(parquet_dir, '2024-02', 'estabelecimentos.parquet')).st_ino
+        state = PipelineState(state_path(os.path.join(tmp, 'downloads')))
+        assert state.get('2024-03', TABLE, 'estabelecimentos') is None
+
+        # Download que falha nas duas tentativas: a tabela também não é gravada
+        write_month(tmp, month='2024-04')
+        import_to_parquet.convert_while_downloading(downloader=FakeDownloader(tmp, '2024-04', failures={'Empresas0.zip'}))
+        assert os.listdir(os.path.join(parquet_dir, '2024-04')) == ['estabelecimentos.parquet']
+        assert state.get('2024-04', TABLE, 'empresas') is None
+    print("✅ Tabela com ZIP corrompido ou ausente não é gravada nem publicada")
+
+def test_engines_equivalent():
+    """Testa que os leitores pyarrow e pandas produzem o mesmo Parquet"""
+    print("\n⚙️  Testando equivalência entre engines...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        write_month(tmp)
+        tables = {}
+        for engine in ('pandas', 'pyarrow'):
+            import_to_parquet.process_files_to_parquet(engine=engine, force=True)
+            tables[engine] = pq.read_table(os.path.join(tmp, 'parquet', 'estabelecimentos.parquet'))
+
+        assert tables['pyarrow'].equals(tables['pandas'])
+        assert tables['pyarrow'].column('complemento').to_pylist() == [None, 'LOJA 1']
+    print("✅ Engines pyarrow e pandas equivalentes")
+
+def test_parallel_conversion():
+    """Testa a conversão paralela por arquivo em um pool de processos"""
+    print("\n🚀 Testando conversão paralela...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        write_month(tmp, estabelecimentos=ESTABELECIMENTOS[:1])
+        write_month(tmp, month='2024-02')
+        import_to_parquet.process_files_to_parquet()
+        expected = pq.read_table(os.path.join(tmp, 'parquet', 'estabelecimentos.parquet'))
+
+        import_to_parquet.process_files_to_parquet(workers=2, force=True)
+
+        parquet_dir = os.path.join(tmp, 'parquet')
+        assert not os.path.exists(os.path.join(parquet_dir, 'estabelecimentos.parquet'))
+        assert os.listdir(os.path.join(parquet_dir, 'estabelecimentos')) == ['part-00000.parquet']
+        table = pq.read_table(os.path.join(parquet_dir, 'estabelecimentos'))
+        assert table.num_rows == 2
+        assert table.sort_by('cnpj_basico').equals(expected.sort_by('cnpj_basico'))
+        assert pq.read_table(os.path.join(parquet_dir, '2024-01', 'estabelecimentos')).num_rows == 1
+
+        # Cada processo do pool usa no máximo núcleos/processos threads do Arrow
+        with import_to_parquet.process_pool(2) as executor:
+            assert executor.submit(pa.cpu_count).result() == max(1, (os.cpu_count() or 1) // 2)
+    print("✅ Dataset montado a partir das partes convertidas em paralelo")
+
+def test_typed_columns():
+    """Testa a conversão com datas, decimais, inteiros e códigos em dicionário"""
+    print("\n🔢 Testando colunas tipadas...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        write_month(tmp)
+        import_to_parquet.process_files_to_parquet()
+
+        empresas = pq.read_table(os.path.join(tmp, 'parquet', 'empresas.parquet'))
+        assert empresas.schema.field('capital_social').type == pa.decimal128(15, 2)
+        assert empresas.column('capital_social').to_pylist() == [Decimal('1000.00'), Decimal('0.00')]
+        assert empresas.column('porte_empresa').type == pa.dictionary(pa.int32(), pa.string())
+        assert empresas.column('porte_empresa').to_pylist() == ['01', '05']
+
+        estabelecimentos = pq.read_table(os.path.join(tmp, 'parquet', 'estabelecimentos.parquet'))
+        assert estabelecimentos.column('data_inicio_atividade').to_pylist() == [date(2021, 3, 1), date(2019, 5, 20)]
+        assert estabelecimentos.column('identificador_matriz_filial').type == pa.int8()
+        assert estabelecimentos.column('situacao_cadastral').to_pylist() == ['02', '08']
+        assert estabelecimentos.column('uf').to_pylist() == ['SP', 'RJ']
+
+        # Sentinelas e datas inválidas viram nulo
+        array = pa.array(['20240131', '00000000', '0', '20230231', None])
+        assert import_to_parquet.cast_column(array, 'date').to_pylist() == [date(2024, 1, 31), None, None, None, None]
+
+        # Números que não cabem no tipo viram nulo em vez de interromper a tabela
+        array = pa.array(['300', '127', '-129', '007', 'x'])
+        assert import_to_parquet.cast_column(array, 'int8').to_pylist() == [None, 127, None, 7, None]
+        array = pa.array(['1,234', '99999999999999999,00', '9999999999999,99', '1000,5', '0001000,00'])
+        assert import_to_parquet.cast_column(array, 'decimal(15,2)').to_pylist() == [
+            None, None, Decimal('9999999999999.99'), Decimal('1000.50'), Decimal('1000.00')]
+
+        import_to_parquet.process_files_to_parquet(typed=False)
+        empresas = pq.read_table(os.path.join(tmp, 'parquet', 'empresas.parquet'))
+        assert empresas.column('capital_social').to_pylist() == ['1000,00', '0,00']
+    print("✅ Colunas tipadas conforme metadata.COLUMN_TYPES")
+
+def test_partitioned_output():
+    """Testa a saída particionada, ordenada e com estatísticas por row group"""
+    print("\n🗂️  Testando saída particionada...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        filial = ESTABELECIMENTOS[0][:1] + ['0002', '39'] + ESTABELECIMENTOS[0][3:]
+        write_month(tmp, estabelecimentos=ESTABELECIMENTOS + [filial])
+        import_to_parquet.process_files_to_parquet(partition=True, row_group_size=1)
+
+        table_dir = os.path.join(tmp, 'parquet', 'estabelecimentos')
+        assert not os.path.exists(table_dir + '.parquet')
+        assert sorted(os.listdir(table_dir)) == ['cnpj_prefixo=11', 'cnpj_prefixo=41']
+
+        # Linhas ordenadas por CNPJ e estatísticas min/max em cada row group
+        metadata = pq.read_metadata(os.path.join(table_dir, 'cnpj_prefixo=41', 'part-0.parquet'))
+        assert metadata.num_row_groups == 2
+        column = metadata.schema.to_arrow_schema().get_field_index('cnpj_basico')
+        statistics = metadata.row_group(0).column(column).statistics
+        assert statistics.has_min_max and statistics.min == statistics.max == '41273593'
+
+        dataset = open_dataset(table_dir)
+        assert dataset.count_rows() == 3
+        point = dataset.to_table(filter=ds.field('cnpj_basico') == '11222333')
+        assert point.column('cnpj_prefixo').to_pylist() == ['11']
+
+        import_to_parquet.process_files_to_parquet(partition=True, partition_by='uf')
+        assert sorted(os.listdir(table_dir)) == ['uf=RJ', 'uf=SP']
+
+        # A coluna da tabela continua dentro dos arquivos, como texto, para quem lê arquivo por arquivo
+        part = pq.read_table(os.path.join(table_dir, 'uf=SP', 'part-0.parquet'))
+        assert part.schema.names == LAYOUTS['estabelecimentos']
+        assert set(part.column('uf').to_pylist()) == {'SP'}
+        assert sorted(open_dataset(table_dir).to_table().column('uf').to_pylist()) == ['RJ', 'SP', 'SP']
+
+        # Coluna com valores distintos demais: recusada, a saída anterior fica
+        saved = import_to_parquet.MAX_PARTITIONS
+        import_to_parquet.MAX_PARTITIONS = 1
+        try:
+            import_to_parquet.process_files_to_parquet(partition=True, partition_by='municipio')
+        finally:
+            import_to_parquet.MAX_PARTITIONS = saved
+        assert sorted(os.listdir(table_dir)) == ['uf=RJ', 'uf=SP']
+
+        # Mais partições que o padrão do pyarrow (1024), como municipio
+        table = pa.table({'cnpj_basico': ['41273593'] * 1100, 'cnpj_ordem': ['0001'] * 1100, 'cnpj_dv': ['50'] * 1100,
+                          'municipio': [f'{i:04d}' for i in range(1100)]})
+        pq.write_table(table, os.path.join(tmp, 'parquet', 'estabelecimentos.parquet'))
+        shutil.rmtree(table_dir)
+        assert import_to_parquet.partition_table('estabelecimentos', 'municipio') == 1100
+        assert len(os.listdir(table_dir)) == 1100
+
+        # Partição maior que o limite de ordenação em memória: ordenada por faixas
+        unsorted_dir = os.path.join(tmp, 'unsorted')
+        os.makedirs(unsorted_dir)
+        basicos = ['41273593', None, '11222333', '41273593', '00000001', '99999999', '11222333', None, '50000000']
+        pq.write_table(pa.table({'cnpj_basico': basicos, 'linha': list(range(len(basicos)))}),
+                       os.path.join(unsorted_dir, 'part-0.parquet'))
+        output_path = os.path.join(tmp, 'sorted', 'part-0.parquet')
+        assert import_to_parquet._write_sorted_partition(unsorted_dir, output_path, ['cnpj_basico'], 4, max_rows=2) == 9
+        assert pq.read_table(output_path).column('cnpj_basico').to_pylist() == sorted(
+            filter(None, basicos)) + [None, None]
+    print("✅ Dataset particionado por prefixo do CNPJ e por UF")
+
+def test_monthly_outputs():
+    """Testa a saída por mês, a publicação do mais recente e a reconversão só do que mudou ou falhou"""
+    print("\n📅 Testando conversão por mês e idempotente...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        empresas = [['99888777', 'NOVA EMPRESA SA', '2046', '10', '100,00', '05', '']]
+        write_month(tmp)
+        write_month(tmp, month='2024-02', empresas=empresas)
+        import_to_parquet.process_files_to_parquet()
+
+        parquet_dir = os.path.join(tmp, 'parquet')
+        def path(*parts):
+            return os.path.join(parquet_dir, *parts)
+        # Cada mês na sua pasta; a raiz tem só o mais recente (sem duplicar linhas nem dados)
+        assert pq.read_metadata(path('2024-01', 'empresas.parquet')).num_rows == 2
+        assert pq.read_table(path('empresas.parquet')).column('cnpj_basico').to_pylist() == ['99888777']
+        assert os.stat(path('empresas.parquet')).st_ino == os.stat(path('2024-02', 'empresas.parquet')).st_ino
+        assert sorted(os.listdir(path('2024-02'))) == ['empresas.parquet', 'estabelecimentos.parquet']
+
+        def mtimes():
+            return {name: os.stat(path('2024-02', f'{name}.parquet')).st_mtime_ns
+                    for name in ('empresas', 'estabelecimentos')}
+        before = mtimes()
+        import_to_parquet.process_files_to_parquet()
+        assert mtimes() == before
+
+        # Fontes alteradas e falha em uma tabela: a outra é gravada, a que falhou mantém a saída anterior
+        for name in os.listdir(os.path.join(tmp, 'extracted', '2024-02')):
+            os.utime(os.path.join(tmp, 'extracted', '2024-02', name), ns=(0, 10 ** 18))
+        write_source = import_to_parquet.write_source
+        def failing(source, table_name, *args):
+            if table_name == 'estabelecimentos':
+                raise OSError("disco cheio")
+            return write_source(source, table_name, *args)
+        import_to_parquet.write_source = failing
+        try:
+            import_to_parquet.process_files_to_parquet()
+        finally:
+            import_to_parquet.write_source = write_source
+        after_failure = mtimes()
+        assert after_failure['empresas'] != before['empresas']
+        assert after_failure['estabelecimentos'] == before['estabelecimentos']
+        assert not [name for name in os.listdir(path('2024-02')) if name.endswith('.tmp')]
+
+        # Nova execução refaz só a tabela que falhou
+        import_to_parquet.process_files_to_parquet()
+        rerun = mtimes()
+        assert rerun['empresas'] == after_failure['empresas']
+        assert rerun['estabelecimentos'] != before['estabelecimentos']
+
+        # Falha ao publicar: a tabela não conta como convertida e é publicada na execução seguinte
+        write_month(tmp, month='2024-03')
+        publish_table = import_to_parquet.publish_table
+        def failing_publish(month, table_name):
+            if table_name == 'empresas':
+                raise OSError("disco cheio")
+            return publish_table(month, table_name)
+        import_to_parquet.publish_table = failing_publish
+        try:
+            import_to_parquet.process_files_to_parquet()
+        finally:
+            import_to_parquet.publish_table = publish_table
+        assert pq.read_table(path('empresas.parquet')).column('cnpj_basico').to_pylist() == ['99888777']
+        import_to_parquet.process_files_to_parquet()
+        assert os.stat(path('empresas.parquet')).st_ino == os.stat(path('2024-03', 'empresas.parquet')).st_ino
+    print("✅ Saída por mês, publicação do mais recente e reconversão só do necessário")
+
+def test_month_delta():
+    """Testa o delta entre dois meses: inserções, alterações e remoções"""
+    print("\n🔀 Testando delta entre meses...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Mês seguinte: uma empresa alterada, uma removida e uma nova; chaves
+        # repetidas valem pela última ocorrência
+        empresas = [
+            EMPRESAS[0],
+            ['99888777', 'NOME ANTIGO SA', '2046', '10', '100,00', '05', ''],
+            ['41273593', 'PADARIA SÃO JOÃO LTDA', '2062', '49', '5000,00', '03', ''],
+            ['99888777', 'NOVA EMPRESA SA', '2046', '10', '100,00', '05', ''],
+        ]
+        for month, rows in (('2024-01', EMPRESAS), ('2024-02', empresas)):
+            month_dir = os.path.join(tmp, month)
+            with converter_dirs(month_dir):
+                write_month(month_dir, empresas=rows)
+                import_to_parquet.process_files_to_parquet(partition=month == '2024-02')
+
+        summary = delta.compute_delta(os.path.join(tmp, '2024-01', 'parquet'), os.path.join(tmp, '2024-02', 'parquet'),
+                                      os.path.join(tmp, 'delta'), tables=['empresas', 'estabelecimentos'])
+        assert summary['empresas'] == {'inserted': 1, 'updated': 1, 'deleted': 1}
+        assert summary['estabelecimentos'] == {'inserted': 0, 'updated': 0, 'deleted': 0}
+
+        def cnpjs(kind):
+            return pq.read_table(os.path.join(tmp, 'delta', 'empresas', f'{kind}.parquet')).column('cnpj_basico').to_pylist()
+        assert cnpjs('inserted') == ['99888777']
+        assert cnpjs('updated') == ['41273593']
+        updated = pq.read_table(os.path.join(tmp, 'delta', 'empresas', 'updated.parquet'))
+        assert updated.column('capital_social').to_pylist() == [Decimal('5000.00')]
+        inserted = pq.read_table(os.path.join(tmp, 'delta', 'empresas', 'inserted.parquet'))
+        assert inserted.column('razao_social').to_pylist() == ['NOVA EMPRESA SA']
+        assert cnpjs('deleted') == ['11222333']
+
+        # uf codificada em dicionário (2024-01) ou como texto (partição por uf): mesmos valores, nada alterado
+        # Versões com tipos diferentes (--untyped) não são comparadas: todas as linhas sairiam como alteradas
+        for name, options in (('uf', {'partition': True, 'partition_by': 'uf'}), ('texto', {'typed': False})):
+            month_dir = os.path.join(tmp, name)
+            with converter_dirs(month_dir):
+                write_month(month_dir)
+                import_to_parquet.process_files_to_parquet(**options)
+        summary = delta.compute_delta(os.path.join(tmp, '2024-01', 'parquet'), os.path.join(tmp, 'uf', 'parquet'),
+                                      os.path.join(tmp, 'delta_uf'), tables=['estabelecimentos'])
+        assert summary['estabelecimentos'] == {'inserted': 0, 'updated': 0, 'deleted': 0}
+        try:
+            delta.compute_delta(os.path.join(tmp, '2024-01', 'parquet'), os.path.join(tmp, 'texto', 'parquet'),
+                                os.path.join(tmp, 'delta_texto'), tables=['empresas'])
+            assert False, "versões com tipos diferentes comparadas"
+        except ValueError as e:
+            assert 'capital_social' in str(e)
+    print("✅ Delta com 1 inserção, 1 alteração e 1 remoção")
+
+def test_cnaes_secundarios():
+    """Testa a tabela cnaes_secundarios gerada a partir de cnae_fiscal_secundaria"""
+    print("\n🏷️  Testando CNAEs secundários...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        write_month(tmp)
+        cnaes = [['4721102', 'Padaria e confeitaria'], ['5611203', 'Lanchonetes']]
+        with open(os.path.join(tmp, 'extracted', '2024-01', 'F.K03200$Z.D40113.CNAECSV'), 'wb') as f:
+            f.write(_csv(cnaes))
+        import_to_parquet.process_files_to_parquet(partition=True)
+
+        table = pq.read_table(os.path.join(tmp, 'parquet', 'cnaes_secundarios.parquet'))
+        assert table.to_pylist() == [
+            {'cnpj_basico': '41273593', 'cnpj_ordem': '0001', 'cnpj_dv': '50',
+             'cnae_secundario': '4721102', 'cnae_secundario_descricao': 'Padaria e confeitaria'},
+            {'cnpj_basico': '41273593', 'cnpj_ordem': '0001', 'cnpj_dv': '50',
+             'cnae_secundario': '5611203', 'cnae_secundario_descricao': 'Lanchonetes'},
+        ]
+    print("✅ Um CNAE secundário por linha, com descrição")
+
+def test_aggregates():
+    """Testa os agregados do dashboard calculados ao fim da conversão"""
+    print("\n📈 Testando agregados...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        write_month(tmp)
+        with open(os.path.join(tmp, 'extracted', '2024-01', 'F.K03200$Z.D40113.MUNICCSV'), 'wb') as f:
+            f.write(_csv([['7107', 'SAO PAULO']]))
+        import_to_parquet.process_files_to_parquet(partition=True)
+
+        def read(name):
+            return pq.read_table(os.path.join(tmp, 'parquet', '_aggregates', f'{name}.parquet')).to_pylist()
+        assert read('estabelecimentos_por_uf') == [{'uf': 'RJ', 'total': 1, 'ativos': 0},
+                                                   {'uf': 'SP', 'total': 1, 'ativos': 1}]
+        assert read('estabelecimentos_por_municipio')[1] == {'municipio': '7107', 'uf': 'SP', 'total': 1,
+                                                             'ativos': 1, 'descricao': 'SAO PAULO'}
+        assert [row['mes_inicio_atividade'] for row in read('aberturas_por_mes')] == ['2019-05', '2021-03']
+        assert read('empresas_por_porte') == [{'porte_empresa': '01', 'total': 1}, {'porte_empresa': '05', 'total': 1}]
+
+        summary = {row['tabela']: row['registros'] for row in read('tabelas')}
+        assert summary == {'cnaes_secundarios': 2, 'empresas': 2, 'estabelecimentos': 2, 'municipios': 1}
+
+        # Sem tipos, as datas em texto dão o mesmo agregado por mês
+        import_to_parquet.process_files_to_parquet(typed=False)
+        assert aggregates.compute_aggregates(os.path.join(tmp, 'parquet'), ['aberturas_por_mes']) == {
+            'aberturas_por_mes': pa.Table.from_pylist(read('aberturas_por_mes'))}
+    print("✅ Agregados pequenos gravados em parquet/_aggregates")
+
+def main():
+    """Executa todos os testes"""
+    print("🧪 INICIANDO TESTES DA CONVERSÃO PARA PARQUET\n")
+
+    tests = [
+        ("Arquivos Extraídos", test_convert_extracted),
+        ("Direto dos ZIPs", test_convert_from_zip),
+        ("Conversão Durante o Download", test_convert_while_downloading),
+        ("ZIP Corrompido Durante o Download", test_convert_while_downloading_failures),
+        ("Equivalência de Engines", test_engines_equivalent),
+        ("Conversão Paralela", test_parallel_conversion),
+        ("Colunas Tipadas", test_typed_columns),
+        ("Saída Particionada", test_partitioned_output),
+        ("Saída por Mês", test_monthly_outputs),
+        ("Delta entre Meses", test_month_delta),
+        ("CNAEs Secundários", test_cnaes_secundarios),
+        ("Agregados", test_aggregates),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"--- Teste: {test_name} ---")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
+        print()
+
+    print("📊 RESULTADO DOS TESTES")
+    print(f"✅ Testes aprovados: {passed}/{len(tests)}")
+    print(f"❌ Testes falharam: {len(tests) - passed}/{len(tests)}")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste do manifesto de estado do pipeline
+Registro por etapa, varredura, downloader e conversor usando o manifesto
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import import_to_parquet
+from cnpj_downloader import CNPJDownloader
+from pipeline_state import (PipelineState, state_path, month_of, table_of, zip_fingerprint,
+                            DOWNLOAD, VERIFY, EXTRACT, CONVERT, TABLE, DONE, FAILED)
+from test_downloader import start_local_server, _make_zip
+from test_parquet import converter_dirs, write_month
+
+def test_state_manifest():
+    """Testa o registro, a detecção de mudanças, o resumo e a varredura"""
+    print("📋 Testando o manifesto do pipeline...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_month(tmp)
+        downloads = os.path.join(tmp, 'downloads')
+        state = PipelineState(state_path(downloads))
+        assert not state.exists() and state.files() == [] and state.summary() == {}
+
+        zip_path = os.path.join(downloads, '2024-01', 'Empresas0.zip')
+        assert month_of(zip_path) == '2024-01' and month_of(os.path.join(tmp, 'x.zip')) == ''
+        names = ['Empresas0.zip', 'Socios3.zip', 'Cnaes.zip', 'Naturezas.zip', 'Qualificacoes.zip',
+                 'K3241.K03200Y0.D40113.EMPRECSV', 'leiame.txt']
+        assert [table_of(name) for name in names] == ['empresas', 'socios', 'cnaes', 'naturezas_juridicas',
+                                                      'qualificacoes_socios', 'empresas', None]
+        state.record('2024-01', VERIFY, 'Empresas0.zip', zip_path, checksum=zip_fingerprint(zip_path))
+        assert state.is_done('2024-01', VERIFY, 'Empresas0.zip', zip_path, zip_fingerprint(zip_path))
+        assert not state.is_done('2024-01', VERIFY, 'Empresas0.zip', zip_path, 'zip:outro')
+        assert state.get('2024-01', VERIFY, 'Empresas0.zip')['tamanho'] == os.path.getsize(zip_path)
+
+        # Arquivo alterado em disco deixa de contar como concluído
+        stat = os.stat(zip_path)
+        os.utime(zip_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        assert not state.is_done('2024-01', VERIFY, 'Empresas0.zip', zip_path)
+
+        state.record('2024-01', DOWNLOAD, 'Socios0.zip', status=FAILED, error='timeout')
+        assert not state.is_done('2024-01', DOWNLOAD, 'Socios0.zip')
+
+        # A varredura registra os arquivos existentes, sem o próprio manifesto
+        assert state.scan(downloads, os.path.join(tmp, 'extracted')) == 4
+        summary = state.summary()['2024-01']
+        assert summary[DOWNLOAD]['arquivos'] == 3 and summary[DOWNLOAD]['concluidos'] == 2
+        assert summary[DOWNLOAD]['erros'] == 1 and summary[DOWNLOAD]['bytes'] > 0
+        assert summary[EXTRACT]['concluidos'] == 2
+        assert [row['tabela'] for row in state.files(stage=EXTRACT)] == ['empresas', 'estabelecimentos']
+
+        state.forget(EXTRACT)
+        assert state.files(stage=EXTRACT) == [] and state.files(stage=DOWNLOAD)
+    print("✅ Manifesto registra, resume e detecta mudanças")
+
+def test_downloader_state():
+    """Testa o registro de download, verificação e extração e o salto do que já foi feito"""
+    print("\n📥 Testando o manifesto no downloader...")
+
+    files = {'/2024-01/Empresas0.zip': _make_zip('K3241.EMPRECSV', b'"41273593";"PADARIA"\n' * 100)}
+    server, base_url = start_local_server(files)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            downloader = CNPJDownloader(base_url=base_url, max_requests_per_second=None,
+                                        download_dir=os.path.join(tmp, 'downloads'),
+                                        extract_dir=os.path.join(tmp, 'extracted'))
+            file_list = [{'name': 'Empresas0.zip', 'url': base_url + '2024-01/Empresas0.zip'}]
+            (path,) = downloader.download_verified(file_list, '2024-01/')
+            downloader.extract_file(path, '2024-01/')
+
+            state = downloader.state
+            assert state.is_done('2024-01', DOWNLOAD, 'Empresas0.zip', path)
+            assert state.get('2024-01', VERIFY, 'Empresas0.zip')['checksum'] == zip_fingerprint(path)
+            extracted = state.get('2024-01', EXTRACT, 'K3241.EMPRECSV')
+            assert extracted['status'] == DONE and extracted['origem'] == 'Empresas0.zip'
+
+            # Segunda execução: nada é extraído de novo
+            target = os.path.join(tmp, 'extracted', '2024-01', 'K3241.EMPRECSV')
+            mtime = os.stat(target).st_mtime_ns
+            time.sleep(0.01)
+            assert downloader.download_verified(file_list, '2024-01/') == [path]
+            downloader.extract_file(path, '2024-01/')
+            assert os.stat(target).st_mtime_ns == mtime
+
+            # Arquivo extraído apagado: volta a ser extraído
+            os.remove(target)
+            downloader.extract_file(path, '2024-01/')
+            assert os.path.exists(target)
+        print("✅ Downloader registra as etapas e pula o que já foi feito")
+    finally:
+        server.shutdown()
+
+def test_converter_state():
+    """Testa o conversor lendo as fontes do manifesto e registrando as conversões"""
+    print("\n📦 Testando o manifesto no conversor...")
+
+    with tempfile.TemporaryDirectory() as tmp, converter_dirs(tmp):
+        write_month(tmp)
+        extracted = os.path.join(tmp, 'extracted', '2024-01')
+        state = PipelineState(state_path(os.path.join(tmp, 'downloads')))
+
+        # Sem manifesto: localiza os arquivos com glob
+        assert sorted(import_to_parquet.find_sources()) == ['empresas', 'estabelecimentos']
+
+        # Mês registrado: só os arquivos do manifesto (ex: extração interrompida)
+        member = 'K3241.K03200Y0.D40113.EMPRECSV'
+        state.record('2024-01', EXTRACT, member, os.path.join(extracted, member))
+        assert import_to_parquet.find_sources() == {'empresas': [(os.path.join(extracted, member), None)]}
+
+        # Mês fora do manifesto continua localizado por glob
+        write_month(tmp, month='2024-02')
+        sources = import_to_parquet.find_sources()
+        assert [path for path, _ in sources['estabelecimentos']] == [
+            os.path.join(tmp, 'extracted', '2024-02', 'K3241.K03200Y0.D40113.ESTABELE')]
+
+        import_to_parquet.process_files_to_parquet()
+        converted = state.files(stage=CONVERT)
+        assert [(row['mes'], row['tabela'], row['linhas']) for row in converted] == [
+            ('2024-01', 'empresas', 2), ('2024-02', 'empresas', 2), ('2024-02', 'estabelecimentos', 2)]
+        assert all(row['status'] == DONE for row in converted)
+
+        # Mês registrado apagado à mão: ignorado, sem impedir a conversão do mês novo
+        shutil.rmtree(extracted)
+        write_month(tmp, month='2024-03')
+        os.remove(os.path.join(tmp, 'extracted', '2024-03', member))
+        state.record('2024-03', EXTRACT, member, os.path.join(tmp, 'extracted', '2024-03', member))
+        sources = import_to_parquet.find_sources()
+        assert [os.path.basename(os.path.dirname(path)) for path, _ in sources['empresas']] == ['2024-02']
+        assert [os.path.basename(os.path.dirname(path)) for path, _ in sources['estabelecimentos']] == ['2024-02', '2024-03']
+        import_to_parquet.process_files_to_parquet()
+        assert state.get('2024-03', TABLE, 'estabelecimentos')['linhas'] == 2
+    print("✅ Conversor usa o manifesto e registra as conversões")
+
+def main():
+    """Executa todos os testes"""
+    print("🧪 INICIANDO TESTES DO MANIFESTO DO PIPELINE\n")
+
+    tests = [
+        ("Manifesto", test_state_manifest),
+        ("Downloader", test_downloader_state),
+        ("Conversor", test_converter_state),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"--- Teste: {test_name} ---")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
+        print()
+
+    print("📊 RESULTADO DOS TESTES")
+    print(f"✅ Testes aprovados: {passed}/{len(tests)}")
+    print(f"❌ Testes falharam: {len(tests) - passed}/{len(tests)}")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste das consultas DuckDB
+Converte arquivos pequenos para Parquet e consulta as views do cnpj_query
+"""
+
+import os
+import sys
+import tempfile
+
+import cnpj_query
+import import_to_parquet
+from test_parquet import _csv, converter_dirs, write_month
+
+def _convert(tmp, **options):
+    """Converte os dados de exemplo (com a tabela de municípios) e retorna o diretório Parquet"""
+    with converter_dirs(tmp):
+        write_month(tmp)
+        with open(os.path.join(tmp, 'extracted', '2024-01', 'F.K03200$Z.D40113.MUNICCSV'), 'wb') as f:
+            f.write(_csv([['7107', 'SAO PAULO'], ['6001', 'RIO DE JANEIRO']]))
+        import_to_parquet.process_files_to_parquet(**options)
+    return os.path.join(tmp, 'parquet')
+
+def test_views():
+    """Testa as views equivalentes às do database_schema.sql"""
+    print("🦆 Testando views DuckDB...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_dir = _convert(tmp, partition=True)
+
+        completos = cnpj_query.query("SELECT cnpj, razao_social, municipio_nome, cnae_descricao "
+                                     "FROM vw_estabelecimentos_completos ORDER BY cnpj", parquet_dir=parquet_dir)
+        assert completos.to_dict('records') == [
+            {'cnpj': '11222333000181', 'razao_social': 'AÇAÍ & CIA', 'municipio_nome': 'RIO DE JANEIRO',
+             'cnae_descricao': None},
+            {'cnpj': '41273593000150', 'razao_social': 'PADARIA SÃO JOÃO LTDA', 'municipio_nome': 'SAO PAULO',
+             'cnae_descricao': None},
+        ]
+
+        # Apenas a padaria tem a matriz com situação '02' (ativa)
+        ativas = cnpj_query.query("SELECT cnpj_basico, total_estabelecimentos FROM vw_empresas_ativas",
+                                  parquet_dir=parquet_dir)
+        assert ativas.to_dict('records') == [{'cnpj_basico': '41273593', 'total_estabelecimentos': 1}]
+
+        por_uf = cnpj_query.query("SELECT uf, total_empresas, empresas_ativas FROM vw_estatisticas_uf "
+                                  "WHERE uf = ?", ['SP'], parquet_dir=parquet_dir)
+        assert por_uf.to_dict('records') == [{'uf': 'SP', 'total_empresas': 1, 'empresas_ativas': 1}]
+
+        # Partições continuam texto e tabelas ausentes viram views vazias
+        prefixos = cnpj_query.query("SELECT DISTINCT cnpj_prefixo FROM empresas ORDER BY 1", parquet_dir=parquet_dir)
+        assert prefixos['cnpj_prefixo'].tolist() == ['11', '41']
+        assert cnpj_query.query_command('socios', parquet_dir).empty
+    print("✅ Views consultadas direto dos arquivos Parquet")
+
+def main():
+    """Executa todos os testes"""
+    print("🧪 INICIANDO TESTES DAS CONSULTAS\n")
+
+    tests = [
+        ("Views DuckDB", test_views),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"--- Teste: {test_name} ---")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Falha: {e!r}")
+        print()
+
+    print("📊 RESULTADO DOS TESTES")
+    print(f"✅ Testes aprovados: {passed}/{len(tests)}")
+    print(f"❌ Testes falharam: {len(tests) - passed}/{len(tests)}")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)